@@ -1,11 +1,23 @@
-
 from typing import List, TypedDict, Literal
+import numpy as np
 from .data_types import ClaimDecision, StoryResult
 
+# Integer codes used by the columnar (batch) aggregation API
+LABEL_CODES = {"NONE": 0, "SUPPORT": 1, "CONTRADICT": 2}
+
 class CausalAggregator:
-    def __init__(self):
-        self.core_threshold = 0.8  # Core claim contradiction -> immediate 0
-        self.support_threshold = 2.0 # Threshold for positive prediction if no core contradiction
+    def __init__(self, core_threshold=0.8, support_threshold=2.0, contradiction_ratio=0.5):
+        self.core_threshold = core_threshold  # Core claim contradiction -> immediate 0
+        self.support_threshold = support_threshold # Threshold for positive prediction if no core contradiction
+        self.contradiction_ratio = contradiction_ratio # Contradict score must stay below support * ratio
+
+    def core_contradictions(self, decisions: List[ClaimDecision]) -> List[ClaimDecision]:
+        """Strong contradictions of non-detail claims; any one of them fixes the verdict at 0."""
+        return [
+            d for d in decisions 
+            if d.get("label") == "CONTRADICT" and d.get("confidence", 0.0) >= self.core_threshold
+            and d.get("importance") != "detail"
+        ]
 
     def aggregate(self, decisions: List[ClaimDecision], story_id: str) -> StoryResult:
         """
@@ -17,17 +29,15 @@ class CausalAggregator:
         # Note: We need 'importance' passed through. Assuming ClaimDecision has access or we treat all high-confidence as core for now.
         # Ideally, we verify against claim metadata.
         
-        core_contradictions = [
-            d for d in decisions 
-            if d.get("label") == "CONTRADICT" and d.get("confidence", 0.0) >= self.core_threshold
-        ]
+        core_contradictions = self.core_contradictions(decisions)
         
         if core_contradictions:
             return {
                 "story_id": story_id,
                 "prediction": 0,
                 "rationale": f"Rejected due to {len(core_contradictions)} CORE contradictions. Example: {core_contradictions[0].get('analysis')}",
-                "decisions": decisions
+                "decisions": decisions,
+                "decisive_claim_id": core_contradictions[0].get("claim_id")
             }
 
         # Rule 2: Temporal Weighting & Adversarial Decay
@@ -45,7 +55,7 @@ class CausalAggregator:
 
         # Rule 3: Causal Threshold
         # Contradictions are weighted heavier than support (falsifiability)
-        if contradict_score > support_score * 0.5: # Aggressive contradiction checking
+        if contradict_score > support_score * self.contradiction_ratio: # Aggressive contradiction checking
              prediction = 0
              rationale = "Cumulative contradictions outweigh support signals."
         elif support_score >= self.support_threshold:
@@ -65,6 +75,72 @@ class CausalAggregator:
             "decisions": decisions
         }
 
+    def aggregate_batch(self, story_idx, label_code, confidence, importance=None, n_stories=None) -> dict:
+        """
+        Columnar version of `aggregate` for many stories at once.
+
+        Every argument is a flat array with one entry per claim decision:
+        story_idx (0..n_stories-1), label_code (see LABEL_CODES), confidence and
+        importance (claim weight; rows with importance <= 0 are detail claims and
+        never trigger the core override). Rules are identical to `aggregate`,
+        computed with grouped reductions instead of per-story Python loops.
+        """
+        story_idx = np.asarray(story_idx, dtype=np.int64)
+        label_code = np.asarray(label_code, dtype=np.int8)
+        confidence = np.asarray(confidence, dtype=np.float64)
+        if importance is None:
+            importance = np.ones_like(confidence)
+        importance = np.asarray(importance, dtype=np.float64)
+        if n_stories is None:
+            n_stories = int(story_idx.max()) + 1 if story_idx.size else 0
+
+        is_support = label_code == LABEL_CODES["SUPPORT"]
+        is_contra = label_code == LABEL_CODES["CONTRADICT"]
+
+        # Rule 1: Core Claim Override
+        core_mask = is_contra & (confidence >= self.core_threshold) & (importance > 0)
+        core_count = np.bincount(story_idx, weights=core_mask, minlength=n_stories).astype(np.int64)
+
+        # Rule 2: confidence sums per story
+        support_score = np.bincount(story_idx, weights=confidence * is_support, minlength=n_stories)
+        contradict_score = np.bincount(story_idx, weights=confidence * is_contra, minlength=n_stories)
+
+        # Rule 3: Causal Threshold (everything else defaults to "compatible")
+        rejected = (core_count > 0) | (contradict_score > support_score * self.contradiction_ratio)
+        prediction = np.where(rejected, 0, 1).astype(np.int8)
+
+        return {
+            "prediction": prediction,
+            "core_contradictions": core_count,
+            "score_support": support_score,
+            "score_contradict": contradict_score,
+        }
+
 def aggregate_decisions(decisions: List[ClaimDecision], story_id: str) -> StoryResult:
     aggregator = CausalAggregator()
     return aggregator.aggregate(decisions, story_id)
+
+def decisions_to_columns(decisions_by_story: List[List[ClaimDecision]]) -> dict:
+    """
+    Flattens per-story decision lists into the columns used by `aggregate_batch`.
+    Story i in the input becomes story_idx i.
+    """
+    story_idx, label_code, confidence, importance = [], [], [], []
+    for i, decisions in enumerate(decisions_by_story):
+        for d in decisions:
+            story_idx.append(i)
+            label_code.append(LABEL_CODES.get(d.get("label"), 0))
+            confidence.append(d.get("confidence", 0.0))
+            importance.append(0.0 if d.get("importance") == "detail" else 1.0)
+    return {
+        "story_idx": np.array(story_idx, dtype=np.int64),
+        "label_code": np.array(label_code, dtype=np.int8),
+        "confidence": np.array(confidence, dtype=np.float64),
+        "importance": np.array(importance, dtype=np.float64),
+        "n_stories": len(decisions_by_story),
+    }
+
+def aggregate_batch(columns: dict, aggregator: CausalAggregator = None) -> dict:
+    """Runs the columnar aggregation over the output of `decisions_to_columns`."""
+    aggregator = aggregator or CausalAggregator()
+    return aggregator.aggregate_batch(**columns)
@@ -0,0 +1,265 @@
+"""
+Reproducible end-to-end benchmark on synthetic corpora.
+
+Generates synthetic novels and backstories, then runs indexing, claim
+extraction, retrieval (in-process ChunkIndex, no HTTP), NLI (stub model by
+default) and aggregation, reporting throughput, latency percentiles and
+peak RSS per stage.
+
+Usage:
+    python -m src.benchmark --novels 1 --claims 100
+    python -m src.benchmark --novels 100 --claims 100000 --output results/benchmark.json
+    python -m src.benchmark --baseline results/benchmark.json   # exit 1 on regressions
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .aggregation import aggregate_decisions, aggregate_batch, decisions_to_columns
+from .chunk_index import ChunkIndex
+from .claim_extraction import extract_claims
+from .profiling import PROFILER
+from .fact_table import FactTable
+from . import fact_table, nli_engine, retrieval
+
+CHARS_PER_NOVEL = 200_000
+CLAIMS_PER_STORY = 5
+
+# --- Synthetic corpus ---
+
+_SYLLABLES = ["ka", "lo", "mi", "ter", "van", "dre", "su", "bel", "or", "fa", "ri", "mon", "te", "cri", "sto", "an"]
+_VERBS = ["sailed", "returned", "fought", "escaped", "married", "travelled", "wrote", "lived", "was imprisoned", "met"]
+_FILLER = ["the", "old", "harbour", "letter", "captain", "ship", "prison", "treasure", "storm", "island", "father", "friend"]
+
+def _name(rng):
+    return "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+def _sentence(rng, people, places):
+    return (f"{rng.choice(people)} {rng.choice(_VERBS)} to {rng.choice(places)} in {rng.randint(1750, 1850)} "
+            f"with {rng.choice(people)} and the {rng.choice(_FILLER)} {rng.choice(_FILLER)}.")
+
+def generate_corpus(n_novels: int, n_claims: int, seed: int = 0, chars_per_novel: int = CHARS_PER_NOVEL):
+    """
+    Deterministic synthetic novels [(name, text)] and backstories [(story_id, text)]
+    with roughly n_claims extractable claims in total.
+    """
+    rng = random.Random(seed)
+    people = [_name(rng) for _ in range(200)]
+    places = [_name(rng) for _ in range(80)]
+
+    novels = []
+    for n in range(n_novels):
+        parts, size = [], 0
+        while size < chars_per_novel:
+            sentence = _sentence(rng, people, places)
+            parts.append(sentence)
+            size += len(sentence) + 1
+        novels.append((f"synthetic_novel_{n}.txt", " ".join(parts)))
+
+    stories = []
+    n_stories = max(1, math.ceil(n_claims / CLAIMS_PER_STORY))
+    for s in range(n_stories):
+        count = min(CLAIMS_PER_STORY, n_claims - s * CLAIMS_PER_STORY) or CLAIMS_PER_STORY
+        stories.append((str(s), " ".join(_sentence(rng, people, places) for _ in range(count))))
+    return novels, stories
+
+class StubNLIModel:
+    """
+    Cheap deterministic stand-in for the cross-encoder: lexical overlap drives
+    entailment, negations drive contradiction. Optional per-pair sleep
+    simulates model latency.
+    """
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+
+    def predict(self, pairs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms * len(pairs) / 1000.0)
+        logits = np.zeros((len(pairs), 3))
+        for i, (premise, hypothesis) in enumerate(pairs):
+            p_words = set(premise.lower().split())
+            h_words = hypothesis.lower().split()
+            overlap = sum(w in p_words for w in h_words) / max(len(h_words), 1)
+            logits[i] = [2.0 * ("not" in p_words or "never" in p_words), 4.0 * overlap, 1.0]
+        return logits
+
+# --- Measurement helpers ---
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def _stage_stats(latencies: list, items: int, total: float) -> dict:
+    """Throughput plus per-item latency percentiles (None for one-shot stages)."""
+    lat_ms = np.array(latencies) * 1000
+    pct = lambda q: float(np.percentile(lat_ms, q)) if len(lat_ms) else None
+    return {
+        "items": items,
+        "total_seconds": total,
+        "throughput_per_s": items / total if total > 0 else 0.0,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def _timed_loop(func, items):
+    outputs, latencies = [], []
+    start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        outputs.append(func(item))
+        latencies.append(time.perf_counter() - t0)
+    return outputs, latencies, time.perf_counter() - start
+
+# --- Benchmark ---
+
+def run_benchmark(n_novels: int = 1, n_claims: int = 100, seed: int = 0, real_nli: bool = False,
+                  stub_latency_ms: float = 0.0, chars_per_novel: int = CHARS_PER_NOVEL,
+                  verbose: bool = False, symbolic: bool = False) -> dict:
+    report = {"config": {"novels": n_novels, "claims": n_claims, "seed": seed, "real_nli": real_nli,
+                         "chars_per_novel": chars_per_novel, "symbolic": symbolic}}
+    stages = {}
+    PROFILER.reset()
+
+    novels, stories = generate_corpus(n_novels, n_claims, seed, chars_per_novel)
+
+    # Pipeline modules print per item; keep the benchmark output readable
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        # 1. Indexing
+        start = time.perf_counter()
+        index = ChunkIndex()
+        for name, text in novels:
+            index.add_document(text, name)
+        index.build()
+        stages["indexing"] = _stage_stats([], len(index), time.perf_counter() - start)
+
+        # Every synthetic claim carries a year, so the symbolic path would bypass NLI entirely:
+        # it is opt-in to keep the nli stage comparable with earlier baselines
+        facts = FactTable()
+        if symbolic:
+            start = time.perf_counter()
+            facts = FactTable.from_index(index)
+            stages["fact_table"] = _stage_stats([], len(facts), time.perf_counter() - start)
+
+        # 2. Claim extraction
+        claims_per_story, lat, total = _timed_loop(lambda s: extract_claims(s[1], s[0]), stories)
+        all_claims = [c for claims in claims_per_story for c in claims]
+        stages["extraction"] = _stage_stats(lat, len(all_claims), total)
+
+        # 3. Retrieval (in-process, same code path as the HTTP client minus the socket)
+        previous_index = retrieval._local_index
+        retrieval.use_local_index(index)
+        try:
+            evidence, lat, total = _timed_loop(lambda c: retrieval.retrieve_evidence(c, c["story_id"]), all_claims)
+        finally:
+            retrieval.use_local_index(previous_index)
+        evidence_map = {c["id"]: ev for c, ev in zip(all_claims, evidence)}
+        stages["retrieval"] = _stage_stats(lat, len(all_claims), total)
+
+        # 4. NLI reasoning
+        from .reasoning_llm import reason_about_all_claims
+        previous_model, previous_facts = nli_engine._model_instance, fact_table._fact_table
+        if not real_nli:
+            nli_engine.set_nli_model(StubNLIModel(stub_latency_ms))
+        fact_table.use_fact_table(facts)
+        try:
+            # Synthetic stories draw on every novel; each is checked against one of them
+            def reason(claims):
+                book_file = novels[int(claims[0]["story_id"]) % len(novels)][0] if claims else None
+                return reason_about_all_claims(claims, evidence_map, book_file, symbolic=symbolic)
+            decisions_per_story, lat, total = _timed_loop(reason, claims_per_story)
+        finally:
+            nli_engine.set_nli_model(previous_model)
+            fact_table.use_fact_table(previous_facts)
+        stages["nli"] = _stage_stats(lat, len(all_claims), total)
+        stages["nli"]["pairs_scored"] = PROFILER.counters.get("nli.pairs_scored", 0)
+        stages["nli"]["symbolic_resolved"] = PROFILER.counters.get("reasoning.symbolic_resolved", 0)
+
+        # 5. Aggregation (per story, then the columnar batch path)
+        _, lat, total = _timed_loop(lambda d: aggregate_decisions(d, ""), decisions_per_story)
+        stages["aggregation"] = _stage_stats(lat, len(stories), total)
+
+        start = time.perf_counter()
+        aggregate_batch(decisions_to_columns(decisions_per_story))
+        stages["aggregation_batch"] = _stage_stats([], len(stories), time.perf_counter() - start)
+
+    report["stages"] = stages
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+def find_regressions(report: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """Stages whose throughput dropped by more than `tolerance` versus the baseline."""
+    regressions = []
+    for name, base in baseline.get("stages", {}).items():
+        current = report["stages"].get(name)
+        if not current or base["throughput_per_s"] <= 0:
+            continue
+        ratio = current["throughput_per_s"] / base["throughput_per_s"]
+        if ratio < 1.0 - tolerance:
+            regressions.append(f"{name}: {current['throughput_per_s']:.1f}/s vs baseline "
+                               f"{base['throughput_per_s']:.1f}/s ({ratio:.0%})")
+    return regressions
+
+def print_report(report: dict):
+    print(f"[Benchmark] {report['config']}")
+    print(f"  {'stage':<18} {'items':>8} {'total s':>9} {'items/s':>11} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    fmt = lambda v: f"{v:>9.3f}" if v is not None else f"{'-':>9}"
+    for name, st in report["stages"].items():
+        print(f"  {name:<18} {st['items']:>8} {st['total_seconds']:>9.3f} {st['throughput_per_s']:>11.1f} "
+              f"{fmt(st['p50_ms'])} {fmt(st['p95_ms'])} {fmt(st['p99_ms'])}")
+    if report["peak_rss_mb"] is not None:
+        print(f"  peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark on synthetic corpora.")
+    parser.add_argument("--novels", type=int, default=1, help="Number of synthetic novels (1-100)")
+    parser.add_argument("--claims", type=int, default=100, help="Total backstory claims (100-100000)")
+    parser.add_argument("--chars-per-novel", type=int, default=CHARS_PER_NOVEL)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--real-nli", action="store_true", help="Use the DeBERTa cross-encoder instead of the stub")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="Simulated per-pair stub latency")
+    parser.add_argument("--symbolic", action="store_true", help="Enable the fact-table pre-check before NLI")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Compare throughput against a previous JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop vs baseline")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline logging")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.novels, args.claims, args.seed, args.real_nli,
+                           args.stub_latency_ms, args.chars_per_novel, args.verbose, args.symbolic)
+    print_report(report)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[Benchmark] Report saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        if regressions:
+            print("[Benchmark] REGRESSIONS:")
+            for r in regressions:
+                print(f"  {r}")
+            sys.exit(1)
+        print("[Benchmark] No regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+In-process BM25 chunk index over the novels.
+
+Backs the fallback retrieval server (pathway_pipeline) and can be queried
+directly by `retrieval` / the benchmark suite without an HTTP round trip.
+"""
+from pathlib import Path
+import fnmatch
+import hashlib
+import numpy as np
+
+from .config import NOVELS_DIR
+from .text_analyzer import Analyzer
+
+# Fallback chunking: characters, not tokens
+CHUNK_SIZE_CHARS = 1000
+CHUNK_OVERLAP_CHARS = 200
+# The fallback server has always answered with a fixed top 5
+FALLBACK_TOP_K = 5
+# Okapi BM25 parameters (same defaults as rank_bm25)
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Positional boosts (query time)
+PHRASE_BOOST = 1.0 # x summed idf of the phrase terms, per chunk containing the exact phrase
+PROXIMITY_BOOST = 0.3 # x mean idf / distance, for query term pairs within the window
+PROXIMITY_WINDOW = 5 # terms
+PROXIMITY_CANDIDATES = 50 # Top BM25 chunks re-scored for proximity
+_POSITION_SPAN = 2 ** 20 # Key stride per chunk in the flattened (chunk, position) keys
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_CHARS, overlap: int = CHUNK_OVERLAP_CHARS) -> list:
+    """Sliding window chunks as [(char_offset, chunk_text)]."""
+    return [(i, text[i:i + chunk_size]) for i in range(0, len(text), chunk_size - overlap)]
+
+def corpus_fingerprint(novels_dir=NOVELS_DIR) -> str:
+    """Short version id of the indexed corpus (file names, sizes, mtimes + chunking)."""
+    h = hashlib.sha1(f"{CHUNK_SIZE_CHARS}:{CHUNK_OVERLAP_CHARS}".encode())
+    for path in sorted(Path(novels_dir).glob("*.txt")):
+        stat = path.stat()
+        h.update(f"|{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return h.hexdigest()[:12]
+
+class ChunkIndex:
+    """
+    BM25 over an inverted index: per term id, the ids of the chunks containing
+    it and the term frequencies (numpy arrays). Index and queries share one
+    Analyzer, so scoring only touches the postings of the query's terms.
+
+    Term positions are kept per posting as delta-encoded uint16 arrays
+    (uint32 if a gap does not fit) for phrase and proximity boosting.
+    """
+    def __init__(self, analyzer: Analyzer = None):
+        self.analyzer = analyzer or Analyzer()
+        self.chunks = []     # chunk texts
+        self.metadata = []   # {"source", "file", "chunk_id", "char_offset"} per chunk
+        self.postings = {}   # term id -> (chunk ids int32, term freqs float32)
+        self.positions = {}  # term id -> (offsets int32 [n_postings + 1], position deltas)
+        self.idf = {}        # term id -> idf
+        self.doc_len = None
+        self._terms = []     # analyzed term ids per chunk, until build()
+
+    def add_document(self, text: str, source: str):
+        for offset, chunk in chunk_text(text):
+            self.metadata.append({
+                "source": "BM25_Fallback",
+                "file": source,
+                "chunk_id": f"{source}#{offset}", # Stable across rebuilds
+                "char_offset": offset,
+            })
+            self.chunks.append(chunk)
+            self._terms.append(self.analyzer.term_ids(chunk, add=True))
+
+    def build(self):
+        """Builds postings and BM25 statistics. Call once after all documents are added."""
+        postings = {}
+        for doc_id, term_ids in enumerate(self._terms):
+            positions = {}
+            for pos, tid in enumerate(term_ids):
+                positions.setdefault(tid, []).append(pos)
+            for tid, pos_list in positions.items():
+                postings.setdefault(tid, ([], []))
+                postings[tid][0].append(doc_id)
+                postings[tid][1].append(pos_list)
+
+        n_docs = len(self.chunks)
+        self.doc_len = np.array([len(t) for t in self._terms], dtype=np.float32)
+        self.avgdl = float(self.doc_len.mean()) if n_docs else 0.0
+        self.postings, self.positions = {}, {}
+        for tid, (docs, pos_lists) in postings.items():
+            tfs = np.array([len(p) for p in pos_lists], dtype=np.float32)
+            self.postings[tid] = (np.array(docs, dtype=np.int32), tfs)
+            offsets = np.zeros(len(pos_lists) + 1, dtype=np.int32)
+            offsets[1:] = np.cumsum([len(p) for p in pos_lists])
+            # Gaps restart at each posting, so a posting decodes with one cumsum
+            deltas = np.concatenate([np.diff(p, prepend=0) for p in pos_lists])
+            dtype = np.uint16 if deltas.max(initial=0) < 2 ** 16 else np.uint32
+            self.positions[tid] = (offsets, deltas.astype(dtype))
+        # Lucene-style idf: always positive, unlike raw Okapi idf for very common terms
+        self.idf = {tid: float(np.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5)))
+                    for tid, (docs, _) in self.postings.items()}
+        self._terms = []
+        return self
+
+    def _position_keys(self, tid: int) -> np.ndarray:
+        """
+        All occurrences of a term as sorted keys chunk_id * 2**20 + position,
+        decoded with one cumsum over the whole delta array.
+        """
+        docs, tfs = self.postings[tid]
+        offsets, deltas = self.positions[tid]
+        running = np.cumsum(deltas, dtype=np.int64)
+        # Subtract the running total reached before each posting (gaps restart per posting)
+        before = np.concatenate(([0], running[offsets[1:-1] - 1]))
+        positions = running - np.repeat(before, tfs.astype(np.int64))
+        return np.repeat(docs.astype(np.int64), tfs.astype(np.int64)) * _POSITION_SPAN + positions
+
+    def _phrase_boost(self, phrase: list, keys: dict, scores: np.ndarray):
+        """Adds PHRASE_BOOST to chunks containing the exact term sequence."""
+        starts = keys[phrase[0]]
+        for shift, tid in enumerate(phrase[1:], start=1):
+            starts = starts[np.isin(starts + shift, keys[tid], assume_unique=True)]
+            if not len(starts):
+                return
+        counts = np.bincount(starts // _POSITION_SPAN, minlength=len(scores))
+        weight = PHRASE_BOOST * sum(self.idf[t] for t in phrase)
+        # Saturating in the number of occurrences, like tf
+        scores += (weight * counts / (counts + 1.0)).astype(scores.dtype)
+
+    def _proximity_boost(self, term_ids: list, keys: dict, scores: np.ndarray):
+        """Rewards query term pairs that occur close together in the top BM25 candidates."""
+        pairs = [(a, b) for a, b in zip(term_ids, term_ids[1:]) if a != b]
+        if not pairs:
+            return
+        top = np.argsort(scores)[::-1][:PROXIMITY_CANDIDATES]
+        candidate = np.zeros(len(scores), dtype=bool)
+        candidate[top[scores[top] > 0]] = True
+        bonus = np.zeros(len(scores), dtype=np.float64)
+        for a, b in pairs:
+            ka = keys[a][candidate[keys[a] // _POSITION_SPAN]]
+            kb = keys[b][candidate[keys[b] // _POSITION_SPAN]]
+            if not len(ka) or not len(kb):
+                continue
+            # Nearest occurrence of a for every occurrence of b (other chunks are >= the span away)
+            idx = np.searchsorted(ka, kb)
+            dist = np.minimum(np.abs(kb - ka[np.clip(idx - 1, 0, len(ka) - 1)]),
+                              np.abs(ka[np.clip(idx, 0, len(ka) - 1)] - kb))
+            nearest = np.full(len(scores), np.iinfo(np.int64).max)
+            np.minimum.at(nearest, kb // _POSITION_SPAN, dist)
+            close = (nearest > 0) & (nearest <= PROXIMITY_WINDOW)
+            bonus[close] += PROXIMITY_BOOST * (self.idf[a] + self.idf[b]) / 2 / nearest[close]
+        scores += bonus.astype(scores.dtype)
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """BM25 score of every chunk for a query."""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        if not self.postings:
+            return scores
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len / max(self.avgdl, 1e-9))
+        term_ids = self.analyzer.term_ids(query)
+        for tid in term_ids:
+            docs, tfs = self.postings[tid]
+            scores[docs] += self.idf[tid] * tfs * (BM25_K1 + 1) / (tfs + norm[docs])
+        # Positional boosts: exact multi-word names, then nearby query terms
+        phrases = self.analyzer.phrases(query)
+        keys = {tid: self._position_keys(tid) for tid in set(term_ids).union(*phrases)}
+        for phrase in phrases:
+            self._phrase_boost(phrase, keys, scores)
+        self._proximity_boost(term_ids, keys, scores)
+        return scores
+
+    @classmethod
+    def from_dir(cls, novels_dir=NOVELS_DIR):
+        index = cls()
+        for file_path in sorted(Path(novels_dir).glob("*.txt")):
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    index.add_document(f.read(), file_path.name)
+            except Exception as e:
+                print(f"Error reading {file_path}: {e}")
+        return index.build()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query: str, k: int = FALLBACK_TOP_K, file_glob: str = None) -> list:
+        """
+        Top-k chunks for a query in the /v1/retrieve response format.
+        file_glob restricts the search to matching novel files (e.g. one book).
+        """
+        if not self.postings:
+            return []
+        scores = self.get_scores(query)
+        if file_glob:
+            allowed = np.array([fnmatch.fnmatch(m["file"], file_glob) for m in self.metadata])
+            if not allowed.any():
+                return []
+            scores = np.where(allowed, scores, -np.inf)
+            k = min(k, int(allowed.sum()))
+        top = np.argsort(scores)[::-1][:k]
+        return [
+            {
+                "text": self.chunks[i],
+                "score": 0.8, # Dummy score, rank implies quality
+                "metadata": {**self.metadata[i], "bm25": float(scores[i])},
+            }
+            for i in top
+        ]
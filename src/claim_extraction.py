@@ -1,30 +1,143 @@
-
 import re
 import json
 
-def extract_claims(backstory_text: str, story_id: str) -> list[dict]:
+from .query_planner import adversarial_queries
+
+# Rule-based segmentation: sentences, then clauses
+SENTENCE_SPLIT_RE = r'(?<=[.!?])\s+'
+# Semicolons always split; ", and/but/while..." only when a subject-led clause of 3+ words follows
+CLAUSE_SPLIT_RE = (r'\s*;\s*|,\s+(?:and|but|while|whereas|yet|so|although)\s+'
+                   r'(?=(?:[Hh]e|[Ss]he|[Tt]hey|[Hh]is|[Hh]er|[Tt]heir|[A-Z]\w*)\s+\S+\s+\S+)')
+# Pronoun-led clauses are rewritten to name the backstory's character
+SUBJECT_PRONOUN_RE = r'^(?:[Hh]e|[Ss]he)\b'
+POSSESSIVE_PRONOUN_RE = r'^(?:[Hh]is|[Hh]er)\b'
+MIN_CLAIM_CHARS = 10 # Ignore short noise
+DEDUP_JACCARD = 0.8 # Token overlap above which a claim is a near-duplicate
+# Numbers and dates: claims that differ in one (1814 vs 1815) are never duplicates
+QUANTITY_TOKEN_RE = (r'\b(?:\d+(?:[.,]\d+)*(?:st|nd|rd|th)?|one|two|three|four|five|six|seven|eight|nine|ten|'
+                     r'eleven|twelve|twenty|thirty|forty|fifty|hundred|thousand|first|second|third|'
+                     r'january|february|march|april|may|june|july|august|september|october|november|december)\b')
+
+# Claim tagging cues (case-insensitive)
+BELIEF_RE = r'\b(?:believ\w*|thought|felt|feels?|hoped?|feared?|wish\w*|wanted|dream\w*|suspect\w*|trust\w*|doubt\w*|convinced)\b'
+# Dated facts and life events decide consistency
+CORE_EVENT_RE = (r'\b(?:1[5-9]\d\d|born|died|death|killed|murder\w*|married|marri\w*|arrest\w*|imprison\w*|prison|'
+                 r'escap\w*|fled|exiled?|betray\w*|joined|captured|rescued|inherit\w*|father|mother|son|daughter|'
+                 r'wife|husband|brother|sister)\b')
+# Habits, looks and tastes rarely decide it
+DETAIL_RE = r'\b(?:often|sometimes|usually|always|liked|loved|enjoyed|favou?rite|wore|dressed|habit\w*|fond|hobby|tall|short)\b'
+
+def resolve_pronoun(clause: str, char: str = None) -> str:
+    """Replaces a leading he/she (his/her) with the character's name (possessive)."""
+    if not char:
+        return clause
+    if re.match(POSSESSIVE_PRONOUN_RE, clause):
+        return re.sub(POSSESSIVE_PRONOUN_RE, f"{char}'s", clause, count=1)
+    return re.sub(SUBJECT_PRONOUN_RE, char, clause, count=1)
+
+def segment(backstory_text: str, char: str = None) -> list:
+    """Atomic clause texts of a backstory (before dedup)."""
+    clauses = []
+    for sent in re.split(SENTENCE_SPLIT_RE, backstory_text):
+        for clause in re.split(CLAUSE_SPLIT_RE, sent.strip()):
+            clause = clause.strip()
+            if len(clause) > MIN_CLAIM_CHARS:
+                clauses.append(resolve_pronoun(clause, char))
+    return clauses
+
+def classify_claim(text: str) -> tuple:
+    """
+    Fast rule-based tagging: (type, importance) with type event|belief and
+    importance core|detail. Beliefs and descriptive claims are details unless
+    they carry a date or a life event.
+    """
+    is_belief = re.search(BELIEF_RE, text, re.IGNORECASE) is not None
+    is_event = re.search(CORE_EVENT_RE, text, re.IGNORECASE) is not None
+    is_detail = re.search(DETAIL_RE, text, re.IGNORECASE) is not None
+    importance = "core" if is_event or not (is_belief or is_detail) else "detail"
+    return ("belief" if is_belief else "event"), importance
+
+def _tokens(text: str) -> frozenset:
+    return frozenset(re.findall(r"\w+", text.lower()))
+
+def _quantities(text: str) -> tuple:
+    return tuple(re.findall(QUANTITY_TOKEN_RE, text.lower()))
+
+def dedup_claims(texts: list, threshold: float = DEDUP_JACCARD) -> list:
+    """
+    Drops near-duplicate claims (token Jaccard >= threshold and the same
+    numbers and dates, in order), keeping the first.
     """
-    Extracts claims using local sentence splitting.
+    kept, kept_keys = [], []
+    for text in texts:
+        tokens, quantities = _tokens(text), _quantities(text)
+        if any(q == quantities and len(tokens & t) / max(len(tokens | t), 1) >= threshold
+               for t, q in kept_keys):
+            continue
+        kept.append(text)
+        kept_keys.append((tokens, quantities))
+    return kept
+
+def _make_claims(texts: list, story_id: str, tags: list = None) -> list[dict]:
+    tags = tags or [classify_claim(text) for text in texts]
+    return [
+        {
+            "id": f"{story_id}_C{i}",
+            "story_id": story_id,
+            "text": text,
+            "type": claim_type,
+            "importance": importance,
+            "adversarial_queries": adversarial_queries(text)
+        }
+        for i, (text, (claim_type, importance)) in enumerate(zip(texts, tags))
+    ]
+
+def extract_claims(backstory_text: str, story_id: str, char: str = None) -> list[dict]:
+    """
+    Extracts claims using local sentence + clause splitting.
+    Pronoun-led clauses are attributed to `char`; near-duplicates are dropped.
     Fast, Free, No Rate Limits.
     """
-    # Simple semantic splitting by punctuation (., !, ?)
-    sentences = re.split(r'(?<=[.!?])\s+', backstory_text)
-    
-    claims = []
-    for i, sent in enumerate(sentences):
-        sent = sent.strip()
-        if len(sent) > 10: # Ignore short noise
-            # Generate simple adversarial queries locally
-            adversarial_queries = [
-                f"it is false that {sent}",
-                f"contradiction: {sent}" 
-            ]
-            
-            claims.append({
-                "id": f"{story_id}_C{i}",
-                "story_id": story_id,
-                "text": sent,
-                "adversarial_queries": adversarial_queries
-            })
-            
+    return _make_claims(dedup_claims(segment(backstory_text, char)), story_id)
+
+def extract_claims_frame(df, text_col: str = "content", id_col: str = "id", char_col: str = "char") -> dict:
+    """
+    Vectorized `extract_claims` over a whole CSV frame.
+    Returns {story_id: [Claim]} with the same claims as the per-story function.
+    """
+    import pandas as pd
+
+    ids = df[id_col].astype(str) if id_col in df else df.index.astype(str).to_series(index=df.index)
+    chars = df[char_col].fillna("").astype(str) if char_col in df else pd.Series("", index=df.index)
+    frame = pd.DataFrame({"story_id": ids, "char": chars, "text": df[text_col].fillna("").astype(str)})
+
+    # Sentences, then clauses, one row each
+    frame["text"] = frame["text"].str.split(SENTENCE_SPLIT_RE, regex=True)
+    frame = frame.explode("text")
+    frame["text"] = frame["text"].str.strip().str.split(CLAUSE_SPLIT_RE, regex=True)
+    frame = frame.explode("text")
+    frame["text"] = frame["text"].str.strip()
+    frame = frame[frame["text"].str.len() > MIN_CLAIM_CHARS]
+
+    # Coreference: leading pronoun -> character name
+    has_char = frame["char"] != ""
+    possessive = has_char & frame["text"].str.match(POSSESSIVE_PRONOUN_RE)
+    subject = has_char & ~possessive & frame["text"].str.match(SUBJECT_PRONOUN_RE)
+    frame.loc[possessive, "text"] = (frame.loc[possessive, "char"] + "'s"
+                                     + frame.loc[possessive, "text"].str.replace(POSSESSIVE_PRONOUN_RE, "", regex=True))
+    frame.loc[subject, "text"] = (frame.loc[subject, "char"]
+                                  + frame.loc[subject, "text"].str.replace(SUBJECT_PRONOUN_RE, "", regex=True))
+
+    # Tagging (same rules as classify_claim)
+    is_belief = frame["text"].str.contains(BELIEF_RE, case=False, regex=True)
+    is_event = frame["text"].str.contains(CORE_EVENT_RE, case=False, regex=True)
+    is_detail = frame["text"].str.contains(DETAIL_RE, case=False, regex=True)
+    frame["tag"] = list(zip(is_belief.map({True: "belief", False: "event"}),
+                            (is_event | ~(is_belief | is_detail)).map({True: "core", False: "detail"})))
+
+    claims = {sid: [] for sid in ids}
+    for sid, group in frame.groupby("story_id", sort=False):
+        texts = dedup_claims(group["text"].tolist())
+        tag_of = dict(zip(group["text"], group["tag"]))
+        claims[sid] = _make_claims(texts, sid, [tag_of[t] for t in texts])
     return claims
@@ -2,22 +2,19 @@
 # Configuration for KDSH 2026 Track A
 
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Load environment variables from .env file (for local development)
 load_dotenv()
 
-# Try to import streamlit for cloud deployment
-try:
-    import streamlit as st
-    HAS_STREAMLIT = True
-except ImportError:
-    HAS_STREAMLIT = False
-
 def get_secret(key, default=""):
     """Get secret from Streamlit secrets (cloud) or environment variable (local)"""
-    if HAS_STREAMLIT:
+    # Only consult st.secrets when running inside Streamlit (already imported);
+    # importing it here would slow down every CLI entry point.
+    st = sys.modules.get("streamlit")
+    if st is not None:
         try:
             value = st.secrets.get(key, os.getenv(key, default))
             # Convert to string to handle boolean values from TOML
@@ -38,10 +35,16 @@ TEST_CSV = DATA_DIR / "test.csv"
 
 CHUNKS_DIR = PROCESSED_DATA_DIR / "chunks"
 CLAIMS_DIR = PROCESSED_DATA_DIR / "claims"
-DOSSIERS_DIR = PROCESSED_DATA_DIR / "dossiers"
+DOSSIERS_DIR = PROCESSED_DATA_DIR / "dossiers" # Legacy one-JSON-per-story dossiers (read-only)
+DOSSIER_STORE_DIR = PROCESSED_DATA_DIR / "dossier_store" # Indexed, compressed dossier store
+NLI_CACHE_PATH = PROCESSED_DATA_DIR / "nli_probabilities.npz" # Raw NLI probs for threshold tuning
+TOKEN_CACHE_DIR = PROCESSED_DATA_DIR / "token_cache" # Pre-tokenized chunks per tokenizer version
+STAGE_CACHE_DIR = PROCESSED_DATA_DIR / "stage_cache" # Per-stage outputs keyed by input/config fingerprints
 
 RESULTS_DIR = BASE_DIR / "results"
 RESULTS_CSV = RESULTS_DIR / "results.csv"
+PROFILE_REPORT_JSON = RESULTS_DIR / "profile_report.json" # Stage timings (aggregate + per story)
+PROFILE_REPORT_CSV = RESULTS_DIR / "profile_stories.csv"
 
 # Pathway Configuration
 PATHWAY_LICENSE_KEY = get_secret("PATHWAY_LICENSE_KEY", "")
@@ -58,6 +61,49 @@ CHUNK_SIZE = 1000 # tokens roughly
 CHUNK_OVERLAP = 200
 RETRIEVAL_K = 10
 
+# Detail claims (see claim_extraction.classify_claim) get a shallow check
+DETAIL_RETRIEVAL_K = 5 # Evidence kept per detail claim (claim text query only)
+DETAIL_NLI_EVIDENCE = 3 # Top excerpts scored by NLI per detail claim
+
+# Symbolic pre-check (fact table of years/quantities/places) before NLI (opt-in)
+SYMBOLIC_CHECK = get_secret("SYMBOLIC_CHECK", "False").lower() in ("true", "1", "yes")
+SYMBOLIC_SUPPORT_CONFIDENCE = 0.85
+SYMBOLIC_CONTRADICT_CONFIDENCE = 0.75 # Below the aggregator's core threshold (0.8): a lookup alone never rejects a story
+
+# Incremental batch runs (opt-in): reuse each stage's cached output while its fingerprint is unchanged
+STAGE_CACHE = get_secret("STAGE_CACHE", "False").lower() in ("true", "1", "yes")
+
+# Early termination: stop a story once a core contradiction fixes the verdict (opt-in)
+EARLY_TERMINATION = get_secret("EARLY_TERMINATION", "False").lower() in ("true", "1", "yes")
+EARLY_EXIT_BATCH_CLAIMS = 4 # Claims retrieved + scored (one NLI call) between early-exit checks
+
+# Adaptive deepening (agent): extra retrieval only for low-confidence claims
+# Opt-in, needs langgraph: claims are retrieved + reasoned by the LangGraph agent (src/langgraph_agent.py)
+AGENTIC_REASONING = get_secret("AGENTIC_REASONING", "False").lower() in ("true", "1", "yes")
+ADAPTIVE_NLI_MARGIN = 0.2 # Claims whose best contradiction and entailment are closer than this are re-queried
+ADAPTIVE_MAX_ITERATIONS = 2 # Deepening rounds per story
+ADAPTIVE_STORY_BUDGET = 8 # Extra claim re-retrievals per story, across all rounds
+ADAPTIVE_K_FACTOR = 2 # Candidate/evidence k multiplier per round
+
+# NLI model lifecycle
+NLI_NUM_THREADS = int(get_secret("NLI_NUM_THREADS", "0")) # torch intra-op threads (0 = torch default)
+NLI_WARMUP = get_secret("NLI_WARMUP", "True").lower() in ("true", "1", "yes")
+NLI_TOKEN_CACHE = get_secret("NLI_TOKEN_CACHE", "True").lower() in ("true", "1", "yes") # Reuse chunk token ids
+
+# NLI backend: "local" (one in-process model), "pool" (sharded worker processes, CPU-only hosts)
+# or "remote" (shared scoring server, see nli_server)
+NLI_BACKEND = get_secret("NLI_BACKEND", "local").lower()
+NLI_POOL_WORKERS = int(get_secret("NLI_POOL_WORKERS", "0")) # 0 = use the autotuned layout
+NLI_POOL_THREADS = int(get_secret("NLI_POOL_THREADS", "1")) # torch threads per worker
+NLI_POOL_TUNING_PATH = PROCESSED_DATA_DIR / "nli_pool_tuning.json" # Autotuned workers x threads per host
+
+# NLI scoring server: one model, concurrent requests coalesced into batches
+NLI_SERVER_URL = get_secret("NLI_SERVER_URL", "http://127.0.0.1:8766")
+NLI_SERVER_PORT = 8766
+NLI_BATCH_MAX_PAIRS = 64 # Coalesced batch size cap
+NLI_BATCH_MAX_WAIT_MS = 10 # Longest a request waits for others to join its batch
+NLI_REMOTE_TIMEOUT = 60 # Seconds per scoring request
+
 BOOK_MAPPING = {
     "In Search of the Castaways": "In search of the castaways.txt",
     "The Count of Monte Cristo": "The Count of Monte Cristo.txt"
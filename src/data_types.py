@@ -18,8 +18,10 @@ class DossierEntry(TypedDict):
     claim_id: str
     claim_text: str
     excerpt_text: str # Verbatim text
-    relation: Literal["SUPPORT", "CONTRADICT", "NONE"]
+    chunk_id: Optional[str] # Source chunk (dedup key in the dossier store)
+    relation: Literal["SUPPORT", "CONTRADICT", "NONE"] # Verdict of this excerpt alone
     analysis: str # Explanation of constraint/refutation
+    nli_probs: dict # {"contradiction", "entailment", "neutral"} for this excerpt (when NLI ran)
 
 class ClaimDecision(TypedDict):
     # Internal intermediate state
@@ -29,6 +31,11 @@ class ClaimDecision(TypedDict):
     confidence: float
     analysis: str
     evidence_entries: List[DossierEntry] # Explicit dossier entries
+    evidence_index: Optional[int] # Index of the decisive excerpt in evidence_entries
+    probabilities: List[List[float]] # Full (n_evidence, 3) NLI probability matrix
+    importance: str # core, detail (copied from the claim; detail never triggers the core override)
+    type: str # event, belief
+    source: str # Fact-Table, Local-DeBERTa or Heuristic-Default (no evidence, NLI label NONE or NLI failed)
 
 class StoryResult(TypedDict):
     story_id: str
@@ -36,3 +43,4 @@ class StoryResult(TypedDict):
     rationale: str
     score_support: float
     score_contradict: float
+    decisive_claim_id: Optional[str] # Core contradiction that fixed the verdict (early termination)
@@ -0,0 +1,347 @@
+"""
+Append-only dossier store.
+
+All dossiers live in one data file of length-prefixed, zlib-compressed JSON
+records, with a JSONL sidecar index mapping record keys to byte offsets so a
+single story can be loaded without parsing the others. Excerpt texts are
+stored once per chunk id and referenced from the story records.
+
+Layout (DOSSIER_STORE_DIR):
+    records.bin   [4-byte little-endian length][zlib(JSON)] ...
+    index.jsonl   {"key": "story:<id>" | "excerpt:<chunk_id>", "offset", "length", ...}
+
+Story index lines also carry a small summary (prediction, confidence, claim
+and contradiction counts) so the viewer can filter and paginate without
+decompressing any record.
+
+Flushes hold an exclusive lock on records.bin (where fcntl exists) across
+the data append and the index append, so concurrent writer processes get
+disjoint offsets and index lines in data order.
+"""
+import atexit
+import hashlib
+import json
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError: # Windows: single-writer only
+    fcntl = None
+
+from .config import DOSSIER_STORE_DIR, DOSSIERS_DIR
+
+FLUSH_EVERY_RECORDS = 64
+VIEWER_PAGE_SIZE = 25
+_HEADER = struct.Struct("<I")
+
+def story_sort_key(story_id: str):
+    """Numeric ids in numeric order ("9" before "10"), then any others alphabetically."""
+    story_id = str(story_id)
+    return (0, int(story_id), "") if story_id.isdigit() else (1, 0, story_id)
+
+def excerpt_key(entry: dict) -> str:
+    """
+    Chunk id of an evidence entry plus a hash of its text, so a re-chunked or edited book
+    never reuses a stale excerpt stored under the same id; content hash alone without a chunk id.
+    """
+    digest = hashlib.sha1(entry.get("excerpt_text", "").encode("utf-8")).hexdigest()
+    chunk_id = entry.get("chunk_id")
+    if chunk_id is not None:
+        return f"{chunk_id}@{digest[:16]}"
+    return "sha1:" + digest
+
+class DossierStore:
+    def __init__(self, root=DOSSIER_STORE_DIR, flush_every: int = FLUSH_EVERY_RECORDS):
+        self.root = root
+        self.data_path = root / "records.bin"
+        self.index_path = root / "index.jsonl"
+        self.flush_every = flush_every
+        self._lock = threading.RLock()
+        self._pending = []        # [(key, payload_bytes, index_extra)]
+        self._pending_keys = {}   # key -> position in _pending
+        self.index = {}           # key -> index entry
+        self._index_size = 0
+        os.makedirs(root, exist_ok=True)
+        self.refresh()
+
+    # --- Index ---
+
+    def refresh(self):
+        """Loads index lines appended since the last call (e.g. by another process)."""
+        with self._lock:
+            if not self.index_path.exists():
+                return
+            with open(self.index_path, "rb") as f:
+                self._read_index_from(f)
+
+    def _read_index_from(self, f):
+        f.seek(self._index_size)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break # Partial line from an interrupted writer
+            self._index_size += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # Torn line, terminated by the next writer
+            self.index[entry["key"]] = entry
+
+    def story_ids(self) -> list:
+        with self._lock:
+            keys = list(self.index) + list(self._pending_keys)
+        return sorted({k[len("story:"):] for k in keys if k.startswith("story:")}, key=story_sort_key)
+
+    def has_story(self, story_id: str) -> bool:
+        """True once the story was written (flushed or still buffered)."""
+        key = f"story:{story_id}"
+        with self._lock:
+            return key in self.index or key in self._pending_keys
+
+    def query_stories(self, prediction=None, min_confidence: float = 0.0,
+                      offset: int = 0, limit: int = VIEWER_PAGE_SIZE):
+        """
+        Filters stories on the index summaries only (flushed records).
+        Returns (total_matches, [summary]) for the requested page, ordered by story id.
+        """
+        with self._lock:
+            entries = [e for k, e in self.index.items() if k.startswith("story:")]
+        matches = []
+        for e in entries:
+            if prediction is not None and e.get("prediction") != prediction:
+                continue
+            if min_confidence > 0 and (e.get("confidence") or 0.0) < min_confidence:
+                continue
+            matches.append(e)
+        matches.sort(key=lambda e: story_sort_key(e["key"][len("story:"):]))
+        page = [
+            {
+                "story_id": e["key"][len("story:"):],
+                "prediction": e.get("prediction"),
+                "confidence": e.get("confidence"),
+                "claims": e.get("claims"),
+                "contradictions": e.get("contradictions"),
+                "entries": e.get("entries", 0),
+            }
+            for e in matches[offset:offset + limit]
+        ]
+        return len(matches), page
+
+    # --- Writing ---
+
+    def _append(self, key: str, obj: dict, **index_extra):
+        payload = zlib.compress(json.dumps(obj, separators=(",", ":")).encode("utf-8"))
+        self._pending_keys[key] = len(self._pending)
+        self._pending.append((key, payload, index_extra))
+
+    def write_story(self, story_id: str, entries: list, prediction=None, verdicts: dict = None):
+        """
+        Buffers one story's dossier; excerpts are deduplicated by chunk id and text.
+        verdicts: optional {claim_id: {"label", "confidence"}} from the claim decisions.
+        """
+        verdicts = verdicts or {}
+        with self._lock:
+            claims = {}
+            compact = []
+            for e in entries:
+                ref = excerpt_key(e)
+                key = f"excerpt:{ref}"
+                if key not in self.index and key not in self._pending_keys:
+                    self._append(key, {"text": e.get("excerpt_text", "")})
+                claims[e.get("claim_id")] = e.get("claim_text", "")
+                item = {k: v for k, v in e.items()
+                        if k not in ("excerpt_text", "claim_text", "story_id", "chunk_id")}
+                item["excerpt_ref"] = ref
+                compact.append(item)
+
+            for claim_id in verdicts:
+                claims.setdefault(claim_id, "")
+            # Confidence of the strongest claim backing the verdict (None without decisions)
+            backing = "CONTRADICT" if prediction == 0 else "SUPPORT"
+            confidence = max((v["confidence"] for v in verdicts.values() if v["label"] == backing),
+                             default=0.0) if verdicts else None
+
+            self._append(f"story:{story_id}",
+                         {"story_id": str(story_id), "prediction": prediction, "claims": claims,
+                          "verdicts": verdicts, "dossier": compact},
+                         prediction=prediction, entries=len(compact), claims=len(claims),
+                         contradictions=sum(v["label"] == "CONTRADICT" for v in verdicts.values()),
+                         confidence=confidence)
+            if len(self._pending) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        """Appends buffered records in one write, fsyncs, then publishes them in the index."""
+        with self._lock:
+            if not self._pending:
+                return
+            blob = bytearray()
+            with open(self.data_path, "ab") as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX) # Released when f is closed
+                # The real end of file once locked (tell() in append mode is not it before a write)
+                offset = f.seek(0, os.SEEK_END)
+                index_lines = []
+                for key, payload, extra in self._pending:
+                    record = _HEADER.pack(len(payload)) + payload
+                    entry = {"key": key, "offset": offset + len(blob), "length": len(record), **extra}
+                    blob += record
+                    index_lines.append(entry)
+                f.write(blob)
+                f.flush()
+                os.fsync(f.fileno())
+                # Index last, still locked: a crash between the two writes only leaves unreferenced data
+                with open(self.index_path, "ab+") as index_file:
+                    self._read_index_from(index_file) # Lines of other writers first
+                    if index_file.seek(0, os.SEEK_END) > self._index_size:
+                        index_file.write(b"\n") # Terminate a torn line left by a crashed writer
+                    for entry in index_lines:
+                        index_file.write((json.dumps(entry) + "\n").encode("utf-8"))
+                        self.index[entry["key"]] = entry
+                    index_file.flush()
+                    os.fsync(index_file.fileno())
+                    self._index_size = index_file.tell()
+            self._pending.clear()
+            self._pending_keys.clear()
+
+    def close(self):
+        self.flush()
+
+    # --- Reading ---
+
+    def _read(self, key: str):
+        with self._lock:
+            if key in self._pending_keys:
+                payload = self._pending[self._pending_keys[key]][1]
+                return json.loads(zlib.decompress(payload))
+            entry = self.index.get(key)
+        if entry is None:
+            return None
+        with open(self.data_path, "rb") as f:
+            f.seek(entry["offset"])
+            record = f.read(entry["length"])
+        (length,) = _HEADER.unpack_from(record)
+        return json.loads(zlib.decompress(record[_HEADER.size:_HEADER.size + length]))
+
+    def get_excerpt(self, ref: str) -> str:
+        record = self._read(f"excerpt:{ref}")
+        return record["text"] if record else ""
+
+    def load_story(self, story_id: str):
+        """Compact story record (excerpts by reference), or None."""
+        return self._read(f"story:{story_id}")
+
+    def story_claims(self, story_id: str):
+        """
+        Per-claim view of a story with excerpts by reference, or None:
+        [{"claim_id", "claim_text", "label", "confidence", "evidence": [{"excerpt_ref", "relation", ...}]}].
+        Excerpt texts are fetched separately via get_excerpt(), only for what is displayed.
+        """
+        record = self.load_story(story_id)
+        if record is None:
+            return None
+        verdicts = record.get("verdicts", {})
+        by_claim = {cid: [] for cid in record["claims"]}
+        for item in record["dossier"]:
+            by_claim.setdefault(item.get("claim_id"), []).append(
+                {k: v for k, v in item.items() if k != "claim_id"})
+        return [
+            {
+                "claim_id": cid,
+                "claim_text": record["claims"].get(cid, ""),
+                "label": verdicts.get(cid, {}).get("label"),
+                "confidence": verdicts.get(cid, {}).get("confidence"),
+                "evidence": evidence,
+            }
+            for cid, evidence in by_claim.items()
+        ]
+
+    def load_dossier(self, story_id: str):
+        """
+        Full dossier in the legacy per-story JSON shape
+        {"story_id", "prediction", "dossier": [DossierEntry]}, or None.
+        """
+        record = self.load_story(story_id)
+        if record is None:
+            return None
+        entries = []
+        for item in record["dossier"]:
+            entry = {
+                "story_id": record["story_id"],
+                "claim_id": item.get("claim_id"),
+                "claim_text": record["claims"].get(item.get("claim_id"), ""),
+                "excerpt_text": self.get_excerpt(item["excerpt_ref"]),
+            }
+            entry.update({k: v for k, v in item.items() if k not in ("claim_id", "excerpt_ref")})
+            entries.append(entry)
+        return {"story_id": record["story_id"], "prediction": record["prediction"], "dossier": entries}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_dossier_store() -> DossierStore:
+    """Process-wide store; buffered records are flushed at interpreter exit."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DossierStore()
+            atexit.register(_store.close)
+    return _store
+
+def load_dossier(story_id: str):
+    """Loads one story's dossier from the store, falling back to legacy per-story JSON files."""
+    dossier = get_dossier_store().load_dossier(str(story_id))
+    if dossier is not None:
+        return dossier
+    legacy_path = DOSSIERS_DIR / f"story_{story_id}_dossier.json"
+    if legacy_path.exists():
+        with open(legacy_path, encoding="utf-8") as f:
+            return json.load(f)
+    return None
+
+def legacy_verdicts(entries: list) -> dict:
+    """
+    Per-claim verdicts rebuilt from the excerpt relations of a legacy dossier,
+    which stored no decisions. A claim is CONTRADICT/SUPPORT if any excerpt
+    is, at the NLI threshold it had to pass (a lower bound); claims without a
+    decisive excerpt got the pipeline's default SUPPORT.
+    """
+    from .nli_engine import CONTRADICT_THRESHOLD, ENTAIL_THRESHOLD
+    from .reasoning_llm import DEFAULT_SUPPORT_CONFIDENCE
+    relations = {}
+    for e in entries:
+        relations.setdefault(e.get("claim_id"), set()).add(str(e.get("relation")).upper())
+    verdicts = {}
+    for claim_id, found in relations.items():
+        if "CONTRADICT" in found:
+            verdicts[claim_id] = {"label": "CONTRADICT", "confidence": CONTRADICT_THRESHOLD}
+        elif "SUPPORT" in found:
+            verdicts[claim_id] = {"label": "SUPPORT", "confidence": ENTAIL_THRESHOLD}
+        else:
+            verdicts[claim_id] = {"label": "SUPPORT", "confidence": DEFAULT_SUPPORT_CONFIDENCE}
+    return verdicts
+
+def import_legacy_dossiers(dossiers_dir=DOSSIERS_DIR, store: DossierStore = None) -> int:
+    """
+    Copies per-story JSON dossiers the store does not have yet into it, with
+    verdicts rebuilt by `legacy_verdicts`. Returns the number imported.
+    """
+    store = store or get_dossier_store()
+    count = 0
+    for path in sorted(dossiers_dir.glob("story_*_dossier.json")):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        story_id = str(data["story_id"])
+        if store.has_story(story_id):
+            continue
+        entries = data.get("dossier", [])
+        store.write_story(story_id, entries, data.get("prediction"), legacy_verdicts(entries))
+        count += 1
+    store.flush()
+    return count
+
+if __name__ == "__main__":
+    n = import_legacy_dossiers()
+    print(f"[Dossier] Imported {n} legacy dossiers into {DOSSIER_STORE_DIR}")
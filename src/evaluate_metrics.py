@@ -1,10 +1,34 @@
-
-import pandas as pd
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
+import numpy as np
 import sys
 import os
 from .config import RESULTS_CSV, TRAIN_CSV
 
+def compute_metrics(y_true, y_pred) -> dict:
+    """
+    Accuracy, Precision, Recall, F1 and confusion counts for binary labels
+    (1 = consistent). Plain NumPy so it is cheap enough for threshold sweeps.
+    """
+    y_true = np.asarray(y_true, dtype=np.int8)
+    y_pred = np.asarray(y_pred, dtype=np.int8)
+
+    tp = int(np.sum((y_true == 1) & (y_pred == 1)))
+    tn = int(np.sum((y_true == 0) & (y_pred == 0)))
+    fp = int(np.sum((y_true == 0) & (y_pred == 1)))
+    fn = int(np.sum((y_true == 1) & (y_pred == 0)))
+
+    total = tp + tn + fp + fn
+    prec = tp / (tp + fp) if (tp + fp) else 0.0
+    rec = tp / (tp + fn) if (tp + fn) else 0.0
+    f1 = 2 * prec * rec / (prec + rec) if (prec + rec) else 0.0
+
+    return {
+        "accuracy": (tp + tn) / total if total else 0.0,
+        "precision": prec,
+        "recall": rec,
+        "f1": f1,
+        "tn": tn, "fp": fp, "fn": fn, "tp": tp,
+    }
+
 def evaluate_metrics(ground_truth_path=TRAIN_CSV, predictions_path=RESULTS_CSV):
     """
     Calculates classification metrics (Accuracy, Precision, Recall, F1) 
@@ -19,6 +43,7 @@ def evaluate_metrics(ground_truth_path=TRAIN_CSV, predictions_path=RESULTS_CSV):
         print(f"Error: Predictions file not found at {predictions_path}")
         return
 
+    import pandas as pd
     print("Loading data...")
     truth_df = pd.read_csv(ground_truth_path)
     pred_df = pd.read_csv(predictions_path)
@@ -47,21 +72,18 @@ def evaluate_metrics(ground_truth_path=TRAIN_CSV, predictions_path=RESULTS_CSV):
     print(f"EVALUATION RESULTS (n={len(merged)})")
     print("="*40)
     
-    acc = accuracy_score(y_true, y_pred)
-    prec = precision_score(y_true, y_pred, zero_division=0)
-    rec = recall_score(y_true, y_pred, zero_division=0)
-    f1 = f1_score(y_true, y_pred, zero_division=0)
-    cm = confusion_matrix(y_true, y_pred)
+    m = compute_metrics(y_true, y_pred)
     
-    print(f"Accuracy:  {acc:.2%}")
-    print(f"Precision: {prec:.4f}")
-    print(f"Recall:    {rec:.4f}")
-    print(f"F1 Score:  {f1:.4f}")
+    print(f"Accuracy:  {m['accuracy']:.2%}")
+    print(f"Precision: {m['precision']:.4f}")
+    print(f"Recall:    {m['recall']:.4f}")
+    print(f"F1 Score:  {m['f1']:.4f}")
     print("-" * 20)
     print("Confusion Matrix:")
-    print(f"TN: {cm[0][0]} | FP: {cm[0][1]}")
-    print(f"FN: {cm[1][0]} | TP: {cm[1][1]}")
+    print(f"TN: {m['tn']} | FP: {m['fp']}")
+    print(f"FN: {m['fn']} | TP: {m['tp']}")
     print("="*40)
+    return m
 
 if __name__ == "__main__":
     evaluate_metrics()
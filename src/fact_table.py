@@ -0,0 +1,225 @@
+"""
+Ingest-time fact table and symbolic pre-check.
+
+Sentences of the novels are scanned once for years, counted quantities
+("fourteen years") and places ("at Marseilles"). Each becomes a fact
+(entity, attribute, value, file, char offset) for every named entity of the
+sentence, indexed by (entity, attribute). Claims carrying an explicit date
+or number are then resolved by lookup in the story's own novel: the same
+entity and event verb with the same value supports the claim, the same
+event with only other values contradicts it. Anything else falls through
+to NLI.
+
+Capitalized sentence-initial words ("During", "Suspected") only count as
+entities if the corpus also capitalizes them mid-sentence. Unit words and
+numbers never count as entities or event terms.
+"""
+import re
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+from .config import NOVELS_DIR, SYMBOLIC_SUPPORT_CONFIDENCE, SYMBOLIC_CONTRADICT_CONFIDENCE
+from .text_analyzer import analyze, normalize, STOPWORDS
+
+YEAR_RE = re.compile(r"\b(1[5-9]\d\d)\b")
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+}
+QUANTITY_RE = re.compile(r"\b(\d{1,3}|" + "|".join(NUMBER_WORDS) + r")\s+(years?|months?|weeks?|days?)\b",
+                         re.IGNORECASE)
+PLACE_RE = re.compile(r"\b(?:in|at|to|from|near)\s+(?:the\s+)?((?:[A-ZÀ-Ý][\w’']*)(?:\s+(?:d['’])?[A-ZÀ-Ý][\w’']*)*)")
+NAME_RE = re.compile(r"\b[A-ZÀ-Ý][a-zà-ÿ]+(?:[’'][a-z]+)?\b")
+SENTENCE_RE = re.compile(r"[^.!?]+[.!?]?")
+# Capitalized words that are not entities
+NON_ENTITIES = STOPWORDS | {"but", "not", "no", "yes", "sir", "madame", "monsieur", "mr", "mrs", "oh", "ah",
+                            "well", "now", "there", "here", "then", "yet", "all", "one", "chapter"} | set(NUMBER_WORDS)
+# Units of the quantities: shared by every dated sentence, so never evidence of the same event
+UNIT_TERMS = frozenset({"year", "month", "week", "day", "time", "age", "old"})
+# Event verbs: past-tense forms ("arrested", "fled") of the sentence; generic irregular
+# ones such as "saw", "made", "went" or "told" name no particular event
+PAST_VERB_RE = re.compile(r"\b[a-z]{3,}ed\b")
+IRREGULAR_VERBS = frozenset({
+    "bought", "broke", "built", "caught", "died", "fell", "fled", "fought", "grew", "hid", "lost", "met",
+    "paid", "sank", "sent", "shot", "sold", "spent", "stole", "struck", "swam", "swore", "taught", "threw",
+    "won", "wrote", "born",
+})
+NOT_VERBS = frozenset({"hundred", "indeed", "kindred", "sacred", "naked", "wicked", "beloved", "proceed",
+                       "exceed", "succeed", "speed", "breed"})
+
+class Fact(NamedTuple):
+    entity: str
+    attribute: str # year | years/months/weeks/days | place
+    value: object
+    file: str
+    char_offset: int
+    verbs: frozenset # Stemmed event verbs of the sentence (event context)
+    sentence: str
+
+def _name_matches(sentence: str):
+    """(normalized name, sentence_initial) for the capitalized words of a sentence."""
+    first_word = re.search(r"[^\W\d_]", sentence)
+    for m in NAME_RE.finditer(sentence):
+        name = normalize(m.group(0).split("’")[0].split("'")[0])
+        if name not in NON_ENTITIES:
+            yield name, first_word is not None and m.start() == first_word.start()
+
+def _entities(sentence: str, names=None) -> list:
+    """
+    Named entities of a sentence. The sentence-initial word is capitalized
+    anyway: it is kept only if it is in `names` (None keeps it, for indexing,
+    where the lookup side applies the filter).
+    """
+    found = {n for n, initial in _name_matches(sentence) if not initial or names is None or n in names}
+    return sorted(found)
+
+def _verbs(sentence: str) -> frozenset:
+    words = re.findall(r"[a-z]+", normalize(sentence))
+    verbs = [w for w in words if (PAST_VERB_RE.fullmatch(w) and w not in NOT_VERBS) or w in IRREGULAR_VERBS]
+    return frozenset(t for v in verbs for t in analyze(v) if t not in UNIT_TERMS)
+
+def _quantity(number: str) -> int:
+    return int(number) if number.isdigit() else NUMBER_WORDS[number.lower()]
+
+def sentence_facts(sentence: str):
+    """[(attribute, value)] stated in one sentence."""
+    found = [("year", int(y)) for y in YEAR_RE.findall(sentence)]
+    found += [(unit.lower().rstrip("s") + "s", _quantity(n)) for n, unit in QUANTITY_RE.findall(sentence)]
+    found += [("place", normalize(p)) for p in PLACE_RE.findall(sentence) if normalize(p) not in NON_ENTITIES]
+    return found
+
+def _stitch(chunks: list) -> list:
+    """Overlapping [(char_offset, text)] chunks of one file as contiguous [(char_offset, text)] spans."""
+    spans = []
+    for offset, chunk in sorted(chunks):
+        if spans and offset <= spans[-1][0] + len(spans[-1][1]):
+            start, text = spans[-1]
+            spans[-1] = (start, text[:offset - start] + chunk if offset + len(chunk) > start + len(text) else text)
+        else:
+            spans.append((offset, chunk))
+    return spans
+
+class FactTable:
+    def __init__(self):
+        self.facts = {}   # (entity, attribute) -> [Fact]
+        self.names = set() # Words the corpus capitalizes mid-sentence (entities for sure)
+        self._seen = set()
+
+    def __len__(self):
+        return sum(len(v) for v in self.facts.values())
+
+    def add_text(self, text: str, file: str, base_offset: int = 0):
+        for m in SENTENCE_RE.finditer(text):
+            sentence = m.group(0).strip()
+            self.names.update(n for n, initial in _name_matches(sentence) if not initial)
+            attributes = sentence_facts(sentence)
+            if not attributes:
+                continue
+            entities = _entities(sentence)
+            if not entities:
+                continue
+            verbs = _verbs(sentence)
+            if not verbs:
+                continue # No event to match a claim against
+            offset = base_offset + m.start() + len(m.group(0)) - len(m.group(0).lstrip())
+            for attribute, value in attributes:
+                for entity in entities:
+                    if attribute == "place" and entity in value.split():
+                        continue # The place itself
+                    # Each fact once, even if the same text is added again
+                    key = (file, offset, entity, attribute, value)
+                    if key in self._seen:
+                        continue
+                    self._seen.add(key)
+                    self.facts.setdefault((entity, attribute), []).append(
+                        Fact(entity, attribute, value, file, offset, verbs, sentence))
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Builds the table from the chunks of a ChunkIndex (same text the retriever serves).
+        Overlapping chunks are stitched back into the file text first, so sentences cut at
+        chunk edges are read whole.
+        """
+        spans = {} # file -> [(char_offset, chunk)]
+        for chunk, meta in zip(index.chunks, index.metadata):
+            spans.setdefault(meta["file"], []).append((meta["char_offset"], chunk))
+        table = cls()
+        for file, chunks in spans.items():
+            for offset, text in _stitch(chunks):
+                table.add_text(text, file, offset)
+        return table
+
+    @classmethod
+    def from_dir(cls, novels_dir=NOVELS_DIR):
+        table = cls()
+        for file_path in sorted(Path(novels_dir).glob("*.txt")):
+            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+                table.add_text(f.read(), file_path.name)
+        return table
+
+    def lookup(self, entity: str, attribute: str) -> list:
+        return self.facts.get((normalize(entity), attribute), [])
+
+    def check_claim(self, claim_text: str, book_file: str, character: str = None):
+        """
+        Symbolic verdict for a claim with explicit dates/numbers/places, or None.
+        Only facts of `book_file` count; `character` (the story's subject) is an
+        entity of every claim, since claims often refer to them by pronoun.
+        A fact must share an entity and an event verb with the claim.
+        Returns {"label", "confidence", "analysis", "facts": [Fact]}.
+        Places can only support: a different place is too often just another scene.
+        """
+        claim_facts = sentence_facts(claim_text)
+        if not claim_facts or not book_file:
+            return None
+        entities = set(_entities(claim_text, self.names))
+        if character:
+            entities.update(t for t in normalize(character).split() if t not in NON_ENTITIES)
+        verbs = _verbs(claim_text)
+        if not entities or not verbs:
+            return None
+
+        support, conflict = [], []
+        for attribute, value in claim_facts:
+            for entity in entities:
+                if attribute == "place" and entity in value.split():
+                    continue
+                for fact in self.lookup(entity, attribute):
+                    if fact.file != book_file:
+                        continue
+                    if not (fact.verbs & verbs):
+                        continue # Same entity, different event
+                    (support if fact.value == value else conflict).append((attribute, value, fact))
+
+        if support:
+            attribute, value, fact = support[0]
+            return {"label": "SUPPORT", "confidence": SYMBOLIC_SUPPORT_CONFIDENCE,
+                    "analysis": f"Fact table: {fact.entity} {attribute}={value} stated in {fact.file}.",
+                    "facts": [f for _, _, f in support]}
+        conflict = [c for c in conflict if c[0] != "place"]
+        if conflict:
+            attribute, value, fact = conflict[0]
+            return {"label": "CONTRADICT", "confidence": SYMBOLIC_CONTRADICT_CONFIDENCE,
+                    "analysis": f"Fact table: claim states {attribute}={value}, but {fact.file} gives "
+                                f"{fact.value} for {fact.entity} ({', '.join(sorted(fact.verbs & verbs))}).",
+                    "facts": [f for _, _, f in conflict]}
+        return None
+
+_fact_table = None
+_fact_table_lock = threading.Lock()
+
+def use_fact_table(table):
+    """Sets the table used by the symbolic pre-check (None rebuilds lazily from NOVELS_DIR)."""
+    global _fact_table
+    _fact_table = table
+
+def get_fact_table() -> FactTable:
+    global _fact_table
+    with _fact_table_lock:
+        if _fact_table is None:
+            _fact_table = FactTable.from_dir()
+            print(f"[Facts] Fact table ready ({len(_fact_table)} facts).")
+    return _fact_table
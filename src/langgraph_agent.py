@@ -1,77 +1,151 @@
-
 from typing import TypedDict, Annotated
-import operator
 from langgraph.graph import StateGraph, END
+from langgraph.types import Send
 
 # Import existing modules
-from .retrieval import retrieve_evidence
-from .reasoning_llm import reason_about_claim
-from .config import RETRIEVAL_K
+from .retrieval import retrieve_evidence, deepen_evidence
+from .reasoning_llm import reason_about_all_claims, is_inconclusive
+from .aggregation import aggregate_decisions
+from .profiling import PROFILER
+from .config import (RETRIEVAL_K, BOOK_MAPPING, ADAPTIVE_NLI_MARGIN, ADAPTIVE_MAX_ITERATIONS,
+                     ADAPTIVE_STORY_BUDGET, ADAPTIVE_K_FACTOR)
+
+def merge_dicts(left: dict, right: dict) -> dict:
+    """Reducer joining the per-claim retrieval branches."""
+    return {**left, **right}
 
 class AgentState(TypedDict):
+    story_id: str
+    claims: list
+    evidence_map: Annotated[dict, merge_dicts] # claim_id -> evidence, filled by the fan-out
+    decisions: list
+    result: dict
+    # Adaptive deepening
+    book_file: str # Novel file of the story, narrows deepening queries
+    character: str
+    pending: list # Claim ids to (re)score in the next reason step; None = all
+    iteration: int
+    budget: int # Remaining claim re-retrievals for this story
+
+class ClaimTask(TypedDict):
+    # Payload of one fan-out branch
     claim: dict
     story_id: str
-    evidence: list
-    decision: dict
-    confidence: float
 
-def retrieve_node(state: AgentState):
+def fan_out_claims(state: AgentState):
     """
-    Retrieves evidence (Semantic + Adversarial + Hybrid Reranked).
+    Map step: one retrieval branch per claim. Branches of the same step run concurrently.
     """
-    evidence = retrieve_evidence(state["claim"], state["story_id"], k=RETRIEVAL_K)
-    return {"evidence": evidence}
+    if not state["claims"]:
+        return "reason"
+    return [Send("retrieve", {"claim": c, "story_id": state["story_id"]}) for c in state["claims"]]
+
+def retrieve_node(task: ClaimTask):
+    """
+    Retrieves evidence (Semantic + Adversarial + Hybrid Reranked) for one claim.
+    """
+    evidence = retrieve_evidence(task["claim"], task["story_id"], k=RETRIEVAL_K)
+    return {"evidence_map": {task["claim"]["id"]: evidence}}
 
 def reason_node(state: AgentState):
     """
-    Reasons about consistency using Gemini.
+    Join step: scores the pending claims (all of them on the first pass) in one batched NLI call.
+    A re-scored claim takes the latest round's decision: it is based on a superset of the evidence.
     """
-    decision = reason_about_claim(state["claim"], state["evidence"])
-    # Clean up decision to match dict if needed
-    return {
-        "decision": decision, 
-        "confidence": decision.get("confidence", 0.0)
-    }
+    pending = state.get("pending")
+    claims = [c for c in state["claims"] if pending is None or c["id"] in pending]
+    new_decisions = reason_about_all_claims(claims, state["evidence_map"], state.get("book_file"),
+                                            state.get("character"))
+
+    previous = {d["claim_id"]: d for d in state["decisions"]}
+    previous.update((d["claim_id"], d) for d in new_decisions)
+    decisions = [previous[c["id"]] for c in state["claims"] if c["id"] in previous]
+    return {"decisions": decisions, "pending": []}
+
+def uncertain_claims(state: AgentState) -> list:
+    # Deepening budget is only spent on NLI-inconclusive core claims
+    return [d["claim_id"] for d in state["decisions"]
+            if is_inconclusive(d, ADAPTIVE_NLI_MARGIN) and d.get("importance") != "detail"]
 
 def should_rerank(state: AgentState):
     """
-    Conditional Logic: If confidence is low, could trigger deeper search (not implemented here loop-wise to avoid costs),
-    or just END.
+    Conditional Logic: NLI-inconclusive claims loop back through a deeper retrieval round
+    while the story's iteration cap and re-retrieval budget allow it.
     """
-    if state["confidence"] < 0.5:
-        # In a full agent, we might change query and loop back to 'retrieve'
-        # return "retrieve" 
-        return "aggregate"
+    if (uncertain_claims(state) and state.get("iteration", 0) < ADAPTIVE_MAX_ITERATIONS
+            and state.get("budget", 0) > 0):
+        return "deepen"
     return "aggregate"
 
+def deepen_node(state: AgentState):
+    """
+    Re-queries only the inconclusive claims (up to the remaining budget) with expanded k,
+    the story's book as partition and, from round 2, reformulated queries.
+    """
+    iteration = state.get("iteration", 0) + 1
+    targets = uncertain_claims(state)[:state["budget"]]
+    claims = {c["id"]: c for c in state["claims"]}
+    evidence_map = {}
+    for claim_id in targets:
+        fresh = deepen_evidence(claims[claim_id], state["story_id"], iteration, k=RETRIEVAL_K,
+                                book_file=state.get("book_file"), character=state.get("character"),
+                                k_factor=ADAPTIVE_K_FACTOR)
+        # Keep the first-pass evidence; add what the deeper search found
+        seen = {e["text"] for e in state["evidence_map"].get(claim_id, [])}
+        evidence_map[claim_id] = state["evidence_map"].get(claim_id, []) + [e for e in fresh if e["text"] not in seen]
+    PROFILER.count("agent.deepened_claims", len(targets))
+    print(f"  [Agent] Deepening round {iteration}: {len(targets)} inconclusive claims")
+    return {"evidence_map": evidence_map, "pending": targets, "iteration": iteration,
+            "budget": state["budget"] - len(targets)}
+
+def aggregate_node(state: AgentState):
+    return {"result": aggregate_decisions(state["decisions"], state["story_id"])}
+
 # Build Graph
 workflow = StateGraph(AgentState)
 workflow.add_node("retrieve", retrieve_node)
 workflow.add_node("reason", reason_node)
+workflow.add_node("deepen", deepen_node)
+workflow.add_node("aggregate", aggregate_node)
 
-workflow.set_entry_point("retrieve")
+workflow.set_conditional_entry_point(fan_out_claims, ["retrieve", "reason"])
 workflow.add_edge("retrieve", "reason")
 workflow.add_conditional_edges(
     "reason",
     should_rerank,
     {
-        "retrieve": "retrieve",
-        "aggregate": END
+        "deepen": "deepen",
+        "aggregate": "aggregate"
     }
 )
+workflow.add_edge("deepen", "reason")
+workflow.add_edge("aggregate", END)
 
 app = workflow.compile()
 
-def run_agentic_check(claim: dict, story_id: str):
+def run_agentic_story(story_id: str, claims: list, book_name: str = None, character: str = None,
+                      budget: int = ADAPTIVE_STORY_BUDGET) -> dict:
     """
-    Entry point to run the LangGraph agent for a single claim.
+    Entry point to run the LangGraph agent for all claims of a story.
+    budget caps the extra claim re-retrievals of adaptive deepening (0 disables it).
+    Returns the final state: {"decisions", "result", "evidence_map", ...}.
     """
     initial_state = {
-        "claim": claim, 
-        "story_id": story_id, 
-        "evidence": [], 
-        "decision": {}, 
-        "confidence": 0.0
+        "story_id": story_id,
+        "claims": claims,
+        "evidence_map": {},
+        "decisions": [],
+        "result": {},
+        "book_file": BOOK_MAPPING.get(book_name),
+        "character": character,
+        "pending": None,
+        "iteration": 0,
+        "budget": budget
     }
-    result = app.invoke(initial_state)
-    return result["decision"]
+    return app.invoke(initial_state)
+
+def run_agentic_check(claim: dict, story_id: str):
+    """
+    Entry point to run the LangGraph agent for a single claim.
+    """
+    return run_agentic_story(story_id, [claim])["decisions"][0]
@@ -1,92 +1,369 @@
 
-from sentence_transformers import CrossEncoder
-import torch
+import threading
+import time
+import numpy as np
+from .config import NLI_NUM_THREADS, NLI_WARMUP, NLI_TOKEN_CACHE, NLI_BACKEND, RETRIEVAL_K
+from .profiling import PROFILER
 
 # fast and accurate NLI model
 MODEL_NAME = "cross-encoder/nli-deberta-v3-small"
 _model_instance = None
 
+# Model lifecycle: idle -> loading -> warming -> ready (or failed)
+_model_lock = threading.Lock()
+_ready_event = threading.Event()
+_preload_thread = None
+_warm_requested = False
+_status = {"state": "idle", "error": None, "load_seconds": None, "warmup_seconds": None}
+
+# Pre-tokenized premises (token_cache.PremiseTokenCache), keyed by chunk id
+_token_cache = None
+
+# "local" | "pool" | "remote" (overridable per process, e.g. by the scoring server itself)
+_backend = NLI_BACKEND
+
+# Premise lengths (words) covering short excerpts up to full 1000-char chunks
+WARMUP_PREMISE_WORDS = (20, 80, 180)
+
+# Decision thresholds on the max contradiction / entailment probability
+CONTRADICT_THRESHOLD = 0.8
+ENTAIL_THRESHOLD = 0.8
+
+# Label order of cross-encoder/nli-deberta-v3-* (config label2id):
+# {'contradiction': 0, 'entailment': 1, 'neutral': 2}
+IDX_CONTRA = 0
+IDX_ENTAIL = 1
+IDX_NEUTRAL = 2
+
+def _softmax(logits):
+    logits = np.asarray(logits, dtype=np.float64)
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+def configure_threads(num_threads: int = NLI_NUM_THREADS):
+    """Sets torch intra-op parallelism (no-op for 0 or when torch is unavailable)."""
+    if num_threads and num_threads > 0:
+        try:
+            import torch
+            torch.set_num_threads(num_threads)
+            print(f"[NLI] torch intra-op threads: {num_threads}")
+        except ImportError:
+            pass
+
 def get_nli_model():
     global _model_instance
+    PROFILER.cache("nli_model", hit=_model_instance is not None)
     if _model_instance is None:
-        print("[NLI] Loading local DeBERTa model (this happens once)...")
+        # Serialize loads: a concurrent caller waits for the preload instead of loading twice
+        with _model_lock:
+            if _model_instance is not None:
+                return _model_instance
+            print(f"[NLI] Loading DeBERTa model ({_backend} backend, this happens once)...")
+            _status.update(state="loading", error=None)
+            start = time.perf_counter()
+            try:
+                with PROFILER.stage("nli.model_load"):
+                    if _backend == "remote":
+                        from .nli_server import RemoteNLIModel
+                        _model_instance = RemoteNLIModel().check()
+                    elif _backend == "pool":
+                        from .nli_pool import create_worker_pool
+                        _model_instance = create_worker_pool()
+                    else:
+                        from sentence_transformers import CrossEncoder
+                        configure_threads()
+                        _model_instance = CrossEncoder(MODEL_NAME)
+                _status["load_seconds"] = time.perf_counter() - start
+                print("[NLI] Model loaded successfully.")
+            except Exception as e:
+                print(f"[NLI] Failed to load model: {e}")
+                _status.update(state="failed", error=str(e))
+                _ready_event.set() # Wake up waiters; they will see the failure
+                return None
+            if _warm_requested:
+                _status["state"] = "warming" # Readiness is signalled after warm-up
+            else:
+                _status["state"] = "ready"
+                _ready_event.set()
+    return _model_instance
+
+def use_backend(backend: str):
+    """Selects how the model is loaded on the next get_nli_model(): local, pool or remote."""
+    global _backend
+    _backend = backend
+
+def set_nli_model(model):
+    """Injects a model exposing `predict(pairs) -> logits` (e.g. a benchmark stub)."""
+    global _model_instance
+    _model_instance = model
+    if model is None:
+        _status.update(state="idle", error=None)
+        _ready_event.clear()
+    else:
+        _status.update(state="ready", error=None)
+        _ready_event.set()
+
+def warm_up(model=None, premise_words=WARMUP_PREMISE_WORDS, batch_size: int = RETRIEVAL_K):
+    """
+    Runs throwaway batches at representative premise lengths so the first real
+    request does not pay for lazy kernel/allocator initialisation.
+    """
+    model = model or get_nli_model()
+    if model is None:
+        return
+    start = time.perf_counter()
+    claim = "He was imprisoned in the fortress for many years before he escaped to the island."
+    for n_words in premise_words:
+        premise = " ".join(["the old sailor returned to the harbour"] * (n_words // 7 + 1))
+        model.predict([(premise, claim)] * batch_size)
+    _status["warmup_seconds"] = time.perf_counter() - start
+    print(f"[NLI] Warm-up done in {_status['warmup_seconds']:.2f}s.")
+
+def use_token_cache(cache):
+    """Sets the pre-tokenized premise cache (None disables the cached-input path)."""
+    global _token_cache
+    _token_cache = cache
+
+def load_token_cache(model=None):
+    """Loads (or builds once) the premise token cache for the model's tokenizer."""
+    model = model or get_nli_model()
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        return None # Stub models tokenize nothing
+    from .token_cache import load_or_build
+    with PROFILER.stage("nli.token_cache_load"):
+        use_token_cache(load_or_build(tokenizer))
+    return _token_cache
+
+def _load_and_warm(warm: bool):
+    model = get_nli_model()
+    if model is None:
+        return
+    if NLI_TOKEN_CACHE:
         try:
-            _model_instance = CrossEncoder(MODEL_NAME)
-            print("[NLI] Model loaded successfully.")
+            load_token_cache(model)
         except Exception as e:
-            print(f"[NLI] Failed to load model: {e}")
-            return None
-    return _model_instance
+            print(f"[NLI] Token cache unavailable (tokenizing per call): {e}")
+    if warm and _backend != "remote": # The server warms its own model
+        _status["state"] = "warming"
+        try:
+            warm_up(model)
+        except Exception as e:
+            print(f"[NLI] Warm-up failed (model still usable): {e}")
+    _status["state"] = "ready"
+    _ready_event.set()
 
-def check_local_consistency(claim_text: str, evidence_list: list) -> dict:
+def preload_nli_model(background: bool = True, warm: bool = NLI_WARMUP):
     """
-    Uses local NLI to check for contradictions.
-    Returns: {"label": "CONTRADICT"|"SUPPORT"|"NONE", "confidence": float} or None (if unsure).
+    Starts loading (and warming) the model eagerly. Idempotent.
+    In background mode returns immediately; use `wait_for_model` / `get_model_status`.
+    """
+    global _preload_thread, _warm_requested
+    with _model_lock:
+        if _preload_thread is not None or _status["state"] == "ready":
+            return _preload_thread
+        _warm_requested = warm
+        _status["state"] = "warming" if _model_instance is not None else "loading"
+        if background:
+            _preload_thread = threading.Thread(target=_load_and_warm, args=(warm,), name="nli-preload", daemon=True)
+            _preload_thread.start()
+            return _preload_thread
+    _load_and_warm(warm)
+    return None
+
+def wait_for_model(timeout: float = None) -> bool:
+    """Blocks until the model is ready (True) or failed / timed out (False)."""
+    if _status["state"] == "idle":
+        preload_nli_model(background=False)
+    _ready_event.wait(timeout)
+    return _status["state"] == "ready"
+
+def get_model_status() -> dict:
+    """Snapshot of the model lifecycle for UIs and batch runners."""
+    return dict(_status, model=MODEL_NAME)
+
+def _predict_cached(model, pairs: list, premise_ids: list):
+    """
+    Cross-encoder logits from cached premise token ids: only the claims are
+    tokenized here. Premises are truncated to fit the model's max length.
+    """
+    import torch
+    tokenizer = model.tokenizer
+    max_length = min(getattr(model, "max_length", None) or tokenizer.model_max_length, 512)
+    n_special = tokenizer.num_special_tokens_to_add(pair=True)
+    use_type_ids = "token_type_ids" in tokenizer.model_input_names
+
+    claim_ids = {}
+    features = []
+    for (_, claim_text), premise in zip(pairs, premise_ids):
+        if claim_text not in claim_ids:
+            claim_ids[claim_text] = tokenizer.encode(claim_text, add_special_tokens=False)
+        hypothesis = claim_ids[claim_text]
+        premise = premise[:max(max_length - n_special - len(hypothesis), 0)].tolist()
+        feature = {"input_ids": tokenizer.build_inputs_with_special_tokens(premise, hypothesis)}
+        if use_type_ids:
+            feature["token_type_ids"] = tokenizer.create_token_type_ids_from_sequences(premise, hypothesis)
+        features.append(feature)
+
+    batch = tokenizer.pad(features, return_tensors="pt")
+    hf_model = model.model
+    with torch.no_grad():
+        logits = hf_model(**{k: v.to(hf_model.device) for k, v in batch.items()}).logits
+    return logits.float().cpu().numpy()
+
+def _predict(model, pairs: list, chunk_ids: list):
+    """
+    Logits for (premise, claim) pairs. Premises whose chunk is in the token
+    cache (with the same text) skip re-tokenization; the rest go through model.predict.
+    """
+    if getattr(model, "accepts_chunk_ids", False):
+        return np.asarray(model.predict(pairs, chunk_ids=chunk_ids)) # The server owns the token cache
+    premise_ids = {}
+    if _token_cache is not None and hasattr(model, "model") and hasattr(model, "tokenizer"):
+        for i, (cid, (premise, _)) in enumerate(zip(chunk_ids, pairs)):
+            ids = _token_cache.get(cid, premise)
+            if ids is not None:
+                premise_ids[i] = ids
+    cached = sorted(premise_ids)
+    PROFILER.cache("nli_premise_tokens", hit=bool(cached))
+    if not cached:
+        return np.asarray(model.predict(pairs))
+
+    logits = np.zeros((len(pairs), 3))
+    logits[cached] = _predict_cached(model, [pairs[i] for i in cached], [premise_ids[i] for i in cached])
+    rest = sorted(set(range(len(pairs))) - set(cached))
+    if rest:
+        logits[rest] = model.predict([pairs[i] for i in rest])
+    return logits
+
+def _chunk_id(evidence: dict):
+    return evidence.get("metadata", {}).get("chunk_id")
+
+def score_pairs(claim_text: str, evidence_list: list):
+    """
+    Raw NLI probabilities for every (evidence, claim) pair.
+    Returns an (n_evidence, 3) array [contradiction, entailment, neutral], or None.
+    Used by the tuning harness to record probabilities once and replay decisions.
     """
     model = get_nli_model()
     if not model or not evidence_list:
         return None
-
-    # Prepare pairs: (Claim, Evidence)
-    # Note: NLI usually expects (Premise, Hypothesis).
-    # Premise = Evidence, Hypothesis = Claim.
     pairs = [(e["text"], claim_text) for e in evidence_list]
-    
+    with PROFILER.stage("nli.inference"):
+        scores = _predict(model, pairs, [_chunk_id(e) for e in evidence_list])
+    PROFILER.count("nli.pairs_scored", len(pairs))
+    return _softmax(scores)
+
+def score_pairs_batch(items: list) -> list:
+    """
+    Scores several claims in one model call.
+    items: [(claim_text, evidence_list)]. Returns one (n_evidence, 3) array per
+    item (None for items without evidence), or None if the model is unavailable.
+    """
+    model = get_nli_model()
+    if not model:
+        return None
+    pairs, chunk_ids, bounds = [], [], []
+    for claim_text, evidence_list in items:
+        start = len(pairs)
+        pairs.extend((e["text"], claim_text) for e in evidence_list)
+        chunk_ids.extend(_chunk_id(e) for e in evidence_list)
+        bounds.append((start, len(pairs)))
+    if not pairs:
+        return [None] * len(items)
+    with PROFILER.stage("nli.inference"):
+        scores = _predict(model, pairs, chunk_ids)
+    PROFILER.count("nli.pairs_scored", len(pairs))
+    probs = _softmax(np.asarray(scores))
+    return [probs[a:b] if b > a else None for a, b in bounds]
+
+def label_probabilities(probs, contradict_threshold: float = CONTRADICT_THRESHOLD,
+                        entail_threshold: float = ENTAIL_THRESHOLD) -> list:
+    """Per-excerpt verdicts for an (n_evidence, 3) probability matrix."""
+    probs = np.asarray(probs)
+    labels = np.where(probs[:, IDX_CONTRA] > contradict_threshold, "CONTRADICT",
+                      np.where(probs[:, IDX_ENTAIL] > entail_threshold, "SUPPORT", "NONE"))
+    return labels.tolist()
+
+def score_evidence(claim_text: str, evidence_list: list,
+                   contradict_threshold: float = CONTRADICT_THRESHOLD,
+                   entail_threshold: float = ENTAIL_THRESHOLD) -> dict:
+    """
+    Scores a claim against all its evidence and keeps the full picture:
+    the (n_evidence, 3) probability matrix, the per-excerpt labels and the
+    index of the decisive excerpt.
+    Returns None if the model is unavailable or there is no evidence.
+    Label is "NONE" when neither threshold is crossed (ambiguous).
+    """
     try:
-        # Predict scores (logits)
-        scores = model.predict(pairs)
-        # Convert to probabilities (softmax) if needed, or just look at max
-        # Labels: 0differs based on model. For DeBERTa-NLI:
-        # usually 0: Contradiction, 1: Entailment, 2: Neutral (check model card)
-        # Actually cross-encoder/nli* usually: 0: Contradiction, 1: Entailment, 2: Neutral
-        
-        # We want to find ANY contradiction with high confidence
-        # or Strong Entailment.
-        
-        best_label = "NONE"
-        best_conf = 0.0
-        
-        # Aggregate logic: If ANY evidence strongly contradicts -> Contradiction.
-        # If ANY evidence strongly supports -> Support.
-        # Contradiction overrides Support.
-        
-        probs = torch.nn.functional.softmax(torch.tensor(scores), dim=1).numpy()
-        
-        # Mapping for this specific model:
-        # 0: Contradiction, 1: Entailment, 2: Neutral 
-        # (Double check: standard is usually Entailment, Neutral, Contradiction?
-        #  Let's verify via generic logic or assume standard MNLI mapping: 
-        #  0: Contradiction, 1: Entailment, 2: Neutral is common for *some*, 
-        #  but `cross-encoder/nli-deberta-v3-*` follows MNLI: 0: Contradiction, 1: Entailment, 2: Neutral?
-        #  Wait, actually many use: 0: Contradiction, 1: Entailment, 2: Neutral
-        #  AutoModelForSequenceClassification default config:
-        #  label2id: {'contradiction': 0, 'entailment': 1, 'neutral': 2}
-        
-        idx_contra = 0
-        idx_entail = 1
-        idx_neutral = 2
-        
-        max_contra = 0.0
-        max_entail = 0.0
-        
-        for p in probs:
-            c = p[idx_contra]
-            e = p[idx_entail]
-            
-            if c > max_contra: max_contra = c
-            if e > max_entail: max_entail = e
-            
-        print(f"  [NLI Debug] Contra: {max_contra:.2f}, Entail: {max_entail:.2f}")
-
-        # Thresholds
-        if max_contra > 0.8:
-            return {"label": "CONTRADICT", "confidence": float(max_contra), "source": "Local-NLI"}
-        elif max_entail > 0.8:
-            return {"label": "SUPPORT", "confidence": float(max_entail), "source": "Local-NLI"}
-            
-        # If ambiguous, return None to let LLM decide
+        probs = score_pairs(claim_text, evidence_list)
+    except Exception as e:
+        print(f"[NLI] Inference error: {e}")
+        return None
+    if probs is None:
         return None
+    return decide_from_probabilities(probs, contradict_threshold, entail_threshold)
 
+def score_evidence_batch(items: list,
+                         contradict_threshold: float = CONTRADICT_THRESHOLD,
+                         entail_threshold: float = ENTAIL_THRESHOLD) -> list:
+    """
+    `score_evidence` for many claims with a single batched model call.
+    items: [(claim_text, evidence_list)]. Returns a result (or None) per item.
+    """
+    try:
+        probs_list = score_pairs_batch(items)
     except Exception as e:
         print(f"[NLI] Inference error: {e}")
+        return [None] * len(items)
+    if probs_list is None:
+        return [None] * len(items)
+    return [decide_from_probabilities(p, contradict_threshold, entail_threshold) if p is not None else None
+            for p in probs_list]
+
+def decide_from_probabilities(probs, contradict_threshold: float = CONTRADICT_THRESHOLD,
+                              entail_threshold: float = ENTAIL_THRESHOLD) -> dict:
+    """Claim verdict, decisive excerpt and per-excerpt labels from an (n_evidence, 3) matrix."""
+    # Aggregate logic: If ANY evidence strongly contradicts -> Contradiction.
+    # If ANY evidence strongly supports -> Support.
+    # Contradiction overrides Support.
+    contra_index = int(np.argmax(probs[:, IDX_CONTRA]))
+    entail_index = int(np.argmax(probs[:, IDX_ENTAIL]))
+    max_contra = float(probs[contra_index, IDX_CONTRA])
+    max_entail = float(probs[entail_index, IDX_ENTAIL])
+
+    print(f"  [NLI Debug] Contra: {max_contra:.2f}, Entail: {max_entail:.2f}")
+
+    if max_contra > contradict_threshold:
+        label, confidence, evidence_index = "CONTRADICT", max_contra, contra_index
+    elif max_entail > entail_threshold:
+        label, confidence, evidence_index = "SUPPORT", max_entail, entail_index
+    else:
+        # Ambiguous: point at the closest call towards contradiction
+        label, confidence, evidence_index = "NONE", max_contra, contra_index
+
+    return {
+        "label": label,
+        "confidence": confidence,
+        "source": "Local-NLI",
+        "evidence_index": evidence_index,
+        "max_contra": max_contra,
+        "max_entail": max_entail,
+        "probabilities": probs,
+        "excerpt_labels": label_probabilities(probs, contradict_threshold, entail_threshold),
+    }
+
+def check_local_consistency(claim_text: str, evidence_list: list,
+                            contradict_threshold: float = CONTRADICT_THRESHOLD,
+                            entail_threshold: float = ENTAIL_THRESHOLD) -> dict:
+    """
+    Uses local NLI to check for contradictions.
+    Returns: {"label": "CONTRADICT"|"SUPPORT", "confidence": float, ...} or None (if unsure).
+    The result also carries the probability matrix and decisive excerpt index
+    (see `score_evidence`).
+    """
+    result = score_evidence(claim_text, evidence_list, contradict_threshold, entail_threshold)
+    if result is None or result["label"] == "NONE":
+        # If ambiguous, return None to let LLM decide
         return None
+    return result
@@ -0,0 +1,192 @@
+"""
+Sharded NLI worker pool for CPU-only hosts.
+
+One CrossEncoder with many intra-op threads scales poorly on short
+sequences, so this mode runs N worker processes, each with its own model
+and a fixed thread count (pinned to its own cores where the OS allows),
+and splits every pair batch into contiguous shards scored in parallel.
+Results are concatenated in input order.
+
+NLIWorkerPool exposes `predict(pairs) -> logits` like the CrossEncoder, so
+nli_engine uses it as the model when NLI_BACKEND = "pool". Workers x threads
+come from NLI_POOL_WORKERS / NLI_POOL_THREADS, or from the per-host choice
+of `autotune` in NLI_POOL_TUNING_PATH. Autotuning loads several model
+copies, so it only runs explicitly:
+
+    python -m src.nli_pool
+
+Until then the pool uses `default_layout` (few workers, capped by free memory).
+"""
+import atexit
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .config import NLI_POOL_WORKERS, NLI_POOL_THREADS, NLI_POOL_TUNING_PATH
+
+MIN_SHARD_PAIRS = 4 # Smaller batches are not worth a round trip to another process
+TUNING_BATCH_PAIRS = 64
+TUNING_ROUNDS = 3
+DEFAULT_MAX_WORKERS = 2
+# Rough resident size of one worker running nli-deberta-v3-small: ~142M parameters (mostly the
+# 128k-token embedding table) as fp32 weights, plus ~400 MB of torch/tokenizer runtime
+WORKER_MEMORY_MB = 142 * 4 + 400
+
+def _load_cross_encoder():
+    from sentence_transformers import CrossEncoder
+    from .nli_engine import MODEL_NAME
+    return CrossEncoder(MODEL_NAME)
+
+# --- Worker process state ---
+
+_worker_model = None
+
+def _init_worker(model_factory, threads: int, next_index, cores_per_worker: int):
+    global _worker_model
+    with next_index.get_lock():
+        index = next_index.value
+        next_index.value += 1
+    # Pin to a disjoint core range when the OS supports it
+    if hasattr(os, "sched_setaffinity") and cores_per_worker:
+        cores = sorted(os.sched_getaffinity(0))
+        mine = cores[index * cores_per_worker:(index + 1) * cores_per_worker]
+        if mine:
+            os.sched_setaffinity(0, mine)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_model = model_factory()
+
+def _worker_predict(pairs):
+    return np.asarray(_worker_model.predict(pairs))
+
+def _worker_ping(_):
+    return os.getpid()
+
+class NLIWorkerPool:
+    def __init__(self, n_workers: int, threads_per_worker: int = 1, model_factory=_load_cross_encoder):
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker
+        ctx = multiprocessing.get_context("spawn") # Fresh interpreters: no forked torch state
+        next_index = ctx.Value("i", 0)
+        cores_per_worker = threads_per_worker if n_workers * threads_per_worker <= (os.cpu_count() or 1) else 0
+        self._executor = ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=ctx, initializer=_init_worker,
+            initargs=(model_factory, threads_per_worker, next_index, cores_per_worker))
+        print(f"[NLI Pool] {n_workers} workers x {threads_per_worker} threads")
+
+    def start(self):
+        """Forces every worker to spawn and load its model (otherwise done on first use)."""
+        list(self._executor.map(_worker_ping, range(self.n_workers)))
+        return self
+
+    def predict(self, pairs):
+        """Logits for all pairs, sharded across workers, in input order."""
+        pairs = list(pairs)
+        if not pairs:
+            return np.zeros((0, 3))
+        n_shards = max(1, min(self.n_workers, len(pairs) // MIN_SHARD_PAIRS))
+        bounds = np.linspace(0, len(pairs), n_shards + 1).astype(int)
+        shards = [pairs[a:b] for a, b in zip(bounds, bounds[1:])]
+        return np.concatenate(list(self._executor.map(_worker_predict, shards)))
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+# --- Self-tuning ---
+
+def candidate_layouts(n_cores: int) -> list:
+    """(workers, threads) layouts that use at most n_cores, threads a power of two."""
+    layouts = []
+    threads = 1
+    while threads <= n_cores:
+        for workers in sorted({1, 2, n_cores // threads // 2, n_cores // threads}):
+            if workers >= 1 and workers * threads <= n_cores:
+                layouts.append((workers, threads))
+        threads *= 2
+    return sorted(set(layouts))
+
+def _tuning_pairs(n: int) -> list:
+    premise = " ".join(["the old sailor returned to the harbour at dawn"] * 12)
+    return [(premise, f"The sailor returned to the harbour in the year {1800 + i}.") for i in range(n)]
+
+def autotune(model_factory=_load_cross_encoder, layouts: list = None, batch_pairs: int = TUNING_BATCH_PAIRS,
+             rounds: int = TUNING_ROUNDS, save_path=NLI_POOL_TUNING_PATH) -> dict:
+    """
+    Measures pairs/s for each (workers, threads) layout on a synthetic batch
+    and returns the best {"workers", "threads", "pairs_per_s", "results"}.
+    """
+    layouts = layouts or candidate_layouts(os.cpu_count() or 1)
+    pairs = _tuning_pairs(batch_pairs)
+    results = []
+    for workers, threads in layouts:
+        pool = NLIWorkerPool(workers, threads, model_factory).start()
+        try:
+            pool.predict(pairs) # Warm-up
+            start = time.perf_counter()
+            for _ in range(rounds):
+                pool.predict(pairs)
+            rate = rounds * len(pairs) / (time.perf_counter() - start)
+        finally:
+            pool.close()
+        results.append({"workers": workers, "threads": threads, "pairs_per_s": rate})
+        print(f"[NLI Pool] {workers} x {threads}: {rate:.1f} pairs/s")
+
+    best = max(results, key=lambda r: r["pairs_per_s"])
+    choice = {**best, "cpu_count": os.cpu_count(), "results": results}
+    if save_path:
+        os.makedirs(save_path.parent, exist_ok=True)
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(choice, f, indent=2)
+    return choice
+
+def _available_memory_mb():
+    """Free physical memory in MB, or None where sysconf does not report it."""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2**20
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def default_layout(n_cores: int = None, available_mb: int = None) -> tuple:
+    """
+    Untuned layout: at most DEFAULT_MAX_WORKERS workers, no more than free
+    memory holds at WORKER_MEMORY_MB each, splitting the cores between them.
+    """
+    n_cores = n_cores or os.cpu_count() or 1
+    available_mb = available_mb if available_mb is not None else _available_memory_mb()
+    workers = min(DEFAULT_MAX_WORKERS, n_cores)
+    if available_mb is not None:
+        workers = min(workers, available_mb // WORKER_MEMORY_MB)
+    workers = max(workers, 1)
+    return workers, max(n_cores // workers, 1)
+
+def pool_layout() -> tuple:
+    """Configured layout, else the tuning result for this host, else `default_layout` (never autotunes)."""
+    if NLI_POOL_WORKERS > 0:
+        return NLI_POOL_WORKERS, max(NLI_POOL_THREADS, 1)
+    if NLI_POOL_TUNING_PATH.exists():
+        with open(NLI_POOL_TUNING_PATH, encoding="utf-8") as f:
+            tuned = json.load(f)
+        if tuned.get("cpu_count") == os.cpu_count():
+            return tuned["workers"], tuned["threads"]
+    workers, threads = default_layout()
+    print(f"[NLI Pool] No tuning for this host; using {workers} workers x {threads} threads "
+          f"(run `python -m src.nli_pool` to tune).")
+    return workers, threads
+
+def create_worker_pool(model_factory=_load_cross_encoder) -> NLIWorkerPool:
+    workers, threads = pool_layout()
+    pool = NLIWorkerPool(workers, threads, model_factory).start()
+    atexit.register(pool.close)
+    return pool
+
+if __name__ == "__main__":
+    tuned = autotune()
+    print(f"[NLI Pool] Best layout: {tuned['workers']} workers x {tuned['threads']} threads "
+          f"({tuned['pairs_per_s']:.1f} pairs/s), saved to {NLI_POOL_TUNING_PATH}")
@@ -0,0 +1,207 @@
+"""
+Local NLI scoring server with dynamic request coalescing.
+
+The Streamlit app, batch runs and the agent path can share one DeBERTa
+copy: the server loads the model once (local or pool backend) and every
+client sends its (premise, claim) pairs to POST /v1/nli. Concurrent
+requests are coalesced by a single batcher thread into one model call of
+up to NLI_BATCH_MAX_PAIRS pairs, waiting at most NLI_BATCH_MAX_WAIT_MS for
+other requests to join, and the logits are split back per request.
+
+Clients set NLI_BACKEND=remote; nli_engine then scores through
+RemoteNLIModel instead of loading a model. Optional chunk_ids (one per pair)
+let the premise token cache apply; a cached entry is only used when its
+text hash matches the premise sent, so a wrong chunk id costs a cache miss,
+never a wrong score.
+
+    python -m src.nli_server             # serves on 8766
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from . import nli_engine
+from .config import (NLI_BACKEND, NLI_SERVER_URL, NLI_SERVER_PORT, NLI_BATCH_MAX_PAIRS,
+                     NLI_BATCH_MAX_WAIT_MS, NLI_REMOTE_TIMEOUT)
+from .profiling import PROFILER
+
+class _Request:
+    __slots__ = ("pairs", "chunk_ids", "done", "logits", "error")
+
+    def __init__(self, pairs, chunk_ids):
+        self.pairs = pairs
+        self.chunk_ids = chunk_ids if chunk_ids is not None else [None] * len(pairs)
+        self.done = threading.Event()
+        self.logits = None
+        self.error = None
+
+class BatchCoalescer:
+    """
+    Collects requests from many threads into dynamically sized batches: the
+    first waiting request opens a window of max_wait_ms, closed early once
+    max_pairs pairs have joined (a request is never split, so one batch can
+    overshoot the cap by its last request).
+    """
+    def __init__(self, model, max_pairs: int = NLI_BATCH_MAX_PAIRS, max_wait_ms: float = NLI_BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.max_pairs = max_pairs
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="nli-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, pairs: list, chunk_ids: list = None):
+        """Blocks until the batch containing these pairs is scored; returns their logits."""
+        if not pairs:
+            return np.zeros((0, 3))
+        request = _Request(pairs, chunk_ids)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.logits
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        n_pairs = len(batch[0].pairs)
+        deadline = time.perf_counter() + self.max_wait
+        while n_pairs < self.max_pairs:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_pairs += len(request.pairs)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            pairs = [p for r in batch for p in r.pairs]
+            chunk_ids = [c for r in batch for c in r.chunk_ids]
+            PROFILER.count("nli_server.batches")
+            PROFILER.count("nli_server.requests", len(batch))
+            PROFILER.count("nli_server.pairs", len(pairs))
+            try:
+                with PROFILER.stage("nli_server.predict"):
+                    logits = nli_engine._predict(self.model, pairs, chunk_ids)
+                start = 0
+                for request in batch:
+                    request.logits = logits[start:start + len(request.pairs)]
+                    start += len(request.pairs)
+            except Exception as e:
+                print(f"[NLI Server] Batch of {len(pairs)} pairs failed: {e}")
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+class RemoteNLIModel:
+    """Client for the scoring server with the CrossEncoder `predict` interface."""
+    accepts_chunk_ids = True # Lets the server's premise token cache apply
+
+    def __init__(self, url: str = NLI_SERVER_URL, timeout: float = NLI_REMOTE_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def check(self):
+        """Fails fast when no server is listening."""
+        import requests
+        response = requests.get(f"{self.url}/health", timeout=5)
+        response.raise_for_status()
+        print(f"[NLI] Using scoring server at {self.url} ({response.json().get('model')}).")
+        return self
+
+    def predict(self, pairs, chunk_ids: list = None):
+        import requests
+        payload = {"pairs": [list(p) for p in pairs]}
+        if chunk_ids is not None:
+            payload["chunk_ids"] = list(chunk_ids)
+        with PROFILER.stage("nli.remote"):
+            response = requests.post(f"{self.url}/v1/nli", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return np.asarray(response.json()["logits"], dtype=np.float64).reshape(-1, 3)
+
+def make_server(coalescer: BatchCoalescer, host: str = "127.0.0.1", port: int = NLI_SERVER_PORT):
+    class NLIHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != '/v1/nli':
+                self.send_response(404)
+                self.end_headers()
+                return
+            try:
+                content_length = int(self.headers['Content-Length'])
+                data = json.loads(self.rfile.read(content_length).decode('utf-8'))
+                pairs = [tuple(p) for p in data.get("pairs", [])]
+                chunk_ids = data.get("chunk_ids")
+            except Exception as e:
+                self._send_json(400, {"error": f"Malformed request: {e}"})
+                return
+            if any(len(p) != 2 for p in pairs):
+                self._send_json(400, {"error": "Each pair must be [premise, claim]."})
+                return
+            if chunk_ids is not None and len(chunk_ids) != len(pairs):
+                self._send_json(400, {"error": f"{len(chunk_ids)} chunk_ids for {len(pairs)} pairs."})
+                return
+            try:
+                logits = coalescer.submit(pairs, chunk_ids)
+                self._send_json(200, {"logits": np.asarray(logits).tolist()})
+            except Exception as e:
+                print(f"[NLI Server] Error: {e}")
+                self._send_json(500, {"error": str(e)})
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json(200, nli_engine.get_model_status())
+            elif self.path == '/metrics':
+                body = PROFILER.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-type', 'text/plain; version=0.0.4')
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_response(404)
+                self.end_headers()
+
+        def log_message(self, format, *args):
+            return # Silence logs
+
+    server = ThreadingHTTPServer((host, port), NLIHandler)
+    server.daemon_threads = True
+    return server
+
+def run_server(host: str = "127.0.0.1", port: int = NLI_SERVER_PORT,
+               max_pairs: int = NLI_BATCH_MAX_PAIRS, max_wait_ms: float = NLI_BATCH_MAX_WAIT_MS):
+    # The server holds the real model: "remote" here would point it at itself
+    nli_engine.use_backend("local" if NLI_BACKEND == "remote" else NLI_BACKEND)
+    nli_engine.preload_nli_model(background=False)
+    model = nli_engine.get_nli_model()
+    if model is None:
+        raise SystemExit("[NLI Server] Model failed to load.")
+    server = make_server(BatchCoalescer(model, max_pairs, max_wait_ms), host, port)
+    print(f"[NLI Server] Running on {port} (batches up to {max_pairs} pairs, {max_wait_ms} ms window)...")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared NLI scoring server")
+    parser.add_argument("--port", type=int, default=NLI_SERVER_PORT)
+    parser.add_argument("--max-pairs", type=int, default=NLI_BATCH_MAX_PAIRS)
+    parser.add_argument("--max-wait-ms", type=float, default=NLI_BATCH_MAX_WAIT_MS)
+    args = parser.parse_args()
+    run_server(port=args.port, max_pairs=args.max_pairs, max_wait_ms=args.max_wait_ms)
@@ -0,0 +1,265 @@
+"""
+End-to-end Pathway dataflow: backstories -> claims -> retrieval -> NLI -> results.
+
+Instead of an external Python loop calling the vector store over HTTP per
+query, the whole pipeline runs inside the Pathway engine:
+
+    backstory CSV rows (streaming table)
+      -> claims UDF, flattened to one row per claim
+      -> one row per retrieval query, answered by DocumentStore.retrieve_query
+         (BM25 over the novels, in-engine)
+      -> hits grouped back per claim and reranked
+      -> batched NLI UDF (score_claims + decide_claims over a whole batch)
+      -> decisions grouped per story, aggregated once every claim is decided
+      -> subscriber: dossier store + ResultsWriter (RESULTS_CSV)
+
+Inputs default to data/train.csv and data/test.csv; in streaming mode rows
+appended to them (or files added to an input directory) are processed
+incrementally. A story whose verdict is updated (e.g. its row changed) is
+recorded again: the later results row and dossier supersede the earlier.
+Requires a Pathway release with the LLM xpack DocumentStore and the Tantivy
+BM25 index (pathway[xpack-llm]); the helpers below are plain Python.
+
+    python -m src.pathway_dataflow [--input data/train.csv data/test.csv] [--static]
+"""
+import argparse
+import json
+import os
+
+from .claim_extraction import extract_claims
+from .query_planner import collapse_equivalent
+from .retrieval import rerank_results
+from .reasoning_llm import score_claims, decide_claims
+from .aggregation import aggregate_decisions
+from .rationale_builder import build_dossier, build_submission_rationale, collect_dossier_entries
+from .dossier_store import get_dossier_store
+from .results_sink import ResultsWriter
+from .profiling import PROFILER
+from .config import TRAIN_CSV, TEST_CSV, NOVELS_DIR, RESULTS_CSV, RETRIEVAL_K, DETAIL_RETRIEVAL_K
+
+DEFAULT_INPUTS = (TRAIN_CSV, TEST_CSV)
+
+NLI_UDF_BATCH_SIZE = 32 # Claims per batched NLI UDF call (one model call each)
+# Document chunks of roughly the fallback index's 1000 characters
+SPLITTER_MIN_TOKENS = 100
+SPLITTER_MAX_TOKENS = 250
+
+def _plain(value):
+    """JSON-safe copy (numpy scalars/arrays become Python numbers/lists)."""
+    return json.loads(json.dumps(value, default=lambda o: o.tolist()))
+
+# --- Row logic (plain Python, wrapped as UDFs in build_dataflow) ---
+
+def claim_rows(story_id: str, content: str, char: str = None) -> list:
+    """Claims of one backstory, each tagged with its position and the story's claim count."""
+    claims = extract_claims(content or "", story_id, char or None)
+    PROFILER.count("claims", len(claims))
+    return [{**c, "position": i, "n_claims": len(claims)} for i, c in enumerate(claims)]
+
+def claim_queries(claim: dict) -> list:
+    """[{"query", "k"}] issued for a claim: detail claims get the shallow claim-text query only."""
+    if claim.get("importance") == "detail":
+        return [{"query": claim["text"], "k": DETAIL_RETRIEVAL_K}]
+    queries = collapse_equivalent([claim["text"]] + claim.get("adversarial_queries", []))
+    return [{"query": q, "k": RETRIEVAL_K} for q in queries]
+
+def merge_hits(claim: dict, results: list) -> list:
+    """
+    Evidence for a claim from the DocumentStore results of all its queries:
+    deduplicated by text, in the Evidence shape, reranked like retrieve_evidence.
+    """
+    unique = {}
+    for hits in results:
+        for hit in hits or []:
+            if hit["text"] in unique:
+                PROFILER.count("retrieval.duplicate_hits")
+                continue
+            # Tantivy BM25 reports distance = -score
+            unique[hit["text"]] = {"text": hit["text"], "score": -float(hit.get("dist", 0.0)),
+                                   "metadata": hit.get("metadata", {})}
+    k = DETAIL_RETRIEVAL_K if claim.get("importance") == "detail" else RETRIEVAL_K
+    return rerank_results(claim, list(unique.values()), k) if unique else []
+
+def decide_batch(claims: list, evidence: list) -> list:
+    """Decisions for a batch of claims with one symbolic pass and one NLI model call."""
+    evidence_map = {c["id"]: ev for c, ev in zip(claims, evidence)}
+    with PROFILER.stage("reasoning"):
+        decisions = decide_claims(claims, evidence_map, score_claims(claims, evidence_map))
+    return [_plain(d) for d in decisions]
+
+def story_verdict(story_id: str, decisions: list) -> dict:
+    """
+    Aggregate + rationale for a story whose claims are all decided (claim
+    order restored). Pure, so the engine may recompute it; the dossier is
+    written by the subscriber (see `VerdictSink`).
+    """
+    decisions = sorted(decisions, key=lambda d: d["position"])
+    result = aggregate_decisions(decisions, story_id)
+    rationale = build_submission_rationale(collect_dossier_entries(decisions), result["prediction"])
+    return {"prediction": int(result["prediction"]), "rationale": rationale, "decisions": decisions}
+
+class VerdictSink:
+    """
+    Subscriber for the results table. Tracks the live verdict of every story
+    through additions and retractions, and at the end of each engine time
+    step records the stories whose verdict changed: dossier first, then the
+    results row. Retracted stories without a replacement are only logged
+    (the results file is append-only).
+    """
+    def __init__(self, writer: ResultsWriter, store=None):
+        self.writer = writer
+        self.store = store or get_dossier_store()
+        self.current = {}   # story_id -> [(row key, verdict)] live rows (retractions and
+                            # additions of one update can arrive in either order)
+        self.recorded = {}  # story_id -> (prediction, rationale) last written
+        self.changed = set()
+
+    def on_change(self, key, row, time, is_addition):
+        story_id = row["story_id"]
+        verdict = getattr(row["verdict"], "value", row["verdict"]) # pw.Json -> dict
+        live = self.current.setdefault(story_id, [])
+        if is_addition:
+            live.append((key, verdict))
+        elif (key, verdict) in live:
+            live.remove((key, verdict))
+        self.changed.add(story_id)
+
+    def on_time_end(self, time):
+        for story_id in sorted(self.changed):
+            if not self.current.get(story_id):
+                self.current.pop(story_id, None)
+                if story_id in self.recorded:
+                    print(f"[Dataflow] Verdict for {story_id} was retracted; its last result stays recorded.")
+                continue
+            verdict = self.current[story_id][-1][1]
+            recorded = (verdict["prediction"], verdict["rationale"])
+            if self.recorded.get(story_id) == recorded:
+                continue
+            build_dossier(story_id, verdict["decisions"], verdict["prediction"], self.store)
+            self.writer.write(story_id, *recorded)
+            print(f"[Dataflow] {'Updated' if story_id in self.recorded else 'Recorded'} result for {story_id}.")
+            self.recorded[story_id] = recorded
+        self.changed.clear()
+
+    def on_end(self):
+        self.writer.close()
+        self.store.flush()
+
+# --- Dataflow ---
+
+def build_dataflow(input_paths=DEFAULT_INPUTS, novels_dir=NOVELS_DIR, mode: str = "streaming"):
+    """
+    Builds the graph over the backstory CSVs (files or directories);
+    returns the results table (story_id, verdict {prediction, rationale, decisions}).
+    """
+    from .pathway_pipeline import _load_pathway
+    pw = _load_pathway()
+    if pw is None:
+        raise RuntimeError("Pathway is not available (Linux/macOS with `pip install pathway[xpack-llm]`).")
+    from pathway.stdlib.indexing import TantivyBM25Factory
+    from pathway.xpacks.llm.document_store import DocumentStore
+    from pathway.xpacks.llm.parsers import ParseUtf8
+    from pathway.xpacks.llm.splitters import TokenCountSplitter
+
+    class BackstorySchema(pw.Schema):
+        id: str = pw.column_definition(primary_key=True)
+        book_name: str
+        char: str
+        content: str
+
+    @pw.udf
+    def claims_udf(story_id: str, content: str, char: str) -> list[pw.Json]:
+        return [pw.Json(c) for c in claim_rows(story_id, content, char)]
+
+    @pw.udf
+    def queries_udf(claim: pw.Json) -> list[pw.Json]:
+        return [pw.Json(q) for q in claim_queries(claim.value)]
+
+    @pw.udf
+    def merge_udf(claim: pw.Json, results: tuple) -> pw.Json:
+        return pw.Json(merge_hits(claim.value, [r.value for r in results]))
+
+    @pw.udf(max_batch_size=NLI_UDF_BATCH_SIZE)
+    def decide_udf(claims: list[pw.Json], evidence: list[pw.Json]) -> list[pw.Json]:
+        decisions = decide_batch([c.value for c in claims], [e.value for e in evidence])
+        return [pw.Json({**d, "position": c.value["position"]}) for c, d in zip(claims, decisions)]
+
+    @pw.udf
+    def verdict_udf(story_id: str, decisions: tuple) -> pw.Json:
+        return pw.Json(story_verdict(story_id, [d.value for d in decisions]))
+
+    @pw.udf
+    def empty_verdict_udf(story_id: str) -> pw.Json:
+        return pw.Json(story_verdict(story_id, []))
+
+    # Document index: the novels, chunked like the fallback index, BM25 in-engine
+    documents = pw.io.fs.read(path=str(novels_dir), format="binary", mode=mode, with_metadata=True)
+    store = DocumentStore(
+        documents,
+        retriever_factory=TantivyBM25Factory(),
+        parser=ParseUtf8(),
+        splitter=TokenCountSplitter(min_tokens=SPLITTER_MIN_TOKENS, max_tokens=SPLITTER_MAX_TOKENS),
+    )
+
+    # 1. Backstories -> one row per claim
+    sources = [pw.io.csv.read(str(path), schema=BackstorySchema, mode=mode) for path in input_paths]
+    stories = pw.Table.concat_reindex(*sources) if len(sources) > 1 else sources[0]
+    extracted = stories.select(story_id=pw.this.id, claims=claims_udf(pw.this.id, pw.this.content, pw.this.char))
+    extracted = extracted.with_columns(n_claims=pw.apply(len, pw.this.claims))
+    # Stories without claims never reach the per-claim branch
+    empty_verdicts = extracted.filter(pw.this.n_claims == 0).select(
+        pw.this.story_id, verdict=empty_verdict_udf(pw.this.story_id))
+    claims = (extracted.filter(pw.this.n_claims > 0)
+              .flatten(pw.this.claims)
+              .select(pw.this.story_id, claim=pw.this.claims))
+    claims = claims.select(pw.this.story_id, pw.this.claim, claim_id=pw.this.claim["id"].as_str(),
+                           n_claims=pw.this.claim["n_claims"].as_int())
+
+    # 2. Retrieval as a query table answered by the document store
+    queries = (claims.select(pw.this.claim_id, q=queries_udf(pw.this.claim))
+               .flatten(pw.this.q)
+               .select(pw.this.claim_id, query=pw.this.q["query"].as_str(), k=pw.this.q["k"].as_int(),
+                       metadata_filter=None, filepath_globpattern=None))
+    retrieved = store.retrieve_query(queries.select(pw.this.query, pw.this.k, pw.this.metadata_filter,
+                                                    pw.this.filepath_globpattern))
+    hits = (queries.join(retrieved, pw.left.id == pw.right.id)
+            .select(pw.left.claim_id, pw.right.result)
+            .groupby(pw.this.claim_id)
+            .reduce(pw.this.claim_id, results=pw.reducers.tuple(pw.this.result)))
+    evidence = claims.join(hits, pw.left.claim_id == pw.right.claim_id).select(
+        pw.left.story_id, pw.left.claim, pw.left.n_claims, evidence=merge_udf(pw.left.claim, pw.right.results))
+
+    # 3. Batched NLI
+    decisions = evidence.select(pw.this.story_id, pw.this.n_claims,
+                                decision=decide_udf(pw.this.claim, pw.this.evidence))
+
+    # 4. Aggregate once all of a story's claims are decided
+    verdicts = (decisions.groupby(pw.this.story_id)
+                .reduce(pw.this.story_id, n_claims=pw.reducers.max(pw.this.n_claims),
+                        n_decided=pw.reducers.count(), decisions=pw.reducers.tuple(pw.this.decision))
+                .filter(pw.this.n_decided == pw.this.n_claims)
+                .select(pw.this.story_id, verdict=verdict_udf(pw.this.story_id, pw.this.decisions)))
+    return pw.Table.concat_reindex(verdicts, empty_verdicts)
+
+def run_dataflow(input_paths=DEFAULT_INPUTS, novels_dir=NOVELS_DIR, mode: str = "streaming",
+                 results_path=RESULTS_CSV):
+    """Runs the dataflow, streaming each finished (or updated) story into the dossier store and results."""
+    from .pathway_pipeline import _load_pathway
+    input_paths = [p for p in input_paths if os.path.exists(p)]
+    if not input_paths:
+        raise FileNotFoundError("No backstory CSVs found (expected data/train.csv and/or data/test.csv).")
+    results = build_dataflow(input_paths, novels_dir, mode)
+    pw = _load_pathway()
+    store = get_dossier_store()
+    sink = VerdictSink(ResultsWriter(results_path, before_flush=store.flush), store)
+    pw.io.subscribe(results, on_change=sink.on_change, on_time_end=sink.on_time_end, on_end=sink.on_end)
+    print(f"[Dataflow] Processing backstories from {', '.join(map(str, input_paths))} ({mode})...")
+    pw.run(monitoring_level=pw.MonitoringLevel.NONE)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the claim pipeline as a Pathway dataflow")
+    parser.add_argument("--input", nargs="+", default=[str(p) for p in DEFAULT_INPUTS],
+                        help="Backstory CSV files (or directories of CSVs)")
+    parser.add_argument("--static", action="store_true", help="Process the current files and exit")
+    args = parser.parse_args()
+    run_dataflow(args.input, mode="static" if args.static else "streaming")
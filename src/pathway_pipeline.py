@@ -6,18 +6,24 @@ import sys
 # On native Windows, we switch to High-Fidelity Local Mode (BM25) to prevent crashes.
 IS_WINDOWS = (os.name == 'nt')
 
-if not IS_WINDOWS:
-    try:
-        import pathway as pw
-        from pathway.xpacks.llm import vector_store
-    except ImportError:
-        pw = None
-        vector_store = None
-else:
-    pw = None
-    vector_store = None
+# Pathway is imported lazily (see _load_pathway): it is heavy and only the
+# indexer process needs it.
+pw = None
+vector_store = None
+
+def _load_pathway():
+    global pw, vector_store
+    if pw is None and not IS_WINDOWS:
+        try:
+            import pathway as pw
+            from pathway.xpacks.llm import vector_store
+        except ImportError:
+            pw = None
+            vector_store = None
+    return pw
 
 from .config import NOVELS_DIR, PATHWAY_LICENSE_KEY, OPENAI_API_KEY, LLM_MODEL, USE_DUMMY_LLM
+from .profiling import PROFILER
 
 # Ensure environment variables are set
 if PATHWAY_LICENSE_KEY:
@@ -46,6 +52,7 @@ class ProductionNovelIndexer:
 
     def build_from_dir(self, novels_dir=NOVELS_DIR):
         """Track A: pw.xpacks.llm.vector_store for long novels"""
+        _load_pathway()
         
         # Step 1: Read files (Data Ingestion)
         data_source = pw.io.fs.read(
@@ -86,53 +93,27 @@ class ProductionNovelIndexer:
         # Check if Pathway is properly loaded
         pathway_available = False
         try:
-            if pw and hasattr(pw, 'io'):
+            if _load_pathway() and hasattr(pw, 'io'):
                 pathway_available = True
         except:
             pass
             
         if USE_DUMMY_LLM or not pathway_available:
-            import time
             from http.server import HTTPServer, BaseHTTPRequestHandler
             import json
-            import glob
-            from rank_bm25 import BM25Okapi
-            from pathlib import Path
+            from .chunk_index import ChunkIndex, FALLBACK_TOP_K
             
             print(f"[Fallback] Starting High-Fidelity BM25 Server (Pathway unavailable on Windows)...")
             
             # 1. Load Novels for Real Search
-            corpus_chunks = []
-            corpus_files = []
-            
-            novels_path = Path(NOVELS_DIR)
-            txt_files = list(novels_path.glob("*.txt"))
-            
-            print(f"[Fallback] Indexing {len(txt_files)} novels from {novels_path}...")
-            
-            for file_path in txt_files:
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        text = f.read()
-                        # Simple chunking: 1000 chars with overlap
-                        chunk_size = 1000
-                        overlap = 200
-                        for i in range(0, len(text), chunk_size - overlap):
-                            chunk = text[i:i + chunk_size]
-                            corpus_chunks.append(chunk)
-                            corpus_files.append(file_path.name)
-                except Exception as e:
-                    print(f"Error reading {file_path}: {e}")
+            print(f"[Fallback] Indexing novels from {NOVELS_DIR}...")
+            with PROFILER.stage("server.index_build"):
+                index = ChunkIndex.from_dir(NOVELS_DIR)
             
-            if not corpus_chunks:
+            if not len(index):
                 print("[Fallback] WARNING: No text found to index! Search will be empty.")
-                tokenized_corpus = []
-                bm25 = None
             else:
-                print(f"[Fallback] content loaded. Tokenizing {len(corpus_chunks)} chunks...")
-                tokenized_corpus = [doc.split(" ") for doc in corpus_chunks]
-                bm25 = BM25Okapi(tokenized_corpus)
-                print("[Fallback] BM25 Index Ready.")
+                print(f"[Fallback] BM25 Index Ready ({len(index)} chunks).")
 
             class MockHandler(BaseHTTPRequestHandler):
                 def do_POST(self):
@@ -142,21 +123,16 @@ class ProductionNovelIndexer:
                         try:
                              data = json.loads(post_data.decode('utf-8'))
                              query = data.get('query', '')
+                             # Serve the requested k, like the Pathway server; top 5 when none is given
+                             top_k = int(data['k']) if data.get('k') else FALLBACK_TOP_K
+                             file_glob = data.get('filepath_globpattern')
                              
                              # REAL SEARCH
                              results = []
-                             if bm25:
-                                 # Tokenize query
-                                 tokenized_query = query.split(" ")
-                                 # Get top 5
-                                 top_docs = bm25.get_top_n(tokenized_query, corpus_chunks, n=5)
-                                 
-                                 for doc in top_docs:
-                                     results.append({
-                                         "text": doc,
-                                         "score": 0.8, # Dummy score, rank implies quality
-                                         "metadata": {"source": "BM25_Fallback"}
-                                     })
+                             PROFILER.count("server.requests")
+                             if len(index):
+                                 with PROFILER.stage("server.bm25_search"):
+                                     results = index.search(query, k=top_k, file_glob=file_glob)
                              else:
                                  # Fallback if no books
                                  results.append({"text": "No novels found in data folder.", "score": 0.0, "metadata": {}})
@@ -172,6 +148,18 @@ class ProductionNovelIndexer:
                     else:
                         self.send_response(404)
                         self.end_headers()
+
+                def do_GET(self):
+                    # Prometheus-style metrics endpoint
+                    if self.path == '/metrics':
+                        body = PROFILER.render_prometheus().encode('utf-8')
+                        self.send_response(200)
+                        self.send_header('Content-type', 'text/plain; version=0.0.4')
+                        self.end_headers()
+                        self.wfile.write(body)
+                    else:
+                        self.send_response(404)
+                        self.end_headers()
                         
                 def log_message(self, format, *args):
                     return # Silence logs
@@ -0,0 +1,248 @@
+"""
+Per-story pipeline shared by the batch runner and the Streamlit app:
+extract -> retrieve -> reason -> aggregate -> dossier.
+"""
+import re
+
+from .claim_extraction import extract_claims
+from .retrieval import retrieve_evidence
+from .reasoning_llm import score_claims, decide_claims, nli_evidence
+from .aggregation import aggregate_decisions, CausalAggregator
+from .rationale_builder import build_dossier, build_submission_rationale, collect_dossier_entries
+from .dossier_store import get_dossier_store
+from .stage_cache import plain
+from .nli_engine import wait_for_model
+from .profiling import PROFILER
+from .config import EARLY_TERMINATION, EARLY_EXIT_BATCH_CLAIMS, BOOK_MAPPING, AGENTIC_REASONING
+
+# Lexical cues that make a claim more likely to clash with the novel
+_CONFLICT_CUES_RE = r'\b(?:\d{3,4}|not|never|no|without|only|first|last)\b'
+
+def contradiction_prior(claim: dict) -> float:
+    """Cheap pre-retrieval estimate of how likely a claim is to be contradicted (for ordering only)."""
+    score = 2.0 if claim.get("importance", "core") != "detail" else 0.0
+    score += 0.5 * len(re.findall(_CONFLICT_CUES_RE, claim["text"], re.IGNORECASE))
+    if claim.get("type", "event") == "event":
+        score += 0.5
+    return score
+
+def collect_evidence(claim: dict, story_id: str) -> list:
+    """Retrieves evidence for one claim, normalized to the Evidence shape."""
+    return [
+        {
+            "text": item.get("text", ""),
+            "score": item.get("score", 0.0),
+            "metadata": item.get("metadata", {})
+        }
+        for item in retrieve_evidence(claim, story_id)
+    ]
+
+def _run_stage(stage_cache, stage: str, inputs, compute, complete=lambda value: True):
+    """(output, hit) through the stage cache, or a plain compute() without one."""
+    if stage_cache is None:
+        return compute(), False
+    return stage_cache.run(stage, inputs, compute, complete)
+
+def score_claims_cached(stage_cache, claims: list, evidence_map: dict, book_file: str = None,
+                        char: str = None):
+    """
+    `score_claims` through the per-claim "nli" stage cache: each claim is keyed
+    by its text and the excerpts (text + chunk id) it is scored against, so an
+    evidence change re-scores only that claim. All misses go to the model in
+    one batched call. Returns (scores, number of claims scored).
+    """
+    if stage_cache is None:
+        wait_for_model()
+        return score_claims(claims, evidence_map, book_file, char), len(claims)
+
+    scores, keys, misses = {}, {}, []
+    for c in claims:
+        excerpts = [(e["text"], e.get("metadata", {}).get("chunk_id")) for e in nli_evidence(c, evidence_map)]
+        keys[c["id"]] = stage_cache.key("nli", [c["id"], c.get("story_id"), c["text"],
+                                                c.get("importance", "core"), excerpts, book_file, char])
+        cached = stage_cache.get("nli", keys[c["id"]])
+        PROFILER.cache("stage.nli", hit=cached is not None)
+        if cached is None:
+            misses.append(c)
+        elif cached:
+            scores[c["id"]] = cached
+    if misses:
+        wait_for_model()
+        fresh = plain(score_claims(misses, evidence_map, book_file, char))
+        for c in misses:
+            if c["id"] in fresh:
+                scores[c["id"]] = fresh[c["id"]]
+                stage_cache.put("nli", keys[c["id"]], fresh[c["id"]])
+            elif not nli_evidence(c, evidence_map):
+                stage_cache.put("nli", keys[c["id"]], {}) # Nothing to score; an NLI failure is not stored
+    return scores, len(misses)
+
+def analyze_story(story_id: str, backstory_text: str, on_progress=None, char: str = None,
+                  claims: list = None, early_exit: bool = EARLY_TERMINATION, stage_cache=None,
+                  book_name: str = None, agentic: bool = AGENTIC_REASONING) -> dict:
+    """
+    Runs the full pipeline for one backstory.
+    `char` attributes pronoun-led clauses to the character; precomputed `claims`
+    (e.g. from `extract_claims_frame`) skip extraction. `book_name` scopes the
+    symbolic pre-check to the story's novel (without it the pre-check is skipped).
+    With early_exit, claims are checked most-likely-contradicted first and the
+    story stops once a core contradiction fixes the verdict (see `_decide_early_exit`).
+    With agentic, the LangGraph agent retrieves and reasons instead, re-querying
+    NLI-inconclusive claims (see `_decide_agentic`; takes precedence over early_exit).
+    With a `stage_cache.StageCache`, each stage reuses its stored output while
+    its fingerprint is unchanged (per batch under early_exit). A failed
+    retrieval raises `retrieval.RetrievalError`, so nothing is cached for the story.
+
+    on_progress(event, payload) is called as work completes, so callers can
+    stream progress: ("claims", claims), ("evidence", (i, claim, evidence)),
+    ("decision", (i, decision)), ("skipped", claims), ("result", result), where i is
+    the claim's position in the claims list.
+    Returns {"claims", "decisions", "result", "rationale", "recomputed"}.
+    """
+    notify = on_progress or (lambda event, payload: None)
+    recomputed = set()
+
+    # 1. Extract Claims
+    if claims is None:
+        with PROFILER.stage("extraction"):
+            claims, hit = _run_stage(stage_cache, "claims", [backstory_text, char],
+                                     lambda: extract_claims(backstory_text, story_id, char))
+        if not hit:
+            recomputed.add("claims")
+    PROFILER.count("claims", len(claims))
+    print(f"  Extracted {len(claims)} claims.")
+    notify("claims", claims)
+
+    book_file = BOOK_MAPPING.get(book_name)
+    if agentic:
+        decisions = _decide_agentic(story_id, claims, notify, book_name, char, recomputed)
+    elif early_exit:
+        decisions = _decide_early_exit(story_id, claims, notify, book_file, char, stage_cache, recomputed)
+    else:
+        decisions = _decide_all(story_id, claims, notify, book_file, char, stage_cache, recomputed)
+
+    # 4. Aggregate + 5. Build Rationale
+    def aggregate():
+        with PROFILER.stage("aggregation"):
+            result = aggregate_decisions(decisions, story_id)
+        rationale = build_submission_rationale(collect_dossier_entries(_decisive_first(decisions, result)),
+                                               result["prediction"])
+        return {"result": result, "rationale": rationale}
+
+    summary, hit = _run_stage(stage_cache, "aggregate", [story_id, decisions], aggregate)
+    if not hit:
+        recomputed.add("aggregate")
+    # The dossier is a side effect, so it is written outside the cache: on a hit too
+    # when the store lacks the story (e.g. a fresh or deleted store)
+    store = get_dossier_store()
+    if not hit or not store.has_story(story_id):
+        with PROFILER.stage("dossier"):
+            build_dossier(story_id, _decisive_first(decisions, summary["result"]),
+                          summary["result"]["prediction"], store)
+    notify("result", summary["result"])
+
+    return {"claims": claims, "decisions": decisions, "result": summary["result"],
+            "rationale": summary["rationale"], "recomputed": recomputed}
+
+def _decisive_first(decisions: list, result: dict) -> list:
+    """Decisions with the aggregator's decisive claim (if any) first, so the rationale cites it."""
+    decisive = result.get("decisive_claim_id")
+    return sorted(decisions, key=lambda d: d["claim_id"] != decisive)
+
+def _decide_all(story_id: str, claims: list, notify, book_file: str, char: str, stage_cache,
+                recomputed: set) -> list:
+    """Retrieve -> reason for every claim, through the "retrieval" and "nli" stages."""
+    # 2. Retrieve Evidence (IO Bound, Local BM25 is fast)
+    def retrieve_all():
+        evidence_map = {}
+        for i, claim in enumerate(claims):
+            evidence_map[claim["id"]] = collect_evidence(claim, story_id)
+            notify("evidence", (i, claim, evidence_map[claim["id"]]))
+        return evidence_map
+
+    with PROFILER.stage("retrieval"):
+        evidence_map, hit = _run_stage(stage_cache, "retrieval", claims, retrieve_all)
+    if hit:
+        for i, claim in enumerate(claims):
+            notify("evidence", (i, claim, evidence_map.get(claim["id"], [])))
+    else:
+        recomputed.add("retrieval")
+
+    # 3. Reason: one batched NLI call for every claim not scored before; NLI scores
+    # are threshold-free, so only the cheap decision step depends on thresholds
+    with PROFILER.stage("reasoning"):
+        scores, n_scored = score_claims_cached(stage_cache, claims, evidence_map, book_file, char)
+        if n_scored:
+            recomputed.add("nli")
+        decisions = decide_claims(claims, evidence_map, scores)
+    for i, decision in enumerate(decisions):
+        notify("decision", (i, decision))
+    print(f"  Reasoned about {len(decisions)} claims.")
+    return decisions
+
+def _decide_agentic(story_id: str, claims: list, notify, book_name: str, char: str, recomputed: set) -> list:
+    """
+    Retrieve -> reason through the LangGraph agent, which deepens retrieval for
+    NLI-inconclusive core claims. Its retrieval and NLI bypass the stage cache.
+    """
+    from .langgraph_agent import run_agentic_story # Optional dependency (langgraph)
+    state = run_agentic_story(story_id, claims, book_name=book_name, character=char)
+    recomputed.update({"retrieval", "nli"})
+    for i, claim in enumerate(claims):
+        notify("evidence", (i, claim, state["evidence_map"].get(claim["id"], [])))
+    decisions = state["decisions"]
+    for i, decision in enumerate(decisions):
+        notify("decision", (i, decision))
+    print(f"  [Agent] Reasoned about {len(decisions)} claims.")
+    return decisions
+
+def _decide_early_exit(story_id: str, claims: list, notify, book_file: str, char: str, stage_cache,
+                       recomputed: set) -> list:
+    """
+    Retrieve -> reason in contradiction_prior order, EARLY_EXIT_BATCH_CLAIMS
+    claims (one batched NLI call) at a time, stopping after the batch in which
+    the aggregator's core override applies: later claims can no longer change
+    the verdict. Each batch goes through the "retrieval" and "nli" stages.
+    Progress events carry the claim's position in `claims`; the claims left
+    unchecked are reported with a ("skipped", claims) event.
+    """
+    aggregator = CausalAggregator()
+    order = sorted(range(len(claims)), key=lambda i: contradiction_prior(claims[i]), reverse=True)
+    decisions = []
+    for start in range(0, len(order), EARLY_EXIT_BATCH_CLAIMS):
+        positions = order[start:start + EARLY_EXIT_BATCH_CLAIMS]
+        batch = [claims[i] for i in positions]
+
+        def retrieve_batch():
+            evidence_map = {}
+            for i in positions:
+                evidence_map[claims[i]["id"]] = collect_evidence(claims[i], story_id)
+                notify("evidence", (i, claims[i], evidence_map[claims[i]["id"]]))
+            return evidence_map
+
+        with PROFILER.stage("retrieval"):
+            evidence_map, hit = _run_stage(stage_cache, "retrieval", batch, retrieve_batch)
+        if hit:
+            for i in positions:
+                notify("evidence", (i, claims[i], evidence_map.get(claims[i]["id"], [])))
+        else:
+            recomputed.add("retrieval")
+
+        with PROFILER.stage("reasoning"):
+            scores, n_scored = score_claims_cached(stage_cache, batch, evidence_map, book_file, char)
+            if n_scored:
+                recomputed.add("nli")
+            batch_decisions = decide_claims(batch, evidence_map, scores)
+        for i, decision in zip(positions, batch_decisions):
+            decisions.append(decision)
+            notify("decision", (i, decision))
+        core = aggregator.core_contradictions(batch_decisions)
+        if core:
+            skipped = [claims[i] for i in order[len(decisions):]]
+            PROFILER.count("early_exit.stories")
+            PROFILER.count("early_exit.skipped_claims", len(skipped))
+            print(f"  [EarlyExit] Core contradiction on {core[0]['claim_id']}; skipped {len(skipped)} claims.")
+            notify("skipped", skipped)
+            break
+    print(f"  Reasoned about {len(decisions)}/{len(claims)} claims.")
+    return decisions
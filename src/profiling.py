@@ -0,0 +1,227 @@
+"""
+Lightweight stage-level instrumentation for the inference pipeline.
+
+Usage:
+    from .profiling import PROFILER
+
+    with PROFILER.story(story_id):
+        with PROFILER.stage("retrieval"):
+            ...
+        PROFILER.count("nli.pairs_scored", len(pairs))
+        PROFILER.cache("nli_model", hit=True)
+
+    PROFILER.write_report(json_path, csv_path)   # aggregate + per-story report
+    PROFILER.render_prometheus()                 # text exposition format
+
+Stage latencies are kept in constant memory per stage: fixed histogram
+buckets with sum/count/max (what /metrics exposes, no sorting per scrape)
+and a bounded uniform reservoir sample for the p50/p95 of reports.
+"""
+import bisect
+import csv
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Latency histogram bucket upper bounds, in seconds (Prometheus style)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+RESERVOIR_SIZE = 1024 # Latency samples kept per stage for percentiles
+
+class StageStats:
+    """Constant-memory latency record of one stage."""
+    __slots__ = ("count", "total", "max", "buckets", "reservoir", "_rng")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS) # Non-cumulative counts per bucket
+        self.reservoir = []
+        self._rng = random.Random(0)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        # Reservoir sampling (Algorithm R): a uniform sample of all observations
+        if len(self.reservoir) < RESERVOIR_SIZE:
+            self.reservoir.append(seconds)
+        else:
+            j = self._rng.randrange(self.count)
+            if j < RESERVOIR_SIZE:
+                self.reservoir[j] = seconds
+
+    def cumulative_buckets(self) -> list:
+        """Cumulative bucket counts [(upper_bound_label, count <= bound)]."""
+        buckets, running = [], 0
+        for bound, n in zip(LATENCY_BUCKETS, self.buckets):
+            running += n
+            buckets.append(("+Inf" if bound == float("inf") else repr(bound), running))
+        return buckets
+
+class Profiler:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.durations = {}   # stage -> StageStats
+            self.counters = {}    # name -> int
+            self.stories = []     # per-story records
+
+    # --- Recording ---
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times the wrapped block and records it under `name`."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            stats = self.durations.get(name)
+            if stats is None:
+                stats = self.durations[name] = StageStats()
+            stats.add(seconds)
+        record = getattr(self._local, "story", None)
+        if record is not None:
+            record["stages"][name] = record["stages"].get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        record = getattr(self._local, "story", None)
+        if record is not None:
+            record["counters"][name] = record["counters"].get(name, 0) + n
+
+    def cache(self, name: str, hit: bool):
+        """Records a cache lookup; hit rates are derived in `summary`."""
+        self.count(f"cache.{name}.{'hit' if hit else 'miss'}")
+
+    @contextmanager
+    def story(self, story_id):
+        """Groups all stages/counters recorded in this thread under one story."""
+        if not self.enabled:
+            yield
+            return
+        record = {"story_id": str(story_id), "stages": {}, "counters": {}}
+        self._local.story = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["total_seconds"] = time.perf_counter() - start
+            self._local.story = None
+            with self._lock:
+                self.stories.append(record)
+
+    # --- Reporting ---
+
+    def summary(self) -> dict:
+        with self._lock:
+            durations = {k: (v.count, v.total, v.max, v.cumulative_buckets(), sorted(v.reservoir))
+                         for k, v in self.durations.items()}
+            counters = dict(self.counters)
+
+        stages = {}
+        for name, (count, total, max_seconds, histogram, sample) in durations.items():
+            stages[name] = {
+                "count": count,
+                "total_seconds": total,
+                "mean_seconds": total / count,
+                "p50_seconds": _percentile(sample, 50), # Estimated from the reservoir sample
+                "p95_seconds": _percentile(sample, 95),
+                "max_seconds": max_seconds,
+                "histogram": histogram,
+            }
+
+        cache_rates = {}
+        for key in counters:
+            if key.startswith("cache.") and key.endswith((".hit", ".miss")):
+                cache_name = key[len("cache."):].rsplit(".", 1)[0]
+                hits = counters.get(f"cache.{cache_name}.hit", 0)
+                misses = counters.get(f"cache.{cache_name}.miss", 0)
+                cache_rates[cache_name] = hits / (hits + misses) if (hits + misses) else 0.0
+
+        return {"stages": stages, "counters": counters, "cache_hit_rates": cache_rates}
+
+    def write_report(self, json_path, csv_path=None):
+        """
+        Writes the aggregate summary plus per-story records as JSON, and
+        optionally one CSV row per story (stage seconds and counters as columns).
+        """
+        json_path = Path(json_path)
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            stories = list(self.stories)
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": self.summary(), "stories": stories}, f, indent=2)
+
+        if csv_path:
+            stage_cols = sorted({k for s in stories for k in s["stages"]})
+            counter_cols = sorted({k for s in stories for k in s["counters"]})
+            with open(csv_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["story_id", "total_seconds"] + stage_cols + counter_cols)
+                for s in stories:
+                    writer.writerow(
+                        [s["story_id"], f"{s['total_seconds']:.6f}"]
+                        + [f"{s['stages'].get(c, 0.0):.6f}" for c in stage_cols]
+                        + [s["counters"].get(c, 0) for c in counter_cols]
+                    )
+
+    def render_prometheus(self, prefix: str = "narrative_guard") -> str:
+        """Prometheus text exposition of stage latency histograms and counters (no percentiles)."""
+        with self._lock:
+            stages = {k: (v.cumulative_buckets(), v.total, v.count) for k, v in self.durations.items()}
+            counters = dict(self.counters)
+        lines = [
+            f"# HELP {prefix}_stage_seconds Latency of pipeline stages.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for name, (histogram, total, count) in sorted(stages.items()):
+            for le, cumulative in histogram:
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {total}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {count}')
+
+        lines.append(f"# HELP {prefix}_events_total Pipeline event counters.")
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in sorted(counters.items()):
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def print_summary(self):
+        summary = self.summary()
+        print("\n[Profile] Stage latency (total / mean / p95, seconds):")
+        for name, st in sorted(summary["stages"].items(), key=lambda kv: -kv[1]["total_seconds"]):
+            print(f"  {name:<22} n={st['count']:<6} {st['total_seconds']:9.3f} "
+                  f"{st['mean_seconds']:8.4f} {st['p95_seconds']:8.4f}")
+        for name, value in sorted(summary["counters"].items()):
+            print(f"  {name:<22} {value}")
+        for name, rate in sorted(summary["cache_hit_rates"].items()):
+            print(f"  cache {name:<16} hit rate {rate:.1%}")
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+# Process-wide profiler used by the pipeline modules
+PROFILER = Profiler()
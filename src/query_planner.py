@@ -0,0 +1,81 @@
+"""
+Query planning for adversarial retrieval.
+
+The fallback index scores bag-of-terms BM25, so phrasings such as
+"it is false that X" or "contradiction: X" retrieve the same chunks as X
+itself. The planner collapses term-equivalent queries and generates
+variants that actually change the term bag: antonym / negation
+substitution, date-agnostic and entity-focused queries.
+"""
+import re
+
+from .text_analyzer import STOPWORDS, analyze
+
+# Framing words of the legacy adversarial templates
+FRAMING_TERMS = frozenset({"false", "true", "contradiction"})
+
+ANTONYMS = {
+    "alive": "dead", "dead": "alive", "born": "died", "died": "born",
+    "married": "unmarried", "arrived": "left", "left": "arrived", "loved": "hated", "hated": "loved",
+    "rich": "poor", "poor": "rich", "friend": "enemy", "enemy": "friend", "won": "lost", "lost": "won",
+    "before": "after", "after": "before", "young": "old", "old": "young", "escaped": "captured",
+    "captured": "escaped", "freed": "imprisoned", "imprisoned": "freed", "released": "arrested",
+    "arrested": "released", "accepted": "refused", "refused": "accepted", "trusted": "betrayed",
+    "betrayed": "trusted", "returned": "never returned", "joined": "left", "honest": "dishonest",
+}
+NEGATION_TERMS = "never not"
+YEAR_RE = r'\b1[5-9]\d\d\b'
+MAX_ADVERSARIAL_QUERIES = 3
+
+def query_terms(query: str) -> frozenset:
+    """Content terms of a query as the index analyzer sees them, minus framing words."""
+    return frozenset(t for t in analyze(query) if t not in FRAMING_TERMS)
+
+def collapse_equivalent(queries: list) -> list:
+    """Keeps the first query of every group with the same content terms."""
+    seen, kept = set(), []
+    for q in queries:
+        terms = query_terms(q)
+        if terms in seen:
+            continue
+        seen.add(terms)
+        kept.append(q)
+    return kept
+
+def _content_words(text: str) -> list:
+    words = [w.strip(".,;:!?\"'()") for w in text.split()]
+    return [w for w in words if w and w.lower() not in STOPWORDS]
+
+def antonym_query(text: str):
+    """The claim with its first antonym-bearing term flipped, or a negated claim."""
+    words = _content_words(text)
+    for i, w in enumerate(words):
+        flipped = ANTONYMS.get(w.lower())
+        if flipped:
+            return " ".join(words[:i] + [flipped] + words[i + 1:])
+    return " ".join(words + [NEGATION_TERMS])
+
+def date_agnostic_query(text: str):
+    """Event terms without the year, so passages dating the event differently surface."""
+    if not re.search(YEAR_RE, text):
+        return None
+    words = [w for w in _content_words(text) if not re.fullmatch(YEAR_RE, w)]
+    return " ".join(words) or None
+
+def entity_query(text: str):
+    """Proper names (and years) only: every passage about the same people/places."""
+    words = [w.strip(".,;:!?\"'()") for w in text.split()]
+    entities = [w.split("’")[0].split("'")[0] for w in words[1:] if w[:1].isupper()]
+    if words and words[0][:1].isupper() and words[0].lower() not in STOPWORDS:
+        entities.insert(0, words[0].split("’")[0].split("'")[0])
+    entities += re.findall(YEAR_RE, text)
+    return " ".join(dict.fromkeys(entities)) if len(entities) > 1 else None
+
+def adversarial_queries(text: str, max_queries: int = MAX_ADVERSARIAL_QUERIES) -> list:
+    """
+    Adversarial variants of a claim whose term bags differ from the claim and
+    from each other (at most max_queries).
+    """
+    candidates = [antonym_query(text), date_agnostic_query(text), entity_query(text)]
+    planned = collapse_equivalent([text] + [q for q in candidates if q])
+    return planned[1:max_queries + 1]
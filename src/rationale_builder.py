@@ -1,8 +1,7 @@
 
-import json
-import os
-from .config import DOSSIERS_DIR
 from .data_types import ClaimDecision
+from .dossier_store import get_dossier_store
+from .profiling import PROFILER
 
 
 def build_submission_rationale(dossier_entries, prediction):
@@ -37,28 +36,26 @@ def build_submission_rationale(dossier_entries, prediction):
     return "Rationale classification ambiguous based on available evidence."
 
 
-def build_dossier(story_id: str, decisions: list[ClaimDecision], prediction: int = None):
-    """
-    Saves the detailed claim decisions as a JSON dossier and returns the final rationale.
-    """
-    dossier_path = DOSSIERS_DIR / f"story_{story_id}_dossier.json"
-    
-    # Ensure directory exists
-    os.makedirs(DOSSIERS_DIR, exist_ok=True)
-    
+def collect_dossier_entries(decisions: list[ClaimDecision]) -> list:
+    """Evidence entries of all decisions, in decision order."""
     dossier_entries = []
     for decision in decisions:
         if "evidence_entries" in decision:
             dossier_entries.extend(decision["evidence_entries"])
-            
-    dossier_data = {
-        "story_id": story_id,
-        "prediction": prediction,
-        "dossier": dossier_entries # Full evidence dossier
-    }
-    
-    with open(dossier_path, "w", encoding="utf-8") as f:
-        json.dump(dossier_data, f, indent=2)
+    return dossier_entries
+
+
+def build_dossier(story_id: str, decisions: list[ClaimDecision], prediction: int = None, store=None):
+    """
+    Appends the detailed claim decisions to the dossier store and returns the final rationale.
+    Records are buffered; call `store.flush()` (or `get_dossier_store().flush()`) to persist early.
+    """
+    dossier_entries = collect_dossier_entries(decisions)
+
+    with PROFILER.stage("dossier.write"):
+        store = store or get_dossier_store()
+        verdicts = {d["claim_id"]: {"label": d["label"], "confidence": float(d["confidence"])} for d in decisions}
+        store.write_story(str(story_id), dossier_entries, prediction, verdicts)
 
     # Return the compliant Rationale string
     return build_submission_rationale(dossier_entries, prediction)
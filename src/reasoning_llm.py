@@ -5,39 +5,135 @@ from .data_types import Claim, Evidence, ClaimDecision
 
 
 
-from .nli_engine import check_local_consistency
+import numpy as np
+from .nli_engine import (score_pairs_batch, decide_from_probabilities, CONTRADICT_THRESHOLD, ENTAIL_THRESHOLD,
+                         IDX_CONTRA, IDX_ENTAIL)
+from .config import DETAIL_NLI_EVIDENCE, SYMBOLIC_CHECK
+from .fact_table import sentence_facts, get_fact_table
+from .profiling import PROFILER
 
+# Fact sentences attached to a symbolic decision
+SYMBOLIC_EVIDENCE_FACTS = 3
 
-from .nli_engine import check_local_consistency
+def symbolic_check(claim: dict, book_file: str = None, character: str = None):
+    """
+    Fact-table verdict for claims with explicit dates/numbers/places, else None (-> NLI).
+    Needs the story's novel file: facts of another novel say nothing about the claim.
+    """
+    if not book_file or not sentence_facts(claim["text"]):
+        return None
+    return get_fact_table().check_claim(claim["text"], book_file, character)
+
+def _symbolic_decision(c: dict, result: dict) -> ClaimDecision:
+    ev_entries = [
+        {
+            "story_id": c["story_id"],
+            "claim_id": c["id"],
+            "claim_text": c["text"],
+            "excerpt_text": fact.sentence,
+            "chunk_id": None, # Sentence, not a retrieval chunk: deduplicated by content
+            "relation": result["label"],
+            "analysis": f"{fact.file} @ {fact.char_offset}: {fact.entity} {fact.attribute}={fact.value}"
+        }
+        for fact in result["facts"][:SYMBOLIC_EVIDENCE_FACTS]
+    ]
+    print(f"  [Symbolic] Claim {c['id']} -> {result['label']} ({result['confidence']:.2f}) via Fact-Table")
+    return {
+        "claim_id": c["id"],
+        "story_id": c["story_id"],
+        "label": result["label"],
+        "confidence": result["confidence"],
+        "analysis": result["analysis"],
+        "evidence_entries": ev_entries,
+        "evidence_index": 0,
+        "probabilities": [],
+        "importance": c.get("importance", "core"),
+        "type": c.get("type", "event"),
+        "source": "Fact-Table"
+    }
+
+# Confidence assigned when NLI is inconclusive (presumption of consistency)
+DEFAULT_SUPPORT_CONFIDENCE = 0.5
+
+def nli_evidence(c: dict, evidence_map: dict) -> list:
+    """Evidence scored for a claim: detail claims only against their top excerpts."""
+    ev_list = evidence_map.get(c["id"], [])
+    return ev_list[:DETAIL_NLI_EVIDENCE] if c.get("importance") == "detail" else ev_list
+
+def score_claims(claims: list[dict], evidence_map: dict, book_file: str = None, character: str = None,
+                 symbolic: bool = SYMBOLIC_CHECK) -> dict:
+    """
+    Model-dependent half of reasoning (threshold-free, so it can be cached):
+    {claim_id: {"symbolic": ClaimDecision}} for fact-table resolved claims and
+    {claim_id: {"probabilities": (n_evidence, 3) array}} for NLI-scored ones.
+    Claims without evidence, or left unscored by an NLI failure, are absent.
+    The symbolic pre-check runs only with `symbolic` and the story's `book_file`.
+    """
+    scores = {}
+
+    # Symbolic pre-check: resolved claims skip NLI entirely
+    for c in claims if symbolic else []:
+        result = symbolic_check(c, book_file, character)
+        if result is not None:
+            scores[c["id"]] = {"symbolic": _symbolic_decision(c, result)}
+    if scores:
+        PROFILER.count("reasoning.symbolic_resolved", len(scores))
+
+    # One batched NLI call for every claim that has evidence
+    scored = [c for c in claims if c["id"] not in scores and nli_evidence(c, evidence_map)]
+    if scored:
+        try:
+            probs_list = score_pairs_batch([(c["text"], nli_evidence(c, evidence_map)) for c in scored])
+        except Exception as e:
+            print(f"[NLI] Inference error: {e}")
+            probs_list = None
+        for c, probs in zip(scored, probs_list or []):
+            if probs is not None:
+                scores[c["id"]] = {"probabilities": probs}
+    return scores
 
-def reason_about_all_claims(claims: list[dict], evidence_map: dict) -> list[ClaimDecision]:
+def reason_about_all_claims(claims: list[dict], evidence_map: dict, book_file: str = None,
+                            character: str = None, symbolic: bool = SYMBOLIC_CHECK) -> list[ClaimDecision]:
     """
     Fully Local Neuro-Symbolic Reasoning:
+    0. Resolve claims with explicit dates/numbers against the fact table (no NLI).
     1. Check Local NLI (DeBERTa) for contradictions/entailments.
     2. If NLI is uncertain, fall back to 'Consistent' (Presumption of Innocence).
     
     Status: FAST. No API calls. No Rate Limits.
     """
+    return decide_claims(claims, evidence_map,
+                         score_claims(claims, evidence_map, book_file, character, symbolic))
+
+def decide_claims(claims: list[dict], evidence_map: dict, scores: dict) -> list[ClaimDecision]:
+    """Threshold-dependent half of reasoning: decisions from `score_claims` output."""
     final_decisions = []
     
     for c in claims:
-        ev_list = evidence_map.get(c["id"], [])
+        score = scores.get(c["id"], {})
+        if "symbolic" in score:
+            final_decisions.append(score["symbolic"])
+            continue
+        ev_list = nli_evidence(c, evidence_map)
         
         # Default decision: Consistent (1) with Low Confidence
         label = "SUPPORT"
-        confidence = 0.5
+        confidence = DEFAULT_SUPPORT_CONFIDENCE
         analysis = "Default consistency assumption (no strong contradiction found)."
         source = "Heuristic-Default"
+        nli_result = None
         
         if ev_list:
-            # Run Local NLI
-            nli_result = check_local_consistency(c["text"], ev_list)
+            # Local NLI result (full probability matrix over all excerpts)
+            if "probabilities" in score:
+                nli_result = decide_from_probabilities(np.asarray(score["probabilities"]))
             
-            if nli_result:
+            if nli_result and nli_result["label"] != "NONE":
                 label = nli_result['label']
                 confidence = nli_result['confidence']
                 source = "Local-DeBERTa"
-                analysis = f"Local NLI Model detected {label} with {confidence:.2f} confidence."
+                analysis = (f"Local NLI Model detected {label} with {confidence:.2f} confidence "
+                            f"(decisive excerpt #{nli_result['evidence_index']}).")
             
             # Simple keyword heuristic as backup/booster
             # If evidence mentions "not" + claim verb? (Too complex for simple regex)
@@ -46,17 +142,25 @@ def reason_about_all_claims(claims: list[dict], evidence_map: dict) -> list[Clai
         else:
              analysis = "No evidence found. Assuming consistency."
 
-        # Construct Evidence Entries
+        # Construct Evidence Entries (labeled per excerpt from its own NLI row)
         ev_entries = []
-        for e in ev_list:
-             ev_entries.append({
+        for i, e in enumerate(ev_list):
+             entry = {
                 "story_id": c["story_id"],
                 "claim_id": c["id"],
                 "claim_text": c["text"],
                 "excerpt_text": e["text"],
-                "relation": label if source == "Local-DeBERTa" else "NONE",
+                "chunk_id": e.get("metadata", {}).get("chunk_id"),
+                "relation": "NONE",
                 "analysis": "Evidence used for NLI check."
-            })
+            }
+             if nli_result:
+                 p = nli_result["probabilities"][i]
+                 entry["relation"] = nli_result["excerpt_labels"][i]
+                 entry["nli_probs"] = {"contradiction": float(p[0]), "entailment": float(p[1]), "neutral": float(p[2])}
+                 if source == "Local-DeBERTa" and i == nli_result["evidence_index"]:
+                     entry["analysis"] = f"Decisive excerpt for {nli_result['label']} verdict."
+             ev_entries.append(entry)
             
         print(f"  [Local] Claim {c['id']} -> {label} ({confidence:.2f}) via {source}")
 
@@ -66,11 +170,31 @@ def reason_about_all_claims(claims: list[dict], evidence_map: dict) -> list[Clai
             "label": label,
             "confidence": confidence,
             "analysis": analysis,
-            "evidence_entries": ev_entries
+            "evidence_entries": ev_entries,
+            "evidence_index": nli_result["evidence_index"] if nli_result else None,
+            "probabilities": nli_result["probabilities"].tolist() if nli_result else [],
+            "importance": c.get("importance", "core"),
+            "type": c.get("type", "event"),
+            "source": source
         })
 
     return final_decisions
 
+def is_inconclusive(decision: ClaimDecision, margin: float) -> bool:
+    """
+    True when NLI did not settle the claim: no evidence or no NLI scores (the
+    model failed), no excerpt past either threshold (NLI label NONE, decided by
+    the default assumption), or best contradiction and best entailment within
+    `margin` of each other. Fact-table (symbolic) decisions are settled.
+    """
+    probs = np.asarray(decision.get("probabilities") or [])
+    if probs.size == 0:
+        return decision.get("source") != "Fact-Table"
+    max_contra, max_entail = float(probs[:, IDX_CONTRA].max()), float(probs[:, IDX_ENTAIL].max())
+    if max_contra <= CONTRADICT_THRESHOLD and max_entail <= ENTAIL_THRESHOLD:
+        return True
+    return abs(max_contra - max_entail) < margin
+
 # Legacy single function (kept just in case, or removed if unused)
 def reason_about_claim(claim, evidence):
     # Redirect to batch for simplicity? Or just keep as compat wrapper
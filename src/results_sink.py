@@ -0,0 +1,182 @@
+"""
+Buffered, crash-tolerant writer for RESULTS_CSV.
+
+Rows are batched and appended with a single O_APPEND write + fsync per flush.
+A sidecar file (<results>.ids) lists processed Story IDs together with the
+CSV byte offset after each row, so resume checks are a set lookup instead of
+re-reading the CSV, and a torn last line after a crash is detected and
+truncated on open.
+
+`before_flush` (e.g. the dossier store's flush) runs before every CSV flush,
+so a recorded result never points at a dossier that is still only buffered.
+"""
+import csv
+import io
+import os
+import time
+
+from .config import RESULTS_CSV
+
+RESULT_COLUMNS = ["Story ID", "Prediction", "Rationale"]
+FLUSH_EVERY_ROWS = 10
+FLUSH_INTERVAL_S = 30.0
+
+def _csv_line(values) -> str:
+    buf = io.StringIO()
+    # Rows are kept on one physical line so torn writes can be cut at the last newline
+    csv.writer(buf, lineterminator="\n").writerow(
+        [str(v).replace("\r", " ").replace("\n", " ") for v in values])
+    return buf.getvalue()
+
+class ResultsWriter:
+    def __init__(self, path=RESULTS_CSV, flush_every: int = FLUSH_EVERY_ROWS,
+                 flush_interval: float = FLUSH_INTERVAL_S, before_flush=None):
+        self.path = path
+        self.before_flush = before_flush
+        self.ids_path = path.with_name(path.name + ".ids")
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._buffer = []   # [(story_id, line)]
+        self._last_flush = time.monotonic()
+        os.makedirs(path.parent, exist_ok=True)
+
+        self._csv_size = self._truncate_partial_line()
+        self.processed_ids = self._load_ids()
+
+    # --- Recovery ---
+
+    def _truncate_partial_line(self) -> int:
+        """Cuts a torn last row (no trailing newline) left by an interrupted write."""
+        if not self.path.exists():
+            return 0
+        size = self.path.stat().st_size
+        if size == 0:
+            return 0
+        with open(self.path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return size
+            # Scan backwards for the last complete line
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                nl = chunk.rfind(b"\n")
+                if nl != -1:
+                    pos = pos - step + nl + 1
+                    break
+                pos -= step
+            f.truncate(pos)
+            print(f"[Results] Truncated partial row at end of {self.path.name} ({size - pos} bytes).")
+            return pos
+
+    def _load_ids(self) -> set:
+        """
+        Reads the sidecar, reconciling it with the CSV: rows appended after the
+        last sidecar entry are parsed from the CSV tail, entries beyond the CSV
+        end (rows lost in a crash) are dropped.
+        """
+        entries = []
+        if self.ids_path.exists():
+            with open(self.ids_path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    story_id, _, offset = line.rstrip("\n").rpartition("\t")
+                    entries.append((story_id, int(offset)))
+        # Without a sidecar (older results file) the whole CSV is parsed once below
+
+        valid = [(sid, off) for sid, off in entries if off <= self._csv_size]
+        last_offset = valid[-1][1] if valid else 0
+        if len(valid) != len(entries):
+            self._rewrite_ids(valid)
+
+        if self._csv_size > last_offset:
+            tail = self._parse_rows_from(last_offset)
+            if tail:
+                self._append_ids(tail)
+                valid.extend(tail)
+        return {sid for sid, _ in valid}
+
+    def _parse_rows_from(self, offset: int) -> list:
+        """[(story_id, end_offset)] for complete data rows starting at `offset`."""
+        rows = []
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            pos = offset
+            for raw in f:
+                pos += len(raw)
+                values = next(csv.reader([raw.decode("utf-8")]), [])
+                if not values or values == RESULT_COLUMNS:
+                    continue
+                rows.append((values[0], pos))
+        return rows
+
+    def _rewrite_ids(self, entries):
+        tmp = self.ids_path.with_name(self.ids_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(f"{sid}\t{off}\n" for sid, off in entries)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.ids_path)
+
+    def _append_ids(self, entries):
+        with open(self.ids_path, "a", encoding="utf-8") as f:
+            f.writelines(f"{sid}\t{off}\n" for sid, off in entries)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # --- Writing ---
+
+    def __contains__(self, story_id) -> bool:
+        return str(story_id) in self.processed_ids
+
+    def __len__(self):
+        return len(self.processed_ids)
+
+    def write(self, story_id, prediction, rationale):
+        story_id = str(story_id)
+        self._buffer.append((story_id, _csv_line([story_id, prediction, rationale])))
+        self.processed_ids.add(story_id)
+        if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """One atomic append + fsync for the CSV, then the sidecar ids."""
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        if self.before_flush is not None:
+            self.before_flush()
+        data = "" if self._csv_size else _csv_line(RESULT_COLUMNS)
+        ids = []
+        pos = self._csv_size + len(data.encode("utf-8"))
+        for story_id, line in self._buffer:
+            data += line
+            pos += len(line.encode("utf-8"))
+            ids.append((story_id, pos))
+
+        payload = data.encode("utf-8")
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        fd = os.open(self.path, flags, 0o644)
+        try:
+            written = 0
+            while written < len(payload):
+                written += os.write(fd, payload[written:])
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        self._csv_size += len(payload)
+        self._append_ids(ids)
+        self._buffer.clear()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,13 +1,38 @@
 
-import requests
-from .config import RETRIEVAL_K
+from .config import RETRIEVAL_K, DETAIL_RETRIEVAL_K
+from .profiling import PROFILER
+from .query_planner import collapse_equivalent
+from .text_analyzer import analyze
 
-def retrieve_evidence(claim: dict, story_id: str, k: int = RETRIEVAL_K):
+# Optional in-process ChunkIndex; when set, queries skip the HTTP server
+_local_index = None
+
+class RetrievalError(RuntimeError):
+    """A retrieval query failed (server down, non-200): the evidence would be incomplete."""
+
+def use_local_index(index):
+    """Routes retrieval to an in-process ChunkIndex (None restores the HTTP server)."""
+    global _local_index
+    _local_index = index
+
+def retrieve_evidence(claim: dict, story_id: str, k: int = RETRIEVAL_K,
+                      search_k: int = None, book_file: str = None, queries: list = None):
     """
     Queries the running Pathway Vector Store for relevant chunks.
     Uses 'adversarial_queries' if present to find contradictions.
+
+    Deepening overrides (default: the plain claim + adversarial queries, server top-k):
+    search_k - candidates requested per query
+    book_file - restrict the search to one novel file (glob)
+    queries - replaces the claim-derived query list
+
+    Detail claims get a shallow check (claim text only, DETAIL_RETRIEVAL_K) unless deepening.
+
+    Raises RetrievalError if any query failed, after trying them all: empty
+    evidence from a dead server must not pass for "nothing found".
     """
     url = "http://127.0.0.1:8765/v1/retrieve"
+    import requests
     
     from .config import USE_DUMMY_LLM
     if USE_DUMMY_LLM:
@@ -17,59 +42,124 @@ def retrieve_evidence(claim: dict, story_id: str, k: int = RETRIEVAL_K):
         ]
 
     # Combine claim text with adversarial queries for broader recall
-    queries = [claim["text"]] + claim.get("adversarial_queries", [])
+    shallow = claim.get("importance") == "detail" and search_k is None
+    if shallow:
+        k = min(k, DETAIL_RETRIEVAL_K)
+    if queries is None:
+        queries = [claim["text"]] + ([] if shallow else claim.get("adversarial_queries", []))
+    # Term-equivalent phrasings return the same BM25 results: issue each term bag once
+    planned = collapse_equivalent(queries)
+    PROFILER.count("retrieval.collapsed_queries", len(queries) - len(planned))
+    queries = planned
     
     unique_results = {}
+    failures = []
     
     for q in queries:
         full_query = f"BOOK_CONTEXT. {q}" # Simple prefix
         payload = {
             "query": full_query,
-            "k": k,
+            "k": search_k or k,
         }
+        if book_file:
+            payload["filepath_globpattern"] = book_file
+        
+        if _local_index is not None:
+            from .chunk_index import FALLBACK_TOP_K
+            with PROFILER.stage("retrieval.local"):
+                results = _local_index.search(full_query, k=search_k or FALLBACK_TOP_K, file_glob=book_file)
+            PROFILER.count("retrieval.queries")
+            for res in results:
+                if res["text"] not in unique_results:
+                    unique_results[res["text"]] = res
+                else:
+                    PROFILER.count("retrieval.duplicate_hits")
+            continue
         
         try:
-            response = requests.post(url, json=payload)
+            with PROFILER.stage("retrieval.http"):
+                response = requests.post(url, json=payload)
+            PROFILER.count("retrieval.queries")
             if response.status_code == 200:
                 results = response.json()
                 for res in results:
                     # Deduplicate by text content (simple heuristic)
                     if res["text"] not in unique_results:
                         unique_results[res["text"]] = res
+                    else:
+                        PROFILER.count("retrieval.duplicate_hits")
             else:
                 print(f"Retrieval failed for query '{q}': {response.status_code}")
+                failures.append(f"HTTP {response.status_code}")
         except Exception as e:
             print(f"Error connecting to Vector Store: {e}")
+            failures.append(str(e))
             
+    if failures:
+        PROFILER.count("retrieval.failures", len(failures))
+        raise RetrievalError(f"{len(failures)}/{len(queries)} retrieval queries failed for claim "
+                             f"{claim.get('id')}: {failures[0]}")
     
     # 3. Hybrid Reranking (Novelty)
+    if not unique_results:
+        return []
+    with PROFILER.stage("retrieval.rerank"):
+        return rerank_results(claim, list(unique_results.values()), k)
+
+def reformulate_queries(claim: dict, character: str = None) -> list:
+    """
+    Alternative phrasings for a claim the first pass could not settle:
+    the claim anchored on the character, and a keyword-only variant.
+    """
+    text = claim["text"]
+    keywords = " ".join(w.strip(".,;:!?\"'") for w in text.split() if len(w) > 3)
+    queries = [f"{character} {text}" if character else text]
+    if keywords and keywords != text:
+        queries.append(f"{character} {keywords}" if character else keywords)
+    queries.append(f"{character or ''} never {keywords}".strip())
+    return queries
+
+def deepen_evidence(claim: dict, story_id: str, iteration: int, k: int = RETRIEVAL_K,
+                    book_file: str = None, character: str = None, k_factor: int = 2) -> list:
+    """
+    One adaptive deepening round for a low-confidence claim.
+    Round 1 widens k within the claim's book; later rounds also reformulate the queries.
+    """
+    expanded_k = k * k_factor ** iteration
+    queries = reformulate_queries(claim, character) if iteration > 1 else None
+    PROFILER.count("retrieval.deepening_rounds")
+    return retrieve_evidence(claim, story_id, k=expanded_k, search_k=expanded_k,
+                             book_file=book_file, queries=queries)
+
+def rerank_results(claim: dict, results: list, k: int = RETRIEVAL_K) -> list:
+    """
+    Hybrid reranking of retrieved chunks: Semantic + BM25 + Temporal.
+    """
     # If we have results, we refine them.
     # Note: efficient BM25 requires the whole corpus. 
     # Here we simulate reranking top-k or use a second-stage pass if we had the full text accessible easily.
     # For this implementation, we will act on the retrieved 'semantic_chunks' (sorted_results)
     
+    # Convert to list and sort by score (descending)
+    sorted_results = sorted(results, key=lambda x: x.get("score", 0), reverse=True)
+
     try:
         from rank_bm25 import BM25Okapi
         import numpy as np
-        
-        if not unique_results:
-            return []
-            
-        # Convert to list and sort by score (descending)
-        sorted_results = sorted(unique_results.values(), key=lambda x: x.get("score", 0), reverse=True)
 
         semantic_chunks = sorted_results[:k*2] # Get more candidates for reranking
         if not semantic_chunks:
             return []
             
         # BM25 Scoring on Candidate Chunks
-        tokenized_chunks = [c.get("text", "").split() for c in semantic_chunks]
+        # Same analyzer as the chunk index (normalized, stemmed, no stopwords)
+        tokenized_chunks = [analyze(c.get("text", "")) for c in semantic_chunks]
         bm25 = BM25Okapi(tokenized_chunks)
         query = claim.get("text", "")
         if claim.get("adversarial_queries"):
              query += " " + " ".join(claim.get("adversarial_queries"))
         
-        bm25_scores = bm25.get_scores(query.split())
+        bm25_scores = bm25.get_scores(analyze(query))
         
         # Temporal Scoring (Mocking position if missing, else use metadata)
         # Assuming metadata might contain 'chunk_id' or strict 'position'. 
@@ -1,7 +1,7 @@
 
+import argparse
 import multiprocessing
 import time
-import pandas as pd
 import os
 import sys
 from pathlib import Path
@@ -9,18 +9,19 @@ from pathlib import Path
 # Add src to path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from src.pathway_pipeline import ProductionNovelIndexer
-from src.claim_extraction import extract_claims
-from src.retrieval import retrieve_evidence
-from src.reasoning_llm import reason_about_claim
-from src.aggregation import aggregate_decisions
-from src.rationale_builder import build_dossier
-from src.config import RESULTS_CSV, TRAIN_CSV, TEST_CSV
+from src.pipeline import analyze_story
+from src.nli_engine import preload_nli_model
+from src.dossier_store import get_dossier_store
+from src.results_sink import ResultsWriter
+from src.config import (RESULTS_CSV, TRAIN_CSV, TEST_CSV, PROFILE_REPORT_JSON, PROFILE_REPORT_CSV, EARLY_TERMINATION,
+                        STAGE_CACHE, AGENTIC_REASONING)
+from src.profiling import PROFILER
 
 def start_pathway_server():
     """Starts the Pathway Vector Store Server."""
     print("[Server] Starting Pathway Pipeline...")
     try:
+        from src.pathway_pipeline import ProductionNovelIndexer
         pipeline = ProductionNovelIndexer()
         pipeline.run_server()
     except Exception as e:
@@ -28,9 +29,24 @@ def start_pathway_server():
         # Identify if it is a mock/fallback scenario
         pass
 
-def run_full_pipeline():
-    """Runs inference on ALL data (Train + Test) with RESUME capability."""
+def run_full_pipeline(early_exit: bool = EARLY_TERMINATION, incremental: bool = STAGE_CACHE,
+                      agentic: bool = AGENTIC_REASONING):
+    """
+    Runs inference on ALL data (Train + Test) with RESUME capability.
+
+    Incremental mode runs every story through the stage cache and writes a
+    fresh results file per run fingerprint (and early_exit/agentic setting), which
+    replaces RESULTS_CSV once all stories are done; unchanged stages come from
+    the cache, so only what a config/model/index change affects is recomputed.
+    Otherwise stories already in RESULTS_CSV are skipped as a whole.
+    """
     
+    import pandas as pd
+
+    # Load + warm the NLI model in the background while data loads and the
+    # first story is extracted/retrieved
+    preload_nli_model(background=True)
+
     # Load Data
     print("[Client] Loading datasets...")
     dfs = []
@@ -47,32 +63,34 @@ def run_full_pipeline():
     if 'id' in full_df.columns:
         full_df.drop_duplicates(subset=['id'], inplace=True)
         
-    # Checkpoint Logic: Load existing results
-    processed_ids = set()
-    if RESULTS_CSV.exists():
-        try:
-            existing_df = pd.read_csv(RESULTS_CSV)
-            # Check if valid columns
-            if "Story ID" in existing_df.columns:
-                processed_ids = set(existing_df["Story ID"].astype(str))
-                print(f"[Client] Resuming: Found {len(processed_ids)} already processed stories.")
-        except Exception as e:
-            print(f"[Client] Warning reading existing results: {e}")
-
-    # Prepare file for appending
-    write_header = not RESULTS_CSV.exists() or os.stat(RESULTS_CSV).st_size == 0
-    if not write_header:
-        # If file exists but we are resuming, verify header is there? 
-        # Assume yes if we read it successfully above.
-        pass
+    # Claims for every story in one vectorized pass (clause split + coreference + dedup)
+    from src.claim_extraction import extract_claims_frame
+    with PROFILER.stage("extraction"):
+        claims_by_story = extract_claims_frame(full_df)
+        
+    # Checkpoint Logic: processed Story IDs come from the results sidecar index
+    stage_cache = None
+    results_path = RESULTS_CSV
+    if incremental:
+        from src.stage_cache import StageCache
+        stage_cache = StageCache()
+        # Rows of an interrupted run with the same fingerprints are still valid
+        # Early exit and the agent decide differently, so their rows never mix with a full run's
+        mode = ".agentic" if agentic else ".early" if early_exit else ""
+        results_path = RESULTS_CSV.with_name(f"{RESULTS_CSV.stem}.{stage_cache.run_fingerprint}{mode}.partial.csv")
+        print(f"[Client] Incremental run {stage_cache.run_fingerprint} (stage cache).")
+    # Dossiers are flushed with every results flush, so a recorded row always has its dossier
+    results_writer = ResultsWriter(results_path, before_flush=get_dossier_store().flush)
+    if len(results_writer):
+        print(f"[Client] Resuming: Found {len(results_writer)} already processed stories.")
 
     total_stories = len(full_df)
-    print(f"[Client] Total stories: {total_stories}. Remaining: {total_stories - len(processed_ids)}")
+    print(f"[Client] Total stories: {total_stories}. Remaining: {total_stories - len(results_writer)}")
     
     for index, row in full_df.iterrows():
         story_id = str(row.get("id", index))
         
-        if story_id in processed_ids:
+        if story_id in results_writer:
             continue
             
         book_name = row.get("book_name")
@@ -81,70 +99,80 @@ def run_full_pipeline():
         print(f"\nProcessing Story {story_id} ({book_name})...")
         
         try:
-            # 1. Extract Claims
-            claims = extract_claims(backstory_text, story_id)
-            print(f"  Extracted {len(claims)} claims.")
-            
-            # 2. Retrieve Evidence (IO Bound, Local BM25 is fast)
-            evidence_map = {}
-            for claim in claims:
-                evidence_data = retrieve_evidence(claim, story_id)
-                evidence_list = []
-                for item in evidence_data:
-                    evidence_list.append({
-                        "text": item.get("text", ""),
-                        "score": item.get("score", 0.0),
-                        "metadata": item.get("metadata", {})
-                    })
-                evidence_map[claim["id"]] = evidence_list
-
-            # 3. Reason (Batch Mode - FAST)
-            from src.reasoning_llm import reason_about_all_claims
-            decisions = reason_about_all_claims(claims, evidence_map)
-            print(f"  Reasoned about {len(decisions)} claims in batch.")
-                
-            # 4. Aggregate
-            result = aggregate_decisions(decisions, story_id)
-            
-            # 5. Build Rationale
-            final_rationale = build_dossier(story_id, decisions, result["prediction"])
+            with PROFILER.story(story_id):
+                # 1-5. Extract, Retrieve, Reason, Aggregate, Build Rationale
+                char = row.get("char")
+                analysis = analyze_story(story_id, backstory_text, char=char if isinstance(char, str) else None,
+                                         claims=claims_by_story.get(story_id), early_exit=early_exit,
+                                         stage_cache=stage_cache, book_name=book_name, agentic=agentic)
+                result = analysis["result"]
+                final_rationale = analysis["rationale"]
             
-            # 6. Save IMMEDIATE (Incremental)
-            result_row = {
-                "Story ID": story_id,
-                "Prediction": result["prediction"],
-                "Rationale": final_rationale
-            }
+                # 6. Save (Buffered, flushed every few stories)
+                results_writer.write(story_id, result["prediction"], final_rationale)
             
-            pd.DataFrame([result_row]).to_csv(RESULTS_CSV, mode='a', header=write_header, index=False)
-            write_header = False # Next rows won't need header
+                print(f"  > Recorded result for {story_id}.")
             
-            print(f"  > Saved result for {story_id}.")
-            
-            # Proactive cooldown (Reduced to 5s since calls are vastly fewer)
-            time.sleep(5)
+            # Proactive cooldown (Reduced to 5s since calls are vastly fewer); not needed for cached stories
+            if "nli" in analysis.get("recomputed", {"nli"}):
+                time.sleep(5)
             
         except Exception as e:
             print(f"  ERROR processing story {story_id}: {e}")
             # Optional: Save error state? 
             # For now, we just skip saving so it can be retried.
 
+    results_writer.close()
+    if stage_cache is not None:
+        if len(results_writer) >= total_stories:
+            os.replace(results_path, RESULTS_CSV)
+            os.replace(results_writer.ids_path, RESULTS_CSV.with_name(RESULTS_CSV.name + ".ids"))
+            print(f"[Client] Results for run {stage_cache.run_fingerprint} saved to {RESULTS_CSV}")
+        else:
+            print(f"[Client] {total_stories - len(results_writer)} stories failed; partial results kept in "
+                  f"{results_path.name} (rerun to resume).")
+    get_dossier_store().close()
     print("\n[Client] Processing complete.")
+    PROFILER.print_summary()
+    PROFILER.write_report(PROFILE_REPORT_JSON, PROFILE_REPORT_CSV)
+    print(f"[Client] Profile report saved to {PROFILE_REPORT_JSON}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the full pipeline on train + test with resume.")
+    parser.add_argument("--no-server", action="store_true",
+                        help="Use an already running retrieval server on 8765 instead of starting one")
+    parser.add_argument("--server-wait", type=float, default=10.0,
+                        help="Seconds to wait for the retrieval server to start")
+    parser.add_argument("--early-exit", action="store_true",
+                        help="Stop a story once a core contradiction fixes its verdict")
+    parser.add_argument("--agentic", action="store_true",
+                        help="Reason with the LangGraph agent, re-querying NLI-inconclusive claims (needs langgraph)")
+    parser.add_argument("--stage-cache", action="store_true",
+                        help="Recompute only the stages a config/model/index change affects (results replace "
+                             "RESULTS_CSV once every story succeeds)")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
+    args = parse_args()
+
     # 1. Start Pathway Server
-    server_process = multiprocessing.Process(target=start_pathway_server)
-    server_process.start()
+    server_process = None
+    if not args.no_server:
+        server_process = multiprocessing.Process(target=start_pathway_server)
+        server_process.start()
     
-    # Wait for server
-    print("Waiting 10s for server...")
-    time.sleep(10) 
+        # Wait for server
+        print(f"Waiting {args.server_wait:.0f}s for server...")
+        time.sleep(args.server_wait) 
     
     try:
-        run_full_pipeline()
+        run_full_pipeline(early_exit=args.early_exit or EARLY_TERMINATION,
+                          incremental=STAGE_CACHE or args.stage_cache,
+                          agentic=args.agentic or AGENTIC_REASONING)
     except Exception as e:
         print(f"Pipeline failed: {e}")
     finally:
-        print("Stopping server...")
-        server_process.terminate()
-        server_process.join()
+        if server_process is not None:
+            print("Stopping server...")
+            server_process.terminate()
+            server_process.join()
@@ -0,0 +1,112 @@
+"""
+Incremental recomputation: per-stage outputs keyed by fingerprints.
+
+Every story goes through claims -> retrieval -> nli -> aggregate. Each
+stage's output is stored under STAGE_CACHE_DIR/<stage>/ keyed by a hash of
+its inputs (the upstream stage's output) and of the stage's own code
+version and config. A rerun recomputes a stage only when that key changes;
+a recomputed stage whose output is unchanged leaves everything downstream
+cached. So a threshold tweak only re-aggregates, and an index change
+re-retrieves and re-scores only the claims whose evidence changed: NLI
+outputs are stored per claim, keyed by the claim and the excerpts it is
+scored against (see `pipeline.score_claims_cached`).
+
+Bump a STAGE_VERSIONS entry whenever the stage's code changes its output.
+"""
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from .config import (STAGE_CACHE_DIR, NOVELS_DIR, RETRIEVAL_K, DETAIL_RETRIEVAL_K, DETAIL_NLI_EVIDENCE,
+                     SYMBOLIC_CHECK, SYMBOLIC_SUPPORT_CONFIDENCE, SYMBOLIC_CONTRADICT_CONFIDENCE, USE_DUMMY_LLM)
+from .chunk_index import (corpus_fingerprint, FALLBACK_TOP_K, BM25_K1, BM25_B, PHRASE_BOOST,
+                          PROXIMITY_BOOST, PROXIMITY_WINDOW, PROXIMITY_CANDIDATES)
+from .text_analyzer import ANALYZER_VERSION
+from .profiling import PROFILER
+
+STAGES = ("claims", "retrieval", "nli", "aggregate")
+STAGE_VERSIONS = {"claims": "1", "retrieval": "1", "nli": "3", "aggregate": "2"}
+
+def _json_default(obj):
+    if hasattr(obj, "tolist"): # numpy arrays and scalars
+        return obj.tolist()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+def plain(value):
+    """JSON-normalized copy, so freshly computed outputs match cached ones."""
+    return json.loads(json.dumps(value, default=_json_default))
+
+def fingerprint(*parts) -> str:
+    """Stable short hash of JSON-serializable parts."""
+    data = json.dumps(parts, sort_keys=True, default=_json_default, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+def stage_fingerprints(novels_dir=NOVELS_DIR) -> dict:
+    """Code/config fingerprint of every stage (independent of the story being processed)."""
+    from .nli_engine import MODEL_NAME, CONTRADICT_THRESHOLD, ENTAIL_THRESHOLD
+    from .reasoning_llm import DEFAULT_SUPPORT_CONFIDENCE
+    corpus = corpus_fingerprint(novels_dir)
+    return {
+        "claims": fingerprint("claims", STAGE_VERSIONS["claims"]),
+        "retrieval": fingerprint("retrieval", STAGE_VERSIONS["retrieval"], corpus, ANALYZER_VERSION,
+                                 RETRIEVAL_K, DETAIL_RETRIEVAL_K, FALLBACK_TOP_K, BM25_K1, BM25_B, PHRASE_BOOST,
+                                 PROXIMITY_BOOST, PROXIMITY_WINDOW, PROXIMITY_CANDIDATES, USE_DUMMY_LLM),
+        "nli": fingerprint("nli", STAGE_VERSIONS["nli"], MODEL_NAME, DETAIL_NLI_EVIDENCE, SYMBOLIC_CHECK,
+                           SYMBOLIC_SUPPORT_CONFIDENCE, SYMBOLIC_CONTRADICT_CONFIDENCE,
+                           corpus if SYMBOLIC_CHECK else None), # The fact table is built from the corpus
+        "aggregate": fingerprint("aggregate", STAGE_VERSIONS["aggregate"], CONTRADICT_THRESHOLD,
+                                 ENTAIL_THRESHOLD, DEFAULT_SUPPORT_CONFIDENCE),
+    }
+
+class StageCache:
+    def __init__(self, cache_dir=STAGE_CACHE_DIR, fingerprints: dict = None):
+        self.cache_dir = Path(cache_dir)
+        self.fingerprints = fingerprints or stage_fingerprints()
+
+    @property
+    def run_fingerprint(self) -> str:
+        """Changes whenever any stage's code or config does."""
+        return fingerprint(*(self.fingerprints[s] for s in STAGES))
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.cache_dir / stage / key[:2] / f"{key}.json.gz"
+
+    def key(self, stage: str, inputs) -> str:
+        return fingerprint(self.fingerprints[stage], inputs)
+
+    def get(self, stage: str, key: str):
+        path = self._path(stage, key)
+        if not path.exists():
+            return None
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[StageCache] Ignoring unreadable {stage} entry {key}: {e}")
+            return None
+
+    def put(self, stage: str, key: str, value):
+        path = self._path(stage, key)
+        os.makedirs(path.parent, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(value, f, default=_json_default, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def run(self, stage: str, inputs, compute, complete=lambda value: True):
+        """
+        Returns (output, hit). On a miss, compute() runs and its output is stored
+        if complete(output) (partial results, e.g. after an NLI failure, are not).
+        Outputs come back JSON-normalized either way, so hits and misses match.
+        """
+        key = self.key(stage, inputs)
+        cached = self.get(stage, key)
+        PROFILER.cache(f"stage.{stage}", hit=cached is not None)
+        if cached is not None:
+            return cached, True
+        value = compute()
+        if complete(value):
+            self.put(stage, key, value)
+        return plain(value), False
@@ -0,0 +1,92 @@
+"""
+Shared text analyzer for indexing and querying.
+
+Unicode normalization (accents folded, so "Dantès" == "dantes"),
+lowercasing, punctuation stripping, stopword removal and light suffix
+stemming, plus a memoized term -> id vocabulary. The chunk index and the
+query side must analyze with the same analyzer (and ANALYZER_VERSION).
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+# Bump when any rule below changes: cached analyzed corpora are keyed by it
+ANALYZER_VERSION = "2"
+
+STOPWORDS = frozenset("""
+a an the and or but then so of to in on at by for with from as into onto about over under
+is was were be been being are am has had have do did does it its this that these those there
+he she his her him they them their we our you your i my me who whom which what when where while
+s
+""".split()) | {"book_context"} # Prefix retrieval adds to every query
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+")
+# Multi-word names: capitalized words joined by name particles ("Count of Monte Cristo", "Château d'If"),
+# or any quoted span
+_PHRASE_RE = re.compile(r"[A-ZÀ-Ý][\w’']*(?:\s+(?:(?:of|de|du|la|le|the)\s+)?(?:d['’])?[A-ZÀ-Ý][\w’']*)+"
+                        r"|[\"“]([^\"”]+)[\"”]")
+# Curly quotes and similar marks become plain separators before tokenizing
+_PUNCT_TRANSLATION = str.maketrans({"’": "'", "‘": "'", "“": '"', "”": '"', "—": " ", "–": " "})
+
+@lru_cache(maxsize=200_000)
+def stem(token: str) -> str:
+    """Light suffix stripping (plural, -ed, -ing, -ly); stems keep at least 3 letters."""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if re.search(r"(?:ss|x|z|ch|sh)es$", token):
+        return token[:-2]
+    for suffix in ("ing", "ed", "ly", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            if suffix == "s" and token.endswith("ss"):
+                return token
+            return token[:-len(suffix)]
+    return token
+
+def normalize(text: str) -> str:
+    """NFKD-folds accents and lowercases."""
+    text = unicodedata.normalize("NFKD", text.translate(_PUNCT_TRANSLATION))
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+
+class Analyzer:
+    def __init__(self, stopwords=STOPWORDS):
+        self.stopwords = stopwords
+        self.vocab = {}   # term -> id
+
+    def tokens(self, text: str) -> list:
+        """Normalized, stemmed terms in order (stopwords removed)."""
+        return [stem(t) for t in _TOKEN_RE.findall(normalize(text)) if t not in self.stopwords]
+
+    def term_id(self, term: str, add: bool = False):
+        tid = self.vocab.get(term)
+        if tid is None and add:
+            tid = self.vocab[term] = len(self.vocab)
+        return tid
+
+    def term_ids(self, text: str, add: bool = False) -> list:
+        """
+        Term ids of a text. With add=False (query side) unknown terms are dropped,
+        since they cannot match anything in the index.
+        """
+        ids = (self.term_id(t, add) for t in self.tokens(text))
+        return [i for i in ids if i is not None]
+
+    def phrases(self, text: str) -> list:
+        """
+        Term-id sequences of the multi-word names and quoted spans in a query
+        (only those with 2+ indexed terms, all known to the vocabulary).
+        """
+        found = []
+        for match in _PHRASE_RE.finditer(text):
+            terms = self.tokens(match.group(1) or match.group(0))
+            ids = [self.vocab.get(t) for t in terms]
+            if len(ids) >= 2 and None not in ids:
+                found.append(ids)
+        return found
+
+_default = Analyzer()
+
+def analyze(text: str) -> list:
+    """Terms of `text` with the default analyzer."""
+    return _default.tokens(text)
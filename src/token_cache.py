@@ -0,0 +1,108 @@
+"""
+Pre-tokenized novel chunks for the NLI cross-encoder.
+
+The same chunks are premises for many claims, so their token ids (without
+special tokens) are computed once with the model's tokenizer and stored
+under TOKEN_CACHE_DIR, keyed by tokenizer version and corpus fingerprint.
+nli_engine assembles model inputs from these ids plus the freshly
+tokenized claim.
+
+Chunk ids are file offsets, so a lookup also checks a hash of the premise
+text: ids from another chunking or an edited novel are never used.
+
+File layout (npz): chunk_ids (str), hashes (str), offsets (int64, n + 1), tokens (int32, flat).
+"""
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .chunk_index import chunk_text, corpus_fingerprint
+from .config import NOVELS_DIR, TOKEN_CACHE_DIR
+
+TOKENIZE_BATCH = 256
+CACHE_FORMAT = "2" # Bump when the file layout changes
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+def tokenizer_version(tokenizer) -> str:
+    """Short id that changes whenever the tokenizer (or its library) could tokenize differently."""
+    try:
+        import transformers
+        lib_version = transformers.__version__
+    except ImportError:
+        lib_version = "?"
+    key = f"{getattr(tokenizer, 'name_or_path', '')}|{type(tokenizer).__name__}|{len(tokenizer)}|{lib_version}"
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+class PremiseTokenCache:
+    def __init__(self, version: str):
+        self.version = version
+        self.ids = {}     # chunk_id -> int32 token ids
+        self.hashes = {}  # chunk_id -> text_hash of the tokenized text
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, chunk_id, text: str):
+        """Token ids of the chunk, or None unless they were computed from exactly `text`."""
+        if chunk_id is None or chunk_id not in self.ids:
+            return None
+        if self.hashes.get(chunk_id) != text_hash(text):
+            return None
+        return self.ids[chunk_id]
+
+    def add_chunks(self, tokenizer, items, batch_size: int = TOKENIZE_BATCH):
+        """Tokenizes [(chunk_id, text)] in batches (fast tokenizers parallelize internally)."""
+        items = [(cid, text) for cid, text in items if cid not in self.ids]
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            encoded = tokenizer([text for _, text in batch], add_special_tokens=False)["input_ids"]
+            for (cid, text), ids in zip(batch, encoded):
+                self.ids[cid] = np.asarray(ids, dtype=np.int32)
+                self.hashes[cid] = text_hash(text)
+
+    def save(self, path: Path):
+        chunk_ids = list(self.ids)
+        lengths = [len(self.ids[c]) for c in chunk_ids]
+        offsets = np.zeros(len(chunk_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        tokens = np.concatenate([self.ids[c] for c in chunk_ids]) if chunk_ids else np.zeros(0, np.int32)
+        os.makedirs(path.parent, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp, chunk_ids=np.array(chunk_ids), hashes=np.array([self.hashes[c] for c in chunk_ids]),
+                 offsets=offsets, tokens=tokens)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, version: str):
+        cache = cls(version)
+        with np.load(path) as data:
+            offsets, tokens = data["offsets"], data["tokens"]
+            for i, (cid, h) in enumerate(zip(data["chunk_ids"].tolist(), data["hashes"].tolist())):
+                cache.ids[cid] = tokens[offsets[i]:offsets[i + 1]]
+                cache.hashes[cid] = h
+        return cache
+
+def load_or_build(tokenizer, novels_dir=NOVELS_DIR, cache_dir=TOKEN_CACHE_DIR) -> PremiseTokenCache:
+    """
+    Loads the cache for this tokenizer + corpus, or tokenizes every chunk of
+    the novels (same chunking and chunk ids as ChunkIndex) and saves it.
+    """
+    version = tokenizer_version(tokenizer)
+    path = Path(cache_dir) / f"{version}_{corpus_fingerprint(novels_dir)}.v{CACHE_FORMAT}.npz"
+    if path.exists():
+        cache = PremiseTokenCache.load(path, version)
+        print(f"[NLI] Loaded {len(cache)} pre-tokenized chunks from {path.name}.")
+        return cache
+
+    cache = PremiseTokenCache(version)
+    for file_path in sorted(Path(novels_dir).glob("*.txt")):
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+        cache.add_chunks(tokenizer, ((f"{file_path.name}#{offset}", chunk) for offset, chunk in chunk_text(text)))
+    cache.save(path)
+    print(f"[NLI] Pre-tokenized {len(cache)} chunks into {path.name}.")
+    return cache
@@ -0,0 +1,233 @@
+"""
+Threshold tuning harness.
+
+Step 1 (slow, once): run extraction + retrieval + `score_claims` over
+train.csv exactly as the pipeline does (character-aware extraction, detail
+claims scored against their top excerpts only, symbolic pre-check) and
+record the raw per-pair NLI probabilities, each claim's importance and any
+symbolic decision.
+Step 2 (fast, many times): replay the decision rules of `decide_claims` and
+the `CausalAggregator` rules (detail claims never trigger the core override)
+in memory for any threshold configuration, scored with `compute_metrics`.
+
+Usage:
+    python -m src.tuning record            # needs the retrieval server on 8765
+    python -m src.tuning search --method grid
+    python -m src.tuning search --method random --trials 500
+"""
+import argparse
+import itertools
+import random
+import time
+import numpy as np
+
+from .config import TRAIN_CSV, NLI_CACHE_PATH, BOOK_MAPPING
+from .aggregation import CausalAggregator, LABEL_CODES
+from .evaluate_metrics import compute_metrics
+from .nli_engine import CONTRADICT_THRESHOLD, ENTAIL_THRESHOLD
+from .reasoning_llm import DEFAULT_SUPPORT_CONFIDENCE
+
+LABEL_MAP = {"consistent": 1, "contradict": 0}
+
+DEFAULT_PARAMS = {
+    "contradict_threshold": CONTRADICT_THRESHOLD,
+    "entail_threshold": ENTAIL_THRESHOLD,
+    "core_threshold": 0.8,
+    "support_threshold": 2.0,
+    "contradiction_ratio": 0.5,
+}
+
+DEFAULT_GRID = {
+    "contradict_threshold": [0.5, 0.6, 0.7, 0.8, 0.9, 0.95],
+    "entail_threshold": [0.5, 0.6, 0.7, 0.8, 0.9, 0.95],
+    "core_threshold": [0.6, 0.7, 0.8, 0.9, 0.95],
+    "support_threshold": [2.0],  # Only affects the rationale text, not the prediction
+    "contradiction_ratio": [0.25, 0.5, 0.75, 1.0, 1.5],
+}
+
+def new_columns() -> dict:
+    return {"story_ids": [], "labels": [], "claim_story_idx": [], "claim_importance": [],
+            "claim_symbolic_code": [], "claim_symbolic_conf": [], "pair_claim_idx": [], "pair_probs": []}
+
+def append_story(columns: dict, story_id: str, label: int, claims: list, scores: dict):
+    """Adds one story's claims and their `score_claims` output to the recording columns."""
+    s_idx = len(columns["story_ids"])
+    columns["story_ids"].append(story_id)
+    columns["labels"].append(label)
+    for claim in claims:
+        c_idx = len(columns["claim_story_idx"])
+        columns["claim_story_idx"].append(s_idx)
+        columns["claim_importance"].append(0.0 if claim.get("importance") == "detail" else 1.0)
+        score = scores.get(claim["id"], {})
+        symbolic = score.get("symbolic")
+        columns["claim_symbolic_code"].append(LABEL_CODES[symbolic["label"]] if symbolic else -1)
+        columns["claim_symbolic_conf"].append(symbolic["confidence"] if symbolic else 0.0)
+        if "probabilities" in score:
+            probs = np.asarray(score["probabilities"], dtype=np.float32)
+            columns["pair_claim_idx"].extend([c_idx] * len(probs))
+            columns["pair_probs"].append(probs)
+
+def save_columns(columns: dict, cache_path=NLI_CACHE_PATH):
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    pair_probs = columns["pair_probs"]
+    np.savez_compressed(
+        cache_path,
+        story_ids=np.array(columns["story_ids"]),
+        labels=np.array(columns["labels"], dtype=np.int8),
+        claim_story_idx=np.array(columns["claim_story_idx"], dtype=np.int64),
+        claim_importance=np.array(columns["claim_importance"], dtype=np.float64),
+        claim_symbolic_code=np.array(columns["claim_symbolic_code"], dtype=np.int8),
+        claim_symbolic_conf=np.array(columns["claim_symbolic_conf"], dtype=np.float64),
+        pair_claim_idx=np.array(columns["pair_claim_idx"], dtype=np.int64),
+        pair_probs=np.concatenate(pair_probs) if pair_probs else np.zeros((0, 3), dtype=np.float32),
+    )
+    print(f"[Tuning] Saved {len(columns['pair_claim_idx'])} pair probabilities to {cache_path}")
+
+def record_nli_probabilities(csv_path=TRAIN_CSV, cache_path=NLI_CACHE_PATH):
+    """
+    Runs extraction, retrieval and scoring once, as `pipeline.analyze_story`
+    does, and stores the raw probabilities in a columnar .npz file (one row
+    per evidence/claim pair, plus per-claim importance and symbolic decisions).
+    """
+    import pandas as pd
+    from .claim_extraction import extract_claims
+    from .pipeline import collect_evidence
+    from .reasoning_llm import score_claims
+
+    df = pd.read_csv(csv_path)
+    columns = new_columns()
+    for s_idx, (_, row) in enumerate(df.iterrows()):
+        story_id = str(row.get("id", s_idx))
+        print(f"[Tuning] Recording story {story_id} ({s_idx + 1}/{len(df)})...")
+        char = row.get("char") if isinstance(row.get("char"), str) else None
+        claims = extract_claims(row.get("content"), story_id, char)
+        evidence_map = {c["id"]: collect_evidence(c, story_id) for c in claims}
+        scores = score_claims(claims, evidence_map, BOOK_MAPPING.get(row.get("book_name")), char)
+        append_story(columns, story_id, LABEL_MAP.get(row.get("label"), -1), claims, scores)
+    save_columns(columns, cache_path)
+
+def load_nli_cache(cache_path=NLI_CACHE_PATH) -> dict:
+    """
+    Loads a recorded cache and precomputes the per-claim max probabilities,
+    which are the only NLI signals the decision rules look at.
+    """
+    with np.load(cache_path) as data:
+        cache = {k: data[k] for k in data.files}
+    if "claim_importance" not in cache:
+        raise ValueError(f"{cache_path} predates importance/symbolic recording; rerun `python -m src.tuning record`.")
+
+    n_claims = len(cache["claim_story_idx"])
+    max_contra = np.zeros(n_claims)
+    max_entail = np.zeros(n_claims)
+    np.maximum.at(max_contra, cache["pair_claim_idx"], cache["pair_probs"][:, 0])
+    np.maximum.at(max_entail, cache["pair_claim_idx"], cache["pair_probs"][:, 1])
+
+    cache["max_contra"] = max_contra
+    cache["max_entail"] = max_entail
+    cache["has_evidence"] = np.bincount(cache["pair_claim_idx"], minlength=n_claims) > 0
+    return cache
+
+def replay(cache: dict, params: dict) -> np.ndarray:
+    """
+    Re-derives claim decisions and story predictions for one configuration.
+    Mirrors decide_claims: symbolic decisions as recorded, else NLI
+    (CONTRADICT > SUPPORT > inconclusive) with the default SUPPORT assumption;
+    detail claims are masked out of the aggregator's core override.
+    """
+    p = {**DEFAULT_PARAMS, **params}
+    max_contra, max_entail = cache["max_contra"], cache["max_entail"]
+    has_ev = cache["has_evidence"]
+
+    is_contra = has_ev & (max_contra > p["contradict_threshold"])
+    is_entail = has_ev & ~is_contra & (max_entail > p["entail_threshold"])
+
+    label_code = np.where(is_contra, LABEL_CODES["CONTRADICT"], LABEL_CODES["SUPPORT"])
+    confidence = np.where(is_contra, max_contra,
+                          np.where(is_entail, max_entail, DEFAULT_SUPPORT_CONFIDENCE))
+    symbolic = cache["claim_symbolic_code"] >= 0
+    label_code = np.where(symbolic, cache["claim_symbolic_code"], label_code)
+    confidence = np.where(symbolic, cache["claim_symbolic_conf"], confidence)
+
+    aggregator = CausalAggregator(
+        core_threshold=p["core_threshold"],
+        support_threshold=p["support_threshold"],
+        contradiction_ratio=p["contradiction_ratio"],
+    )
+    result = aggregator.aggregate_batch(
+        cache["claim_story_idx"], label_code, confidence, cache["claim_importance"],
+        n_stories=len(cache["story_ids"]),
+    )
+    return result["prediction"]
+
+def evaluate_params(cache: dict, params: dict) -> dict:
+    """Metrics for one configuration against the recorded train labels."""
+    labeled = cache["labels"] >= 0
+    predictions = replay(cache, params)
+    return compute_metrics(cache["labels"][labeled], predictions[labeled])
+
+def grid_search(cache: dict, grid: dict = DEFAULT_GRID, metric: str = "accuracy") -> list:
+    """Exhaustive search. Returns [(metrics, params)] sorted best-first."""
+    keys = list(grid)
+    results = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        params = dict(zip(keys, values))
+        results.append((evaluate_params(cache, params), params))
+    results.sort(key=lambda r: r[0][metric], reverse=True)
+    return results
+
+def random_search(cache: dict, space: dict = None, n_trials: int = 200,
+                  metric: str = "accuracy", seed: int = 0) -> list:
+    """
+    Random search over continuous ranges {name: (low, high)}.
+    Returns [(metrics, params)] sorted best-first.
+    """
+    space = space or {k: (min(v), max(v)) for k, v in DEFAULT_GRID.items()}
+    rng = random.Random(seed)
+    results = []
+    for _ in range(n_trials):
+        params = {k: rng.uniform(lo, hi) for k, (lo, hi) in space.items()}
+        results.append((evaluate_params(cache, params), params))
+    results.sort(key=lambda r: r[0][metric], reverse=True)
+    return results
+
+def print_top(results: list, top: int = 10):
+    for rank, (m, params) in enumerate(results[:top], 1):
+        params_str = ", ".join(f"{k}={v:.3f}" for k, v in params.items())
+        print(f"{rank:>3}. acc={m['accuracy']:.2%} f1={m['f1']:.4f} "
+              f"prec={m['precision']:.4f} rec={m['recall']:.4f} | {params_str}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune NLI/aggregation thresholds on cached probabilities.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Run NLI once over train.csv and cache the probabilities")
+    rec.add_argument("--csv", default=str(TRAIN_CSV))
+
+    srch = sub.add_parser("search", help="Search thresholds against the cached probabilities")
+    srch.add_argument("--method", choices=["grid", "random"], default="grid")
+    srch.add_argument("--trials", type=int, default=200)
+    srch.add_argument("--metric", choices=["accuracy", "f1", "precision", "recall"], default="accuracy")
+    srch.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from pathlib import Path
+        record_nli_probabilities(Path(args.csv))
+        return
+
+    cache = load_nli_cache()
+    print(f"[Tuning] Baseline: {evaluate_params(cache, {})}")
+
+    start = time.perf_counter()
+    if args.method == "grid":
+        results = grid_search(cache, metric=args.metric)
+    else:
+        results = random_search(cache, n_trials=args.trials, metric=args.metric)
+    elapsed = time.perf_counter() - start
+
+    print(f"[Tuning] Evaluated {len(results)} configurations in {elapsed:.2f}s "
+          f"({elapsed / max(len(results), 1) * 1000:.2f} ms each)")
+    print_top(results, args.top)
+
+if __name__ == "__main__":
+    main()
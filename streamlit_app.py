@@ -2,17 +2,21 @@
 import streamlit as st
 import pandas as pd
 import json
-import time
+import queue
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Import pipeline components
-from src.claim_extraction import extract_claims
-from src.retrieval import retrieve_evidence
-from src.reasoning_llm import reason_about_all_claims
-from src.aggregation import aggregate_decisions
-from src.rationale_builder import build_dossier
+from src.pipeline import analyze_story
+from src.chunk_index import ChunkIndex, corpus_fingerprint
+from src.fact_table import FactTable, use_fact_table
+from src.dossier_store import get_dossier_store, import_legacy_dossiers, VIEWER_PAGE_SIZE
+from src import retrieval
 from src.run_all import TRAIN_CSV, RESULTS_CSV
+from src.config import NOVELS_DIR, DOSSIERS_DIR
+from src.nli_engine import (preload_nli_model, get_model_status,
+                            MODEL_NAME, CONTRADICT_THRESHOLD, ENTAIL_THRESHOLD)
 
 st.set_page_config(page_title="Narrative Consistency Guard", layout="wide")
 
@@ -22,10 +26,60 @@ st.markdown("""
 **Goal**: Verify if a character's backstory is consistent with the novel (Track A).
 """)
 
+# --- Cached resources (shared across reruns and sessions) ---
+
+@st.cache_resource(show_spinner=False)
+def start_model():
+    """Starts loading/warming DeBERTa once per process instead of on the first click."""
+    preload_nli_model(background=True)
+    return f"{MODEL_NAME}|{CONTRADICT_THRESHOLD}|{ENTAIL_THRESHOLD}"
+
+@st.cache_resource(show_spinner="Indexing novels...")
+def load_index(version: str):
+    """In-process BM25 index over the novels, so the app needs no retrieval server."""
+    return ChunkIndex.from_dir(NOVELS_DIR)
+
+@st.cache_resource(show_spinner="Extracting dates and places...")
+def load_fact_table(version: str):
+    """Fact table for the symbolic pre-check, built from the cached index's chunks."""
+    return FactTable.from_index(load_index(version))
+
+@st.cache_resource
+def get_executor():
+    # One background worker: analyses run off the script thread and stream progress back
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis")
+
+@st.cache_resource
+def get_analysis_cache():
+    """Memoized analyses keyed by (story_id, index_version, model_version)."""
+    return {}
+
+@st.cache_data(show_spinner=False)
+def load_results(path: str, mtime: float):
+    # Keyed by mtime: re-read only when the results file actually changes
+    return pd.read_csv(path)
+
+@st.cache_resource(show_spinner="Importing legacy dossiers...")
+def import_legacy(version: float):
+    """Copies the per-story JSON dossiers the store lacks into it (once per change of the folder)."""
+    n = import_legacy_dossiers(DOSSIERS_DIR, get_dossier_store())
+    if n:
+        print(f"[Dossier] Imported {n} legacy dossiers into the store.")
+    return n
+
+model_version = start_model()
+index_version = corpus_fingerprint(NOVELS_DIR)
+retrieval.use_local_index(load_index(index_version))
+use_fact_table(load_fact_table(index_version))
+
 # --- Sidebar ---
 st.sidebar.header("Navigation")
 mode = st.sidebar.radio("Mode", ["Interactive Analysis", "View Results"])
 
+model_status = get_model_status()
+st.sidebar.caption(f"NLI model: **{model_status['state']}**"
+                   + (f" ({model_status['error']})" if model_status["error"] else ""))
+
 @st.cache_data
 def load_data():
     if TRAIN_CSV.exists():
@@ -41,7 +95,7 @@ if mode == "View Results":
     st.header("📊 Batch Analysis Dashboard")
     
     if RESULTS_CSV.exists():
-        res_df = pd.read_csv(RESULTS_CSV)
+        res_df = load_results(str(RESULTS_CSV), RESULTS_CSV.stat().st_mtime)
         
         # --- Metrics Section ---
         col1, col2, col3 = st.columns(3)
@@ -58,71 +112,81 @@ if mode == "View Results":
         
         st.divider()
         
-        # --- Filter & Table ---
-        filter_status = st.radio("Filter Verdict:", ["All", "Consistent Only", "Inconsistent Only"], horizontal=True)
+        # --- Filter & Table (served from the dossier store index, one page at a time) ---
+        store = get_dossier_store()
+        store.refresh()
+        if DOSSIERS_DIR.exists():
+            import_legacy(DOSSIERS_DIR.stat().st_mtime)
+        rationales = dict(zip(res_df["Story ID"].astype(str), res_df["Rationale"]))
         
-        filtered_df = res_df.copy()
-        if filter_status == "Consistent Only":
-            filtered_df = res_df[res_df["Prediction"] == 1]
-        elif filter_status == "Inconsistent Only":
-            filtered_df = res_df[res_df["Prediction"] == 0]
-            
-        st.dataframe(
-            filtered_df,
-            column_config={
-                "Prediction": st.column_config.CheckboxColumn("Consistent?", disabled=True),
-                "Rationale": "Summary Rationale"
-            },
-            use_container_width=True,
-            hide_index=True
-        )
+        f1, f2 = st.columns([2, 1])
+        filter_status = f1.radio("Filter Verdict:", ["All", "Consistent Only", "Inconsistent Only"], horizontal=True)
+        min_confidence = f2.slider("Min. confidence", 0.0, 1.0, 0.0, 0.05)
+        prediction = {"Consistent Only": 1, "Inconsistent Only": 0}.get(filter_status)
+        
+        total_matches, _ = store.query_stories(prediction, min_confidence, limit=0)
+        n_pages = max(1, -(-total_matches // VIEWER_PAGE_SIZE))
+        page_no = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1)
+        _, page = store.query_stories(prediction, min_confidence,
+                                      offset=(page_no - 1) * VIEWER_PAGE_SIZE, limit=VIEWER_PAGE_SIZE)
+        page_df = pd.DataFrame(page)
+        if not page_df.empty:
+            page_df["rationale"] = page_df["story_id"].map(rationales)
+        
+        if not page_df.empty:
+            st.dataframe(
+                page_df,
+                column_config={
+                    "story_id": "Story ID",
+                    "prediction": st.column_config.CheckboxColumn("Consistent?", disabled=True),
+                    "confidence": st.column_config.NumberColumn("Confidence", format="%.2f"),
+                    "claims": "Claims",
+                    "contradictions": "Contradictions",
+                    "entries": "Excerpts",
+                    "rationale": "Summary Rationale"
+                },
+                use_container_width=True,
+                hide_index=True
+            )
+        missing = len(set(rationales) - set(store.story_ids()))
+        st.caption(f"{total_matches} stories match."
+                   + (f" {missing} results have no dossier and are not listed." if missing else ""))
         
         # --- Deep Dive Inspection ---
         st.subheader("🔍 Deep Dive Inspection")
-        if not filtered_df.empty:
-            selected_id = st.selectbox("Select Story ID to audit:", filtered_df["Story ID"].unique())
+        if not page_df.empty:
+            selected_id = st.selectbox("Select Story ID to audit:", page_df["story_id"])
             
             if selected_id:
-                row = filtered_df[filtered_df["Story ID"] == selected_id].iloc[0]
-                
-                # Parse the Rationale String to recreate the Card
-                rationale_raw = str(row["Rationale"])
-                
-                # Simple parser for our strict format: [Claim]: X | [Evidence]: Y | [Analysis]: Z
-                claim_part = rationale_raw
-                evidence_part = "See above"
-                analysis_part = "See above"
+                summary = page_df[page_df["story_id"] == selected_id].iloc[0]
+                claims = store.story_claims(selected_id) or []
                 
-                if "[Claim]:" in rationale_raw:
-                    parts = rationale_raw.split("|")
-                    for p in parts:
-                        p = p.strip()
-                        if p.startswith("[Claim]:"): claim_part = p.replace("[Claim]:", "").strip()
-                        if p.startswith("[Evidence]:"): evidence_part = p.replace("[Evidence]:", "").strip().replace('"', '')
-                        if p.startswith("[Analysis]:"): analysis_part = p.replace("[Analysis]:", "").strip()
+                st.markdown("### 🧩 Evidence Dossier")
+                st.caption(f"Audit Log for Story ID: {selected_id} "
+                           f"({'✅ VALID' if summary['prediction'] == 1 else '❌ FALSE'}, {len(claims)} claims)")
                 
-                # Display Card
-                st.markdown("### 🧩 Evidence Dossier Card")
-                st.caption(f"Audit Log for Story ID: {selected_id}")
-                
-                with st.container(border=True):
-                    c1, c2 = st.columns([1, 4])
-                    with c1:
-                         if row['Prediction'] == 1:
-                            st.markdown("## ✅\n**VALID**")
-                         else:
-                            st.markdown("## ❌\n**FALSE**")
-                    
-                    with c2:
-                        st.markdown(f"**Questioned Claim**: {claim_part}")
-                        st.info(f"**Logic Analysis**: {analysis_part}")
-                    
-                    with st.expander("📜 Primary Source Evidence (Verbatim)", expanded=True):
-                        # Highlight evidence text based on verdict
-                        if row['Prediction'] == 0:
-                            st.markdown(f"> :red[**\"{evidence_part}\"**]")
-                        else:
-                            st.markdown(f"> :green[**\"{evidence_part}\"**]")
+                for claim in claims:
+                    lbl = claim["label"] or "NONE"
+                    with st.container(border=True):
+                        c1, c2 = st.columns([1, 4])
+                        with c1:
+                            conf = f"{claim['confidence'] * 100:.0f}% Conf" if claim["confidence"] is not None else ""
+                            st.metric("Verdict", {"SUPPORT": "✅ VALID", "CONTRADICT": "❌ FALSE"}.get(lbl, "❓ UNSURE"), conf,
+                                      delta_color="inverse" if lbl == "CONTRADICT" else "normal" if lbl == "SUPPORT" else "off")
+                        with c2:
+                            st.markdown(f"**Questioned Claim**: {claim['claim_text']}")
+                        
+                        # Excerpts are only read from the store when the claim is opened
+                        show = st.toggle(f"📜 Primary Source Evidence ({len(claim['evidence'])})",
+                                         key=f"ev_{selected_id}_{claim['claim_id']}")
+                        if show:
+                            if not claim["evidence"]:
+                                st.caption("No direct retrieval matches found.")
+                            for ev in claim["evidence"]:
+                                excerpt = store.get_excerpt(ev["excerpt_ref"])
+                                colour = "red" if ev.get("relation") == "CONTRADICT" else "green" if ev.get("relation") == "SUPPORT" else "gray"
+                                st.markdown(f"> :{colour}[**\"{excerpt}\"**]")
+                                st.caption(f"{ev['excerpt_ref']} · {ev.get('relation', 'NONE')} · {ev.get('analysis', '')}")
         else:
             st.info("No stories match the current filter.")
 
@@ -146,110 +210,137 @@ elif mode == "Interactive Analysis":
             with st.expander("📖 Read Backstory Profile", expanded=False):
                 st.markdown(f"*{row['content']}*")
             
-            if st.button("🚀 Analyze Consistency", type="primary"):
+            cache_key = (story_id, index_version, model_version)
+            analysis_cache = get_analysis_cache()
+            analysis = analysis_cache.get(cache_key)
+            
+            if analysis is None and st.button("🚀 Analyze Consistency", type="primary"):
                 
-                # --- Pipeline Execution ---
+                # --- Pipeline Execution (background worker, progress streamed per claim) ---
                 with st.status("Running Hybrid Neuro-Symbolic Pipeline...", expanded=True) as status:
                     
                     try:
-                        # 1. Extraction
+                        events = queue.Queue()
+                        future = get_executor().submit(
+                            analyze_story, story_id, row["content"],
+                            lambda event, payload: events.put((event, payload)),
+                            row["char"] if isinstance(row.get("char"), str) else None,
+                            book_name=row.get("book_name"))
+                        
                         status.write("🔍 Step 1: Decomposing Backstory into Claims (Regex)...")
-                        claims = extract_claims(row["content"], story_id)
-                        time.sleep(0.5) # UX feel
+                        progress = st.progress(0.0)
+                        n_claims = n_evidence = n_decided = 0
+                        if get_model_status()["state"] != "ready":
+                            status.write("⏳ NLI model is still warming up; retrieval starts meanwhile...")
+                        
+                        while not (future.done() and events.empty()):
+                            try:
+                                event, payload = events.get(timeout=0.1)
+                            except queue.Empty:
+                                continue
+                            if event == "claims":
+                                n_claims = len(payload)
+                                status.write(f"📚 Step 2: Adversarial Retrieval (BM25) for {n_claims} claims...")
+                            elif event == "evidence":
+                                # Early exit checks claims out of order: progress counts events, i names the claim
+                                n_evidence += 1
+                                progress.progress(n_evidence / (2 * max(n_claims, 1)))
+                            elif event == "decision":
+                                i, decision = payload
+                                if n_decided == 0:
+                                    status.write("🧠 Step 3: Neuro-Symbolic Verification (DeBERTa NLI)...")
+                                n_decided += 1
+                                status.write(f"&nbsp;&nbsp;Claim {i + 1}/{n_claims}: **{decision['label']}** "
+                                             f"({decision['confidence']:.2f})")
+                                progress.progress(0.5 + n_decided / (2 * max(n_claims, 1)))
+                            elif event == "skipped":
+                                status.write(f"⏭️ Core contradiction found; skipped the remaining {len(payload)} "
+                                             f"claims (verdict is fixed).")
+                            elif event == "result":
+                                progress.progress(1.0)
+                                status.write("📝 Step 4: Compiling Evidence Dossier...")
+                        
+                        analysis = future.result()
+                        get_dossier_store().flush()
                         
-                        if not claims:
+                        if not analysis["claims"]:
                             status.update(label="Failed: No claims found.", state="error")
                             st.warning("No verifiable claims found in extraction.")
+                            analysis = None
                         else:
-                            # 2. Retrieval
-                            status.write(f"📚 Step 2: Adversarial Retrieval (BM25 + Vector) for {len(claims)} claims...")
-                            evidence_map = {}
-                            for claim in claims:
-                                ev_data = retrieve_evidence(claim, story_id)
-                                evidence_list = []
-                                for item in ev_data:
-                                    evidence_list.append({
-                                        "text": item.get("text", ""),
-                                        "score": item.get("score", 0.0),
-                                        "metadata": item.get("metadata", {})
-                                    })
-                                evidence_map[claim["id"]] = evidence_list
-                            
-                            # 3. Reasoning
-                            status.write("🧠 Step 3: Neuro-Symbolic Verification (DeBERTa NLI)...")
-                            decisions = reason_about_all_claims(claims, evidence_map)
-                            
-                            # 4. Aggregate
-                            status.write("📝 Step 4: Compiling Evidence Dossier...")
-                            result = aggregate_decisions(decisions, story_id)
-                            final_rationale = build_dossier(story_id, decisions, result["prediction"])
-                            
+                            analysis_cache[cache_key] = analysis
                             status.update(label="Analysis Complete!", state="complete", expanded=False)
-                            
-                            # --- Results Display ---
-                            st.divider()
-                            
-                            # Tabs for Organized View
-                            tab_verdict, tab_dossier, tab_raw = st.tabs(["🛡️ Final Verdict", "📂 Evidence Dossier (Track A)", "⚙️ Raw Data"])
-                            
-                            with tab_verdict:
-                                st.subheader("Consistency Judgment")
-                                if result['prediction'] == 1:
-                                    st.success("### ✅ Consistent")
-                                    st.markdown("The backstory aligns with the established narrative constraints.")
-                                else:
-                                    st.error("### ❌ Contradiction Detected")
-                                    st.markdown("The backstory conflicts with specific events in the narrative.")
-                                
-                                st.markdown("### Submission Rationale")
-                                st.info(final_rationale)
-                                
-                                # Download Button
-                                dossier_json = json.dumps(decisions, indent=2)
-                                st.download_button("📥 Download Dossier (JSON)", dossier_json, f"dossier_{story_id}.json")
-
-                            with tab_dossier:
-                                st.markdown("### 🧩 Claim Verification Audit")
-                                st.caption("Strict compliance with Section 5: Excerpt -> Linkage -> Analysis")
-                                
-                                for decision in decisions:
-                                    lbl = decision["label"]
-                                    confidence = decision["confidence"]
-                                    claim_txt = decision.get("claim_text", "Claim")
-                                    
-                                    # Card Styling
-                                    with st.container(border=True):
-                                        col1, col2 = st.columns([1, 4])
-                                        with col1:
-                                            if lbl == "SUPPORT":
-                                                st.metric("Verdict", "✅ VALID", f"{confidence*100:.0f}% Conf")
-                                            elif lbl == "CONTRADICT":
-                                                st.metric("Verdict", "❌ FALSE", f"{confidence*100:.0f}% Conf", delta_color="inverse")
-                                            else:
-                                                st.metric("Verdict", "❓ UNSURE", "Low Data", delta_color="off")
-                                        
-                                        with col2:
-                                            st.markdown(f"**Claim**: {claim_txt}")
-                                            st.markdown(f"**Analysis**: *{decision['analysis']}*")
-                                            
-                                        # Evidence Dropdown
-                                        with st.expander("📜 Primary Text Excerpts (Verbatim)"):
-                                            if not decision["evidence_entries"]:
-                                                st.caption("No direct retrieval matches found.")
-                                            for ev in decision["evidence_entries"]:
-                                                bg_color = "#e6ffe6" if lbl == "SUPPORT" else "#ffe6e6" if lbl == "CONTRADICT" else "#f0f2f6"
-                                                st.markdown(f"""
-                                                <div style="background-color: {bg_color}; padding: 10px; border-radius: 5px; border-left: 3px solid #ccc;">
-                                                    <small>FILE: {ev.get("story_id", "Unknown")}</small><br>
-                                                    <em>"...{ev['excerpt_text']}..."</em>
-                                                </div>
-                                                <br>
-                                                """, unsafe_allow_html=True)
-
-                            with tab_raw:
-                                st.json(decisions)
-
                     except Exception as e:
                         st.error(f"Pipeline Error: {e}")
                         status.update(label="Pipeline Crashed", state="error")
+                        analysis = None
+            elif analysis is not None:
+                st.caption("Showing cached analysis (same story, index and model version).")
+            
+            if analysis is not None:
+                decisions = analysis["decisions"]
+                result = analysis["result"]
+                final_rationale = analysis["rationale"]
+                
+                # --- Results Display ---
+                st.divider()
+                
+                # Tabs for Organized View
+                tab_verdict, tab_dossier, tab_raw = st.tabs(["🛡️ Final Verdict", "📂 Evidence Dossier (Track A)", "⚙️ Raw Data"])
+                
+                with tab_verdict:
+                    st.subheader("Consistency Judgment")
+                    if result['prediction'] == 1:
+                        st.success("### ✅ Consistent")
+                        st.markdown("The backstory aligns with the established narrative constraints.")
+                    else:
+                        st.error("### ❌ Contradiction Detected")
+                        st.markdown("The backstory conflicts with specific events in the narrative.")
+                    
+                    st.markdown("### Submission Rationale")
+                    st.info(final_rationale)
+                    
+                    # Download Button
+                    dossier_json = json.dumps(decisions, indent=2)
+                    st.download_button("📥 Download Dossier (JSON)", dossier_json, f"dossier_{story_id}.json")
+
+                with tab_dossier:
+                    st.markdown("### 🧩 Claim Verification Audit")
+                    st.caption("Strict compliance with Section 5: Excerpt -> Linkage -> Analysis")
+                    
+                    for decision in decisions:
+                        lbl = decision["label"]
+                        confidence = decision["confidence"]
+                        claim_txt = decision.get("claim_text", "Claim")
+                        
+                        # Card Styling
+                        with st.container(border=True):
+                            col1, col2 = st.columns([1, 4])
+                            with col1:
+                                if lbl == "SUPPORT":
+                                    st.metric("Verdict", "✅ VALID", f"{confidence*100:.0f}% Conf")
+                                elif lbl == "CONTRADICT":
+                                    st.metric("Verdict", "❌ FALSE", f"{confidence*100:.0f}% Conf", delta_color="inverse")
+                                else:
+                                    st.metric("Verdict", "❓ UNSURE", "Low Data", delta_color="off")
+                            
+                            with col2:
+                                st.markdown(f"**Claim**: {claim_txt}")
+                                st.markdown(f"**Analysis**: *{decision['analysis']}*")
+                                
+                            # Evidence Dropdown
+                            with st.expander("📜 Primary Text Excerpts (Verbatim)"):
+                                if not decision["evidence_entries"]:
+                                    st.caption("No direct retrieval matches found.")
+                                for ev in decision["evidence_entries"]:
+                                    bg_color = "#e6ffe6" if lbl == "SUPPORT" else "#ffe6e6" if lbl == "CONTRADICT" else "#f0f2f6"
+                                    st.markdown(f"""
+                                    <div style="background-color: {bg_color}; padding: 10px; border-radius: 5px; border-left: 3px solid #ccc;">
+                                        <small>FILE: {ev.get("story_id", "Unknown")}</small><br>
+                                        <em>"...{ev['excerpt_text']}..."</em>
+                                    </div>
+                                    <br>
+                                    """, unsafe_allow_html=True)
 
+                with tab_raw:
+                    st.json(decisions)
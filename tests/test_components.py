@@ -1,6 +1,8 @@
 
+import contextlib
+import importlib.util
+import tempfile
 import unittest
-from unittest.mock import MagicMock, patch
 import sys
 import os
 
@@ -8,7 +10,40 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from src.claim_extraction import extract_claims
-from src.aggregation import aggregate_decisions
+from src.aggregation import aggregate_decisions, aggregate_batch, decisions_to_columns
+from src.profiling import Profiler
+
+@contextlib.contextmanager
+def stub_pipeline():
+    """Runs the pipeline in-process: small local index, stub NLI model, temporary dossier store."""
+    from pathlib import Path
+    from src import dossier_store, nli_engine, retrieval
+    from src.benchmark import StubNLIModel
+    from src.chunk_index import ChunkIndex
+
+    class CountingModel(StubNLIModel):
+        calls = 0
+        pairs = 0
+        def predict(self, pairs):
+            self.calls += 1
+            self.pairs += len(pairs)
+            return super().predict(pairs)
+
+    index = ChunkIndex()
+    index.add_document("Faria was imprisoned in the Chateau d'If. Faria never left the island. " * 30, "monte.txt")
+    index.build()
+    previous = (retrieval._local_index, nli_engine._model_instance, dossier_store._store)
+    with tempfile.TemporaryDirectory() as tmp:
+        retrieval.use_local_index(index)
+        stub_pipeline.model = CountingModel()
+        nli_engine.set_nli_model(stub_pipeline.model)
+        dossier_store._store = dossier_store.DossierStore(Path(tmp) / "dossiers")
+        try:
+            yield tmp
+        finally:
+            retrieval.use_local_index(previous[0])
+            nli_engine.set_nli_model(previous[1])
+            dossier_store._store = previous[2]
 
 class TestComponents(unittest.TestCase):
     def test_aggregation_logic_consistent(self):
@@ -29,17 +64,624 @@ class TestComponents(unittest.TestCase):
         self.assertEqual(result["prediction"], 0)
         self.assertIn("Contradiction", result["rationale"])
 
-    @patch("src.claim_extraction.client")
-    def test_extract_claims(self, mock_client):
-        # Mock OpenAI response
-        mock_response = MagicMock()
-        mock_response.choices[0].message.content = '{"claims": [{"text": "Claim 1", "type": "event", "importance": "core"}]}'
-        mock_client.chat.completions.create.return_value = mock_response
-        
-        claims = extract_claims("Some backstory", "story_1")
-        self.assertEqual(len(claims), 1)
-        self.assertEqual(claims[0]["text"], "Claim 1")
-        self.assertEqual(claims[0]["id"], "story_1_c0")
+    def test_batch_aggregation_matches_per_story(self):
+        stories = [
+            [{"label": "SUPPORT", "confidence": 0.9}, {"label": "NONE", "confidence": 0.0}],
+            [{"label": "CONTRADICT", "confidence": 0.95}, {"label": "SUPPORT", "confidence": 0.4}],
+            [{"label": "CONTRADICT", "confidence": 0.6}, {"label": "SUPPORT", "confidence": 0.9}],
+            [{"label": "CONTRADICT", "confidence": 0.7}, {"label": "SUPPORT", "confidence": 2.0}],
+            [],
+        ]
+        batch = aggregate_batch(decisions_to_columns(stories))
+        for i, decisions in enumerate(stories):
+            expected = aggregate_decisions(decisions, str(i))["prediction"]
+            self.assertEqual(batch["prediction"][i], expected)
+
+    def test_profiler_story_stages_and_cache_rates(self):
+        profiler = Profiler()
+        with profiler.story("s1") as record:
+            with profiler.stage("retrieval"):
+                pass
+            profiler.count("nli.pairs_scored", 10)
+            profiler.cache("nli_model", hit=False)
+            profiler.cache("nli_model", hit=True)
+        summary = profiler.summary()
+        self.assertEqual(summary["stages"]["retrieval"]["count"], 1)
+        self.assertEqual(summary["cache_hit_rates"]["nli_model"], 0.5)
+        self.assertEqual(record["counters"]["nli.pairs_scored"], 10)
+        self.assertIn('stage="retrieval",le="+Inf"} 1', profiler.render_prometheus())
+        # Memory per stage stays bounded however many samples arrive
+        from src.profiling import RESERVOIR_SIZE
+        for i in range(3 * RESERVOIR_SIZE):
+            profiler.observe("nli", 0.002 if i % 2 else 0.2)
+        stats = profiler.summary()["stages"]["nli"]
+        self.assertEqual(len(profiler.durations["nli"].reservoir), RESERVOIR_SIZE)
+        self.assertEqual(stats["count"], 3 * RESERVOIR_SIZE)
+        self.assertEqual(dict(stats["histogram"])["0.005"], 3 * RESERVOIR_SIZE // 2)
+        self.assertEqual(stats["p95_seconds"], 0.2)
+
+    def test_extract_claims(self):
+        # Local sentence splitting (the LLM client it used to mock is gone)
+        claims = extract_claims("He sailed to Marseille in 1815. Short. He met Faria in prison!", "story_1")
+        self.assertEqual(len(claims), 2)
+        self.assertEqual(claims[0]["text"], "He sailed to Marseille in 1815.")
+        self.assertEqual(claims[0]["id"], "story_1_C0")
+        self.assertTrue(claims[0]["adversarial_queries"])
+
+        # Clause splitting, pronoun -> character, near-duplicate removal; batch path gives the same claims
+        import pandas as pd
+        from src.claim_extraction import extract_claims_frame
+        text = "His people faded as colonists advanced; he learned to track horses, while his mother died young. He learned to track horses."
+        claims = extract_claims(text, "s2", char="Thalcave")
+        self.assertEqual([c["text"] for c in claims], [
+            "Thalcave's people faded as colonists advanced",
+            "Thalcave learned to track horses",
+            "Thalcave's mother died young."])
+        frame = pd.DataFrame({"id": ["s2"], "char": ["Thalcave"], "content": [text]})
+        self.assertEqual(extract_claims_frame(frame)["s2"], claims)
+        self.assertEqual([c["importance"] for c in claims], ["core", "core", "core"])
+        # Claims that differ only by a number or date are kept apart
+        from src.claim_extraction import dedup_claims
+        self.assertEqual(len(dedup_claims(["Dantes was arrested at Marseille in the spring of 1814.",
+                                           "Dantes was arrested at Marseille in the spring of 1815."])), 2)
+        self.assertEqual(len(dedup_claims(["Dantes was arrested at Marseille in the spring of 1815.",
+                                           "Dantes was arrested at Marseille in the spring of 1815!"])), 1)
+
+        from src.claim_extraction import classify_claim
+        self.assertEqual(classify_claim("He often wore a red scarf."), ("event", "detail"))
+        self.assertEqual(classify_claim("She believed the captain was honest."), ("belief", "detail"))
+        self.assertEqual(classify_claim("He believed his father died in 1815."), ("belief", "core"))
+
+    def test_query_planner_collapses_and_diversifies(self):
+        from src.query_planner import collapse_equivalent, adversarial_queries, query_terms
+        legacy = ["He met Faria.", "it is false that He met Faria.", "contradiction: He met Faria."]
+        self.assertEqual(collapse_equivalent(legacy), ["He met Faria."])
+        queries = adversarial_queries("Dantes was arrested in 1815 by Villefort.")
+        self.assertIn("released", queries[0])
+        self.assertEqual(len({query_terms(q) for q in queries}), len(queries))
+
+    def test_dossier_store_roundtrip_dedups_excerpts(self):
+        import tempfile
+        from pathlib import Path
+        from src.dossier_store import DossierStore
+        entry = {"story_id": "7", "claim_id": "7_C0", "claim_text": "He sailed.", "chunk_id": "book.txt#0",
+                 "excerpt_text": "A long excerpt.", "relation": "SUPPORT", "analysis": "ok"}
+        with tempfile.TemporaryDirectory() as tmp:
+            store = DossierStore(Path(tmp))
+            store.write_story("7", [entry, {**entry, "claim_id": "7_C1"}], prediction=1)
+            store.write_story("8", [{**entry, "story_id": "8", "claim_id": "8_C0"}], prediction=0,
+                              verdicts={"8_C0": {"label": "CONTRADICT", "confidence": 0.9}})
+            store.close()
+            excerpt_keys = [k for k in store.index if k.startswith("excerpt:")]
+            self.assertEqual(len(excerpt_keys), 1)
+            # Same chunk id with different text (book re-chunked) gets its own excerpt
+            store.write_story("9", [{**entry, "story_id": "9", "claim_id": "9_C0", "excerpt_text": "Edited."}])
+            store.flush()
+            self.assertEqual(store.load_dossier("9")["dossier"][0]["excerpt_text"], "Edited.")
+            self.assertEqual(store.load_dossier("7")["dossier"][0]["excerpt_text"], "A long excerpt.")
+
+            reopened = DossierStore(Path(tmp))
+            dossier = reopened.load_dossier("7")
+            self.assertEqual(dossier["prediction"], 1)
+            self.assertEqual(dossier["dossier"][0]["excerpt_text"], "A long excerpt.")
+            self.assertEqual(dossier["dossier"][1]["claim_id"], "7_C1")
+            self.assertEqual(reopened.story_ids(), ["7", "8", "9"])
+            # Filtering/pagination runs on index summaries only
+            total, page = reopened.query_stories(prediction=0, min_confidence=0.5)
+            self.assertEqual(total, 1)
+            self.assertEqual(page[0]["story_id"], "8")
+            self.assertEqual(page[0]["contradictions"], 1)
+            self.assertEqual(reopened.query_stories(offset=1, limit=1)[1][0]["story_id"], "8")
+            self.assertEqual(reopened.story_claims("8")[0]["label"], "CONTRADICT")
+
+    def test_dossier_store_concurrent_writers_and_results_flush(self):
+        from pathlib import Path
+        from src.dossier_store import DossierStore
+        from src.results_sink import ResultsWriter
+        entry = {"claim_id": "1_C0", "claim_text": "He sailed.", "excerpt_text": "An excerpt.", "relation": "NONE"}
+        with tempfile.TemporaryDirectory() as tmp:
+            first, second = DossierStore(Path(tmp) / "store"), DossierStore(Path(tmp) / "store")
+            first.write_story("1", [entry], prediction=1)
+            second.write_story("2", [{**entry, "excerpt_text": "Another."}], prediction=0)
+            first.flush()
+            second.flush() # Appends after the first writer's records, not at a stale offset
+            writer = ResultsWriter(Path(tmp) / "results.csv", flush_every=1, before_flush=first.flush)
+            first.write_story("3", [entry], prediction=1)
+            writer.write("3", 1, "ok")
+            reopened = DossierStore(Path(tmp) / "store")
+            self.assertEqual(reopened.story_ids(), ["1", "2", "3"])
+            self.assertEqual(reopened.load_dossier("2")["dossier"][0]["excerpt_text"], "Another.")
+            self.assertEqual(reopened.load_dossier("1")["dossier"][0]["excerpt_text"], "An excerpt.")
+
+    def test_legacy_dossiers_import_with_verdicts(self):
+        from pathlib import Path
+        from src.config import DOSSIERS_DIR
+        from src.dossier_store import DossierStore, import_legacy_dossiers
+        with tempfile.TemporaryDirectory() as tmp:
+            store = DossierStore(Path(tmp))
+            n = import_legacy_dossiers(DOSSIERS_DIR, store)
+            self.assertEqual(n, len(list(DOSSIERS_DIR.glob("story_*_dossier.json"))))
+            self.assertEqual(import_legacy_dossiers(DOSSIERS_DIR, store), 0) # Already in the store
+            ids = store.story_ids()
+            self.assertEqual(ids, sorted(ids, key=int))
+            total, page = store.query_stories(prediction=0, min_confidence=0.5)
+            self.assertGreater(total, 0)
+            self.assertGreater(page[0]["contradictions"], 0)
+            labels = {c["label"] for c in store.story_claims(page[0]["story_id"])}
+            self.assertIn("CONTRADICT", labels)
+
+    def test_results_writer_resume_after_torn_row(self):
+        import csv
+        import tempfile
+        from pathlib import Path
+        from src.results_sink import ResultsWriter
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "results.csv"
+            with ResultsWriter(path, flush_every=2) as writer:
+                writer.write("1", 1, "ok, with comma")
+                writer.write("2", 0, "multi\nline")
+                writer.write("3", 1, "buffered")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write('4,0,"torn')  # Crash mid-row
+
+            writer = ResultsWriter(path)
+            self.assertEqual(writer.processed_ids, {"1", "2", "3"})
+            self.assertIn("3", writer)
+            writer.write("4", 0, "redone")
+            writer.close()
+            with open(path, newline="", encoding="utf-8") as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(rows[0], ["Story ID", "Prediction", "Rationale"])
+            self.assertEqual([r[0] for r in rows[1:]], ["1", "2", "3", "4"])
+
+            path.with_name("results.csv.ids").unlink()  # Rebuilt from the CSV
+            self.assertEqual(len(ResultsWriter(path)), 4)
+
+    def test_entry_points_import_lazily(self):
+        import subprocess
+        code = (
+            "import sys, time\n"
+            "start = time.perf_counter()\n"
+            "import src.run_all, src.evaluate_metrics, src.tuning\n"
+            "elapsed = time.perf_counter() - start\n"
+            "heavy = ('torch', 'pandas', 'pathway', 'streamlit', 'sentence_transformers', 'sklearn', 'requests')\n"
+            "print(elapsed, ','.join(m for m in heavy if m in sys.modules))\n"
+        )
+        root = os.path.join(os.path.dirname(__file__), '..')
+        out = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        elapsed, _, loaded = out.stdout.strip().partition(" ")
+        self.assertEqual(loaded, "")
+        self.assertLess(float(elapsed), 1.0)
+
+    def test_benchmark_smoke(self):
+        from src.benchmark import run_benchmark, find_regressions
+        report = run_benchmark(n_novels=1, n_claims=10, chars_per_novel=20_000)
+        for stage in ("indexing", "extraction", "retrieval", "nli", "aggregation"):
+            self.assertIn(stage, report["stages"])
+        self.assertEqual(report["stages"]["retrieval"]["items"], 10)
+        self.assertGreater(report["stages"]["nli"]["pairs_scored"], 0)
+        self.assertEqual(find_regressions(report, report), [])
+
+    def test_analyzer_folds_accents_and_index_matches_them(self):
+        from src.text_analyzer import analyze
+        from src.chunk_index import ChunkIndex
+        self.assertEqual(analyze("Dantès, the Abbé's prisoners!"), ["dante", "abbe", "prisoner"])
+        self.assertEqual(analyze("Château d'If"), ["chateau", "d", "if"])
+        index = ChunkIndex()
+        index.add_document("Edmond Dantès was thrown into the Château d'If.", "monte.txt")
+        index.add_document("The ship sailed for Patagonia.", "castaways.txt")
+        index.build()
+        self.assertEqual(index.search("dantes chateau", k=1)[0]["metadata"]["file"], "monte.txt")
+
+        # Exact multi-word names outrank the same terms scattered across a chunk
+        index = ChunkIndex()
+        index.add_document("Monte the dog and a man named Cristo met the count.", "scattered.txt")
+        index.add_document("The Count of Monte Cristo sat down to dinner.", "phrase.txt")
+        index.build()
+        self.assertEqual(index.search("the Count of Monte Cristo", k=1)[0]["metadata"]["file"], "phrase.txt")
+
+        index = ChunkIndex()
+        index.add_document("The prisoners of the Château were moved. If only d'Artagnan knew.", "scattered.txt")
+        index.add_document("He escaped from the Château d'If at night.", "phrase.txt")
+        index.build()
+        self.assertEqual(index.search("Château d'If", k=1)[0]["metadata"]["file"], "phrase.txt")
+
+    def test_fact_table_resolves_dated_claims(self):
+        from src.fact_table import FactTable
+        table = FactTable()
+        table.add_text("In 1815 Dantes was arrested at Marseilles. Mercedes waited for fourteen years. "
+                       "Dantes loved Mercedes. During two years the crew waited at the port. "
+                       "Glenarvan spent two years at sea.", "monte.txt")
+        self.assertEqual(table.check_claim("Dantes was arrested in 1815.", "monte.txt")["label"], "SUPPORT")
+        self.assertEqual(table.check_claim("Dantes was arrested in 1820.", "monte.txt")["label"], "CONTRADICT")
+        self.assertEqual(table.check_claim("She waited for fourteen years.", "monte.txt", "Mercedes")["label"],
+                         "SUPPORT")
+        self.assertIsNone(table.check_claim("Dantes married Mercedes in 1820.", "monte.txt"))
+        # Other novel, sentence-initial non-entity, shared unit word without a shared event verb
+        self.assertIsNone(table.check_claim("Dantes was arrested in 1820.", "castaways.txt"))
+        self.assertIsNone(table.check_claim("During twenty years he waited in one cell.", "monte.txt"))
+        self.assertIsNone(table.check_claim("As a boy he was rescued by Glenarvan, who returned twenty years later.",
+                                            "monte.txt"))
+
+        # A sentence cut by the chunk windows (starts before the overlap, ends in the next chunk)
+        from src.chunk_index import ChunkIndex
+        from src.fact_table import FactTable as Table
+        filler = "The sea was calm. " * 40
+        sentence = "At dawn Dantes was arrested on the quay " + "and led away through the crowd " * 10 + "in 1815. "
+        index = ChunkIndex()
+        index.add_document(filler + sentence + filler, "monte.txt")
+        self.assertLess(len(filler), 800)
+        self.assertGreater(len(filler) + len(sentence), 1000)
+        stitched = Table.from_index(index)
+        self.assertEqual(stitched.check_claim("Dantes was arrested in 1815.", "monte.txt")["label"], "SUPPORT")
+        self.assertEqual(stitched.lookup("Dantes", "year")[0].char_offset, len(filler))
+
+    def test_premise_token_cache_roundtrip(self):
+        import tempfile
+        from pathlib import Path
+        from src.chunk_index import chunk_text
+        from src.token_cache import load_or_build
+
+        class WordTokenizer:
+            name_or_path = "words"
+            def __len__(self):
+                return 100
+            def __call__(self, texts, add_special_tokens=False):
+                return {"input_ids": [[len(w) for w in t.split()] for t in texts]}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            novels, cache_dir = Path(tmp) / "novels", Path(tmp) / "cache"
+            novels.mkdir()
+            (novels / "book.txt").write_text("The abbe dug a tunnel. " * 100, encoding="utf-8")
+            built = load_or_build(WordTokenizer(), novels, cache_dir)
+            loaded = load_or_build(WordTokenizer(), novels, cache_dir)
+            self.assertEqual(len(list(cache_dir.glob("*.npz"))), 1)
+            chunks = dict(chunk_text((novels / "book.txt").read_text(encoding="utf-8")))
+            self.assertEqual(loaded.get("book.txt#800", chunks[800]).tolist(),
+                             built.get("book.txt#800", chunks[800]).tolist())
+            self.assertEqual(loaded.get("book.txt#0", chunks[0])[:3].tolist(), [3, 4, 3])
+            # Same chunk id, different text (re-chunked or edited novel): not used
+            self.assertIsNone(loaded.get("book.txt#0", chunks[800]))
+
+    @unittest.skipUnless(importlib.util.find_spec("transformers") and importlib.util.find_spec("torch"),
+                         "needs transformers and torch")
+    def test_predict_cached_matches_model_predict(self):
+        import numpy as np
+        import torch
+        from pathlib import Path
+        from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+        from src import nli_engine
+        from src.token_cache import PremiseTokenCache
+
+        class TinyCrossEncoder:
+            """CrossEncoder-like wrapper around a randomly initialized tiny BERT."""
+            def __init__(self, tokenizer):
+                torch.manual_seed(0)
+                self.tokenizer = tokenizer
+                self.max_length = 64
+                self.model = BertForSequenceClassification(BertConfig(
+                    vocab_size=tokenizer.vocab_size, hidden_size=16, num_hidden_layers=1,
+                    num_attention_heads=2, intermediate_size=32, num_labels=3)).eval()
+            def predict(self, pairs):
+                batch = self.tokenizer([p for p, _ in pairs], [c for _, c in pairs], padding=True,
+                                       truncation="only_first", max_length=self.max_length, return_tensors="pt")
+                with torch.no_grad():
+                    return self.model(**batch).logits.numpy()
+
+        words = "the abbe dug a tunnel faria was imprisoned in chateau d if dantes escaped".split()
+        with tempfile.TemporaryDirectory() as tmp:
+            vocab = Path(tmp) / "vocab.txt"
+            vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words), encoding="utf-8")
+            model = TinyCrossEncoder(BertTokenizerFast(vocab_file=str(vocab)))
+        premises = ["the abbe dug a tunnel", "faria was imprisoned in the chateau d if"]
+        pairs = [(premises[0], "dantes escaped"), (premises[1], "faria dug a tunnel"), (premises[0], "faria was")]
+        cache = PremiseTokenCache("tiny")
+        cache.add_chunks(model.tokenizer, [("b#0", premises[0]), ("b#1", "stale text at this offset")])
+        previous = nli_engine._token_cache
+        nli_engine.use_token_cache(cache)
+        try:
+            logits = nli_engine._predict(model, pairs, ["b#0", "b#1", "b#0"])
+        finally:
+            nli_engine.use_token_cache(previous)
+        np.testing.assert_allclose(logits, model.predict(pairs), atol=1e-5)
+
+    def test_deepening_widens_k_within_book(self):
+        from src.chunk_index import ChunkIndex
+        from src import retrieval
+        index = ChunkIndex()
+        index.add_document("Faria was imprisoned in the Chateau d'If. " * 60, "monte.txt")
+        index.add_document("Faria sailed to Patagonia with Glenarvan. " * 60, "castaways.txt")
+        index.build()
+        hits = index.search("Faria imprisoned", k=50, file_glob="castaways.txt")
+        self.assertTrue(hits)
+        self.assertTrue(all(h["metadata"]["file"] == "castaways.txt" for h in hits))
+
+        claim = {"id": "1_C0", "story_id": "1", "text": "Faria was imprisoned for life.", "adversarial_queries": []}
+        previous = retrieval._local_index
+        retrieval.use_local_index(index)
+        try:
+            first = retrieval.retrieve_evidence(claim, "1", k=2)
+            deeper = retrieval.deepen_evidence(claim, "1", iteration=1, k=2, book_file="monte.txt")
+        finally:
+            retrieval.use_local_index(previous)
+        self.assertLessEqual(len(first), 2)
+        self.assertGreater(len(deeper), len(first))
+        self.assertTrue(all(e["metadata"]["file"] == "monte.txt" for e in deeper))
+
+    def test_nli_worker_pool_preserves_order(self):
+        from src.benchmark import StubNLIModel
+        from src.nli_pool import NLIWorkerPool
+        pairs = [(f"word{i} not here", f"word{i} claim") for i in range(21)]
+        pool = NLIWorkerPool(2, 1, StubNLIModel)
+        try:
+            logits = pool.predict(pairs)
+        finally:
+            pool.close()
+        self.assertEqual(logits.tolist(), StubNLIModel().predict(pairs).tolist())
+        # Untuned hosts get a small layout that fits in free memory
+        from src.nli_pool import default_layout
+        self.assertEqual(default_layout(8, available_mb=64000), (2, 4))
+        self.assertEqual(default_layout(8, available_mb=2000), (2, 4))
+        self.assertEqual(default_layout(8, available_mb=1500), (1, 8))
+
+    def test_nli_server_coalesces_concurrent_requests(self):
+        import threading
+        import requests
+        from src.benchmark import StubNLIModel
+        from src.nli_server import BatchCoalescer, RemoteNLIModel, make_server
+        from src.profiling import PROFILER
+        coalescer = BatchCoalescer(StubNLIModel(latency_ms=2.0), max_pairs=64, max_wait_ms=50)
+        server = make_server(coalescer, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = RemoteNLIModel(f"http://127.0.0.1:{server.server_address[1]}")
+        requests_ = [[(f"word{i} never", f"word{i} claim {j}") for j in range(3)] for i in range(8)]
+        results = [None] * len(requests_)
+        before = PROFILER.counters.get("nli_server.batches", 0)
+
+        def call(i):
+            results[i] = client.predict(requests_[i])
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(len(requests_))]
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            # chunk_ids must line up with the pairs
+            with self.assertRaises(requests.HTTPError) as ctx:
+                client.predict(requests_[0], chunk_ids=["monte.txt#0"])
+            self.assertEqual(ctx.exception.response.status_code, 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+        for pairs, logits in zip(requests_, results):
+            self.assertEqual(logits.tolist(), StubNLIModel().predict(pairs).tolist())
+        self.assertLess(PROFILER.counters.get("nli_server.batches", 0) - before, len(requests_))
+
+    def test_stage_cache_recomputes_only_changed_stages(self):
+        from pathlib import Path
+        from src.pipeline import analyze_story
+        from src.stage_cache import StageCache, STAGES
+        with stub_pipeline() as tmp:
+            fingerprints = {stage: "v1" for stage in STAGES}
+            run = lambda: analyze_story("1", "Faria was imprisoned on the island.",
+                                        stage_cache=StageCache(Path(tmp) / "stages", dict(fingerprints)))
+            first = run()
+            second = run()
+            fingerprints["aggregate"] = "v2" # e.g. a threshold change
+            third = run()
+        self.assertEqual(first["recomputed"], {"claims", "retrieval", "nli", "aggregate"})
+        self.assertEqual(second["recomputed"], set())
+        self.assertEqual(third["recomputed"], {"aggregate"})
+        self.assertEqual(second["result"]["prediction"], first["result"]["prediction"])
+        self.assertEqual(third["rationale"], first["rationale"])
+
+    def test_stage_cache_rescores_only_changed_claims(self):
+        from pathlib import Path
+        from src import dossier_store
+        from src.pipeline import analyze_story
+        from src.stage_cache import StageCache, STAGES
+        story = "Faria was imprisoned on the island. Faria never left the island."
+        with stub_pipeline() as tmp:
+            cache = StageCache(Path(tmp) / "stages", {stage: "v1" for stage in STAGES})
+            analyze_story("1", story, stage_cache=cache)
+            model = stub_pipeline.model
+            calls, pairs = model.calls, model.pairs
+            changed = analyze_story("1", story.replace("never left", "was a priest on"), stage_cache=cache)
+            self.assertEqual(model.calls - calls, 1)
+            self.assertEqual(model.pairs - pairs, len(changed["decisions"][1]["evidence_entries"]))
+            # A cache hit still writes the dossier into a store that lacks the story
+            dossier_store._store = dossier_store.DossierStore(Path(tmp) / "fresh")
+            cached = analyze_story("1", story, stage_cache=cache)
+            self.assertEqual(cached["recomputed"], set())
+            self.assertTrue(dossier_store._store.has_story("1"))
+
+    def test_failed_retrieval_is_not_cached(self):
+        from pathlib import Path
+        from unittest import mock
+        import requests
+        from src import retrieval
+        from src.pipeline import analyze_story
+        from src.stage_cache import StageCache, STAGES
+        with stub_pipeline() as tmp:
+            cache = StageCache(Path(tmp) / "stages", {stage: "v1" for stage in STAGES})
+            retrieval.use_local_index(None)
+            with mock.patch.object(requests, "post", return_value=mock.Mock(status_code=503)):
+                with self.assertRaises(retrieval.RetrievalError):
+                    analyze_story("1", "Faria was imprisoned on the island.", stage_cache=cache)
+            self.assertFalse((Path(tmp) / "stages" / "retrieval").exists())
+
+    def test_early_exit_stops_at_first_core_contradiction(self):
+        from src import nli_engine
+        from src.benchmark import StubNLIModel
+        from src.pipeline import analyze_story, contradiction_prior, EARLY_EXIT_BATCH_CLAIMS
+
+        class DatedContradictionModel(StubNLIModel):
+            """Stub that strongly contradicts every claim mentioning 1815."""
+            def predict(self, pairs):
+                logits = super().predict(pairs)
+                for i, (_, claim) in enumerate(pairs):
+                    if "1815" in claim:
+                        logits[i] = [8.0, 0.0, 0.0]
+                return logits
+
+        story = ("Faria often wore a red scarf. Faria was a priest in Rome. Faria was imprisoned on the island. "
+                 "Faria taught Dantes history. Faria dug a long tunnel. Faria wrote a treatise on Italy. "
+                 "Faria never left the island after 1815.")
+        from pathlib import Path
+        from src.stage_cache import StageCache, STAGES
+        with stub_pipeline() as tmp:
+            nli_engine.set_nli_model(DatedContradictionModel())
+            cache = StageCache(Path(tmp) / "stages", {stage: "v1" for stage in STAGES})
+            events = []
+            analysis = analyze_story("9", story, lambda event, payload: events.append((event, payload)),
+                                     early_exit=True, stage_cache=cache)
+            rerun = analyze_story("9", story, early_exit=True, stage_cache=cache)
+        claims = analysis["claims"]
+        decided = [payload[1]["claim_id"] for event, payload in events if event == "decision"]
+        # Most-likely-contradicted first, and only the first batch is scored
+        ordered = [c["id"] for c in sorted(claims, key=contradiction_prior, reverse=True)]
+        self.assertEqual(decided, ordered[:EARLY_EXIT_BATCH_CLAIMS])
+        # Progress names each claim by its position in the claim list; the rest is reported skipped
+        for event, payload in events:
+            if event == "decision":
+                self.assertEqual(claims[payload[0]]["id"], payload[1]["claim_id"])
+        skipped = [payload for event, payload in events if event == "skipped"]
+        self.assertEqual([c["id"] for c in skipped[0]], ordered[EARLY_EXIT_BATCH_CLAIMS:])
+        self.assertEqual(analysis["recomputed"], {"claims", "retrieval", "nli", "aggregate"})
+        self.assertEqual(rerun["recomputed"], set())
+        self.assertEqual(rerun["rationale"], analysis["rationale"])
+        self.assertEqual(decided[0], claims[-1]["id"])
+        self.assertEqual(analysis["result"]["prediction"], 0)
+        self.assertEqual(analysis["result"]["decisive_claim_id"], claims[-1]["id"])
+        self.assertTrue(analysis["rationale"].startswith(f"[Claim]: {claims[-1]['text']}"))
+
+    def test_inconclusive_nli_triggers_deepening(self):
+        from src.reasoning_llm import is_inconclusive
+        entry = [{"relation": "NONE"}]
+        # NLI label NONE: neither threshold passed, whatever the default confidence
+        self.assertTrue(is_inconclusive({"probabilities": [[0.5, 0.3, 0.2]], "evidence_entries": entry}, 0.2))
+        self.assertFalse(is_inconclusive({"probabilities": [[0.9, 0.05, 0.05]], "evidence_entries": entry}, 0.2))
+        # Conflicting excerpts: strong contradiction and strong entailment
+        self.assertTrue(is_inconclusive({"probabilities": [[0.85, 0.1, 0.05], [0.05, 0.9, 0.05]],
+                                         "evidence_entries": entry * 2}, 0.2))
+        self.assertTrue(is_inconclusive({"probabilities": [], "evidence_entries": []}, 0.2)) # No evidence
+        # NLI failed on the excerpts: unsettled; fact-table decisions carry no probabilities but are settled
+        self.assertTrue(is_inconclusive({"probabilities": [], "evidence_entries": entry,
+                                         "source": "Heuristic-Default"}, 0.2))
+        self.assertFalse(is_inconclusive({"probabilities": [], "evidence_entries": entry,
+                                          "source": "Fact-Table"}, 0.2))
+
+    @unittest.skipUnless(importlib.util.find_spec("langgraph"), "needs langgraph")
+    def test_agent_deepens_only_inconclusive_claims(self):
+        from src.config import ADAPTIVE_MAX_ITERATIONS
+        from src.langgraph_agent import run_agentic_story
+        from src.profiling import PROFILER
+        with stub_pipeline():
+            claims = extract_claims("Faria was imprisoned in the Chateau d'If. Faria was a priest.", "1")
+            before = PROFILER.counters.get("agent.deepened_claims", 0)
+            state = run_agentic_story("1", claims, budget=8)
+        # The stub entails the first claim; the second stays NLI-inconclusive every round
+        self.assertEqual(PROFILER.counters.get("agent.deepened_claims", 0) - before, ADAPTIVE_MAX_ITERATIONS)
+        self.assertEqual(state["iteration"], ADAPTIVE_MAX_ITERATIONS)
+        self.assertEqual(state["budget"], 8 - ADAPTIVE_MAX_ITERATIONS)
+        self.assertEqual(len(state["decisions"]), 2)
+        # Wired into the pipeline behind AGENTIC_REASONING
+        from src.pipeline import analyze_story
+        with stub_pipeline():
+            analysis = analyze_story("1", "Faria was imprisoned in the Chateau d'If. Faria was a priest.",
+                                     agentic=True)
+        self.assertEqual([d["claim_id"] for d in analysis["decisions"]], [c["id"] for c in analysis["claims"]])
+        self.assertIn("nli", analysis["recomputed"])
+
+    def test_analyze_story_scores_all_claims_in_one_batch(self):
+        from src.pipeline import analyze_story
+        with stub_pipeline():
+            model = stub_pipeline.model
+            analysis = analyze_story("1", "Faria was imprisoned on the island. Faria never left the island. "
+                                          "Faria was a priest.")
+        self.assertEqual(len(analysis["decisions"]), 3)
+        self.assertEqual(model.calls, 1)
+
+    def test_tuning_replay_matches_pipeline_decisions(self):
+        from pathlib import Path
+        from src.aggregation import aggregate_decisions
+        from src.reasoning_llm import decide_claims
+        from src.tuning import new_columns, append_story, save_columns, load_nli_cache, replay
+
+        def claim(story_id, i, importance="core"):
+            return {"id": f"{story_id}_C{i}", "story_id": story_id, "text": "Faria escaped.",
+                    "importance": importance, "type": "event"}
+        contra, entail = [[0.95, 0.02, 0.03]], [[0.02, 0.95, 0.03]]
+        symbolic = {"symbolic": {"claim_id": "c_C0", "story_id": "c", "label": "CONTRADICT",
+                                 "confidence": 0.75, "importance": "core", "type": "event"}}
+        stories = [
+            # Strong contradiction of a detail claim: no core override
+            ("a", [claim("a", 0, "detail"), claim("a", 1), claim("a", 2)],
+             {"a_C0": {"probabilities": contra}, "a_C1": {"probabilities": entail},
+              "a_C2": {"probabilities": entail}}),
+            ("b", [claim("b", 0), claim("b", 1)], {"b_C0": {"probabilities": contra},
+                                                   "b_C1": {"probabilities": entail}}),
+            ("c", [claim("c", 0), claim("c", 1)], {"c_C0": symbolic}),
+        ]
+        columns = new_columns()
+        expected = []
+        for story_id, claims, scores in stories:
+            evidence_map = {c["id"]: [{"text": "x", "metadata": {}}] for c in claims if c["id"] in scores}
+            decisions = decide_claims(claims, evidence_map, scores)
+            expected.append(aggregate_decisions(decisions, story_id)["prediction"])
+            append_story(columns, story_id, 1, claims, scores)
+        with tempfile.TemporaryDirectory() as tmp:
+            save_columns(columns, Path(tmp) / "nli.npz")
+            cache = load_nli_cache(Path(tmp) / "nli.npz")
+        self.assertEqual(replay(cache, {}).tolist(), expected)
+        self.assertEqual(expected, [1, 0, 0])
+
+    def test_dataflow_merges_hits_of_all_claim_queries(self):
+        from src.pathway_dataflow import claim_queries, merge_hits
+        claim = {"id": "1_C0", "text": "Faria was imprisoned in 1815.", "importance": "core",
+                 "adversarial_queries": ["It is false that Faria was imprisoned in 1815.", "Faria freed 1815"]}
+        self.assertEqual([q["query"] for q in claim_queries(claim)],
+                         ["Faria was imprisoned in 1815.", "Faria freed 1815"])
+        self.assertEqual(len(claim_queries({**claim, "importance": "detail"})), 1)
+        hit = {"text": "Faria was imprisoned in the Chateau d'If.", "dist": -3.0, "metadata": {"path": "monte.txt"}}
+        other = {"text": "Faria was freed.", "dist": -1.0, "metadata": {"path": "monte.txt"}}
+        evidence = merge_hits(claim, [[hit, other], [hit]])
+        self.assertEqual(len(evidence), 2)
+        self.assertEqual({e["metadata"]["path"] for e in evidence}, {"monte.txt"})
+
+    def test_dataflow_sink_records_updates_once_per_time_step(self):
+        import csv
+        from pathlib import Path
+        from src.dossier_store import DossierStore
+        from src.pathway_dataflow import VerdictSink, story_verdict
+        from src.results_sink import ResultsWriter
+
+        def decision(label, confidence):
+            entry = {"story_id": "5", "claim_id": "5_C0", "claim_text": "Faria escaped.",
+                     "excerpt_text": "Faria died in his cell.", "relation": label, "analysis": "NLI"}
+            return {"claim_id": "5_C0", "story_id": "5", "label": label, "confidence": confidence,
+                    "analysis": "NLI", "evidence_entries": [entry], "importance": "core", "type": "event",
+                    "position": 0}
+
+        supported, contradicted = story_verdict("5", [decision("SUPPORT", 0.9)]), \
+            story_verdict("5", [decision("CONTRADICT", 0.95)])
+        with tempfile.TemporaryDirectory() as tmp:
+            store = DossierStore(Path(tmp) / "store")
+            writer = ResultsWriter(Path(tmp) / "results.csv", before_flush=store.flush)
+            sink = VerdictSink(writer, store)
+            sink.on_change("k", {"story_id": "5", "verdict": supported}, 2, True)
+            sink.on_time_end(2)
+            self.assertEqual(store.load_dossier("5")["prediction"], 1)
+            # An update: the new row may arrive before the retraction of the old one
+            sink.on_change("k", {"story_id": "5", "verdict": contradicted}, 4, True)
+            sink.on_change("k", {"story_id": "5", "verdict": supported}, 4, False)
+            sink.on_time_end(4)
+            sink.on_time_end(6) # Nothing changed: nothing written
+            sink.on_end()
+            with open(Path(tmp) / "results.csv", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual([r["Prediction"] for r in rows], ["1", "0"])
+            self.assertEqual(DossierStore(Path(tmp) / "store").load_dossier("5")["prediction"], 0)
 
 if __name__ == '__main__':
     unittest.main()